@@ -0,0 +1,260 @@
+import asyncio
+import selectors
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import FPJ_CLOCK
+import FPJ_RELAY
+import FPJ_STEPWORKER
+from FPJ_PROFILER import profiler
+
+SWITCH_POLL: float = 0.05  # Seconds between limit switch reads while waiting
+DISPLAY_INTERVAL: float = 1.0  # Seconds between LCD updates while a dispenser runs or the slider moves
+
+# Blocking driver calls (stepper pulse trains, serial round trips) run here
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fpj-async")
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    """
+    Selector for an event loop on the virtual clock.
+
+    Instead of blocking until the next timer is due, the loop thread idles as
+    a virtual clock participant, so time jumps straight to the next timer once
+    every worker thread is asleep too. Ready I/O (a worker handing back its
+    result) ends the idle early.
+    """
+
+    def _ready(self) -> bool:
+        return bool(selectors.DefaultSelector.select(self, 0))
+
+    def select(self, timeout: Optional[float] = None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        FPJ_CLOCK.clock.idle(timeout, self._ready)
+        return super().select(0)
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """Event loop whose timers (asyncio.sleep, call_later) run on the virtual clock."""
+
+    def __init__(self) -> None:
+        super().__init__(VirtualTimeSelector())
+
+    def time(self) -> float:
+        return FPJ_CLOCK.monotonic()
+
+
+def _resolve(future: asyncio.Future, result, error: Optional[BaseException]) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def run_blocking(func: Callable, *args):
+    """Runs a blocking driver call in a worker thread and waits for it without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    loop_thread = threading.get_ident()
+    clock = FPJ_CLOCK.clock
+    virtual = isinstance(clock, FPJ_CLOCK.VirtualClock)
+    if virtual:
+        clock.expect()
+
+    def call() -> None:
+        with FPJ_CLOCK.participant(expected=virtual):
+            try:
+                with profiler.worker():  # Pool threads are reused; none may carry a phase into its next call
+                    result = func(*args)
+                loop.call_soon_threadsafe(_resolve, future, result, None)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_resolve, future, None, e)
+            if virtual:
+                clock.wake(loop_thread)  # Collect the result before time moves on
+
+    executor.submit(call)
+    return await future
+
+
+def run(coroutine):
+    """Runs a coroutine to completion on an event loop matching the active clock."""
+    loop = VirtualTimeEventLoop() if FPJ_CLOCK.is_virtual() else asyncio.new_event_loop()
+    try:
+        with FPJ_CLOCK.participant():
+            return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncMachine:
+    """
+    Runs the batch with the machine's slow operations as coroutines.
+
+    It stands in for main in FPJ_STATE's state machine, which runs in a
+    worker thread: dispenser pulses, slider moves and mixer travel are handed
+    to the event loop, where a display task runs beside each of them. The
+    scale is read and the LCD updated while a dispenser runs, and the slider's
+    progress is shown while it moves. Sub-steps the state machine marks as
+    independent overlap, e.g. the mixer rises while the sealer cover lifts.
+    Everything else is main's own.
+    """
+
+    def __init__(self, main) -> None:
+        self.main = main
+        self.controller = main.controller
+        self.limits = FPJ_RELAY.LimitSwitch
+        self.dispensers = {
+            "kakawate": self.controller.KakawateRelay,
+            "neem": self.controller.NeemRelay,
+            "water": self.controller.WaterPumpRelay,
+        }
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __getattr__(self, name: str):
+        return getattr(self.main, name)
+
+    # === Primitives ===
+    # Scale requests are tagged and thread-safe, so concurrent callers pipeline instead of queueing
+    async def get_weight(self) -> int:
+        return await run_blocking(self.main.scale.get_weight)
+
+    async def wait_for(self, condition: Callable[[], bool], timeout: Optional[float] = None, poll: float = SWITCH_POLL) -> None:
+        """Waits until condition() (usually a limit switch) is true."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not condition():
+            if deadline is not None and loop.time() >= deadline:
+                raise TimeoutError(f"Timed out waiting for {getattr(condition, '__name__', 'condition')}")
+            await asyncio.sleep(poll)
+
+    async def relay_run(self, relay: FPJ_RELAY.Relay, on_time: float, until=None, cooldown: float = 3.0) -> None:
+        """Async Relay.run: the relay stays on for on_time, or until the blocking wait until(on_time) returns."""
+        relay.turn_on()
+        print(f"{relay.name} is turned ON.")
+        try:
+            with profiler.wait("relay_on"):
+                if until:
+                    await run_blocking(until, on_time)
+                else:
+                    await asyncio.sleep(on_time)
+        finally:
+            relay.turn_off()
+            print(f"{relay.name} is turned OFF.")
+        with profiler.wait("relay_cooldown"):
+            await asyncio.sleep(cooldown)
+
+    async def move_mixer(self, down: bool) -> None:
+        """Drives the mixer to its lower or upper limit switch."""
+        relay = self.controller.MixerDownRelay if down else self.controller.MixerUpRelay
+        relay.turn_on()
+        try:
+            with profiler.wait("mixer_travel"):
+                await self.wait_for(self.limits.is_mixer_down if down else self.limits.is_mixer_up)
+        finally:
+            relay.turn_off()
+        print(f"Mixer reached {'down' if down else 'up'} position.")
+        with profiler.wait("mixer_settle"):
+            await asyncio.sleep(3)
+
+    async def move(self, func: Callable, *args):
+        """Runs a stepper move (or any blocking motion) without blocking the loop."""
+        return await run_blocking(func, *args)
+
+    async def beside(self, work, display):
+        """Awaits work while the display coroutine runs next to it."""
+        task = asyncio.ensure_future(display)
+        try:
+            return await work
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    # === Displays ===
+    async def show_weight(self, ingredient) -> None:
+        """Keeps an ingredient's LCD line at the scale's weight."""
+        while True:
+            await asyncio.sleep(DISPLAY_INTERVAL)
+            self.main.display_ingredient_weight(ingredient, await self.get_weight())
+
+    async def show_steps(self) -> None:
+        """Shows the running stepper move's step count under the activity."""
+        worker = FPJ_STEPWORKER.get_worker()
+        if worker is None:
+            return  # Inline moves have no progress to show
+        while True:
+            await asyncio.sleep(DISPLAY_INTERVAL)
+            self.main.lcd.lcd1.display(line4=f"{worker.progress()['steps']} STEPS")
+
+    # === main, as the state machine sees it (called from its worker) ===
+    def call(self, coroutine):
+        """Runs a coroutine on the loop and waits for its result."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if FPJ_CLOCK.is_virtual():
+            FPJ_CLOCK.clock.idle(None, future.done)  # Lets time run for the coroutine meanwhile
+        return future.result()
+
+    def add_ingredient(self, ingredient, tare: bool = True, progress_func=None) -> None:
+        relay = self.dispensers.get(ingredient.actuator)
+        if relay is None:
+            self.main.add_ingredient(ingredient, tare=tare, progress_func=progress_func)
+            return
+
+        def pulse(on_time: float, until=None) -> None:
+            self.call(self.beside(self.relay_run(relay, on_time, until), self.show_weight(ingredient)))
+
+        self.main.add_ingredient(ingredient, tare=tare, progress_func=progress_func, dispense_func=pulse)
+
+    def move_to_mixer(self) -> None:
+        self.call(self.beside(self.move(self.main.move_to_mixer), self.show_steps()))
+
+    def move_to_sealer(self) -> None:
+        self.call(self.beside(self.move(self.main.move_to_sealer), self.show_steps()))
+
+    def lower_mixer(self) -> None:
+        self.main.show_activity(7)
+        self.call(self.move_mixer(down=True))
+
+    def raise_mixer(self) -> None:
+        self.main.show_activity(9)
+        self.call(self.move_mixer(down=False))
+
+    async def gather(self, actions) -> None:
+        await asyncio.gather(*(run_blocking(action) for action in actions))
+
+    def together(self, actions) -> None:
+        """BatchStateMachine hook: runs independent sub-steps side by side."""
+        self.call(self.gather(actions))
+
+    # === Batch ===
+    async def run_batch(self) -> None:
+        """Runs the batch state machine in a worker, resuming from its checkpoint."""
+        from FPJ_STATE import BatchStateMachine
+
+        self.loop = asyncio.get_running_loop()
+        machine = BatchStateMachine(self, together=self.together)
+        await run_blocking(machine.run)
+
+
+# Usage:
+#   python3 FPJ_ASYNC.py        run one batch with the async runtime (same JSON state as main.py)
+if __name__ == "__main__":
+    import main
+
+    completed = False
+    try:
+        main.profiler.start_batch()
+        main.start_up()
+        run(AsyncMachine(main).run_batch())
+        completed = True
+    except KeyboardInterrupt:
+        print("\n[INTERRUPT] KeyboardInterrupt detected! Turning off all relays...")
+    finally:
+        main.controller.shutdown(force=not completed)
+        main.profiler.end_batch(completed)
+        main.profiler.report()
+        main.FPJ_TRACE.close()
+        print("[SYSTEM] System safely shut down.")
@@ -0,0 +1,266 @@
+import os
+
+# The benchmark always runs against the simulator on the virtual clock; both are
+# chosen when FPJ_PCF and FPJ_CLOCK are first imported, so set them up front.
+os.environ.setdefault("FPJ_BACKEND", "sim")
+os.environ.setdefault("FPJ_CLOCK", "virtual")
+os.environ.setdefault("FPJ_CALIBRATION", "")  # Default stepper speeds, whatever this host calibrated
+
+import contextlib
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+BASELINE_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FPJ_BENCHMARK_BASELINE.json")
+
+# Allowed relative slowdown before a metric counts as a regression.
+# Machine time, iteration counts and cutoff errors are deterministic on the simulator.
+DEFAULT_TOLERANCES: Dict[str, float] = {
+    "machine_s": 0.02,
+    "count": 0.0,
+    "grams": 0.0,
+}
+# Wall-clock units swing by 2x with host load alone, so they are reported but never fail the run
+REPORT_ONLY_UNITS = ("wall_s", "us_per_op")
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the modules' progress prints while a benchmark runs."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def result(value: float, unit: str) -> dict:
+    return {"value": round(value, 6), "unit": unit}
+
+
+def time_per_op(func: Callable[[], object], iterations: int, repeats: int = 5) -> dict:
+    """Returns the best of several runs of func, as wall time per call in microseconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return result(best / iterations * 1_000_000, "us_per_op")
+
+
+class CannedSerial:
+    """In-memory serial port that answers every command with the same line, tagged like the command."""
+
+    def __init__(self, line: bytes) -> None:
+        self.line = line
+        self.tag = b""
+        self.in_waiting = len(line)
+
+    def write(self, data: bytes) -> int:
+        self.tag = data.split(b":", 1)[0]
+        return len(data)
+
+    def readline(self) -> bytes:
+        return self.tag + b":" + self.line
+
+    def close(self) -> None:
+        pass
+
+
+# === End-to-end batch ===
+def bench_batch(results: dict) -> None:
+    """Drives the main.py flow phase by phase against the simulated machine."""
+    import FPJ_CLOCK
+    import FPJ_PCF
+    import FPJ_RELAY
+    import FPJ_SIM
+    import main
+
+    def add(ingredient):
+        def phase():
+            if ingredient.chopped:
+                main.controller.turn_on_chopper()
+            else:
+                main.controller.turn_off_chopper()
+            main.add_ingredient(ingredient)
+        return phase
+
+    phases = [("reset_slider", main.reset_slider)]
+    phases += [(f"add_{ingredient.name.lower()}", add(ingredient)) for ingredient in main.plan.steps]
+    phases += [("mix", main.mix), ("seal", main.seal)]
+
+    batch_machine = FPJ_CLOCK.monotonic()
+    batch_wall = time.perf_counter()
+    for name, phase in phases:
+        commands = FPJ_SIM.esp32.commands
+        machine_start = FPJ_CLOCK.monotonic()
+        wall_start = time.perf_counter()
+        with quiet():
+            phase()
+        results[f"batch.{name}.machine"] = result(FPJ_CLOCK.monotonic() - machine_start, "machine_s")
+        results[f"batch.{name}.wall"] = result(time.perf_counter() - wall_start, "wall_s")
+        results[f"batch.{name}.scale_commands"] = result(FPJ_SIM.esp32.commands - commands, "count")
+    for ingredient in main.plan.steps:
+        dispense = main.profiler.dispensing[ingredient.name]
+        results[f"batch.add_{ingredient.name.lower()}.scale_reads"] = result(dispense["reads"], "count")
+        results[f"batch.add_{ingredient.name.lower()}.cutoff_error"] = result(abs(dispense["cutoff_error"]), "grams")
+    with quiet():
+        main.controller.shutdown()
+
+    results["batch.total.machine"] = result(FPJ_CLOCK.monotonic() - batch_machine, "machine_s")
+    results["batch.total.wall"] = result(time.perf_counter() - batch_wall, "wall_s")
+    results["batch.slider_steps"] = result(FPJ_PCF.machine.steps["slider"], "count")
+    results["batch.sealer_steps"] = result(FPJ_PCF.machine.steps["sealer"], "count")
+    switches = FPJ_PCF.machine.pcf_limitswitch
+    results["batch.switch_reads"] = result(switches.reads + switches.exchanges, "count")
+    results["batch.switch_transactions"] = result(switches.reads + switches.writes + switches.exchanges, "count")
+    results["batch.pin_writes"] = result(FPJ_PCF.pcf_limitswitch.writes + FPJ_PCF.pcf_relay.writes, "count")
+    results["batch.pin_writes_skipped"] = result(FPJ_PCF.pcf_limitswitch.skipped + FPJ_PCF.pcf_relay.skipped, "count")
+    for name, count in FPJ_RELAY.write_counts().items():
+        if count["writes"] or count["skipped"]:
+            key = name.lower().replace(" ", "_")
+            results[f"batch.pin_writes.{key}"] = result(count["writes"], "count")
+            results[f"batch.pin_writes_skipped.{key}"] = result(count["skipped"], "count")
+
+
+# === Micro-benchmarks ===
+def bench_json(results: dict, iterations: int = 200) -> None:
+    from FPJ_JSON import JsonHelper
+
+    helper = JsonHelper(os.path.join(os.getcwd(), "bench.json"))
+    with quiet():
+        helper.set("Weight", 0)
+        results["json.get"] = time_per_op(lambda: helper.get("Weight"), iterations)
+        results["json.set"] = time_per_op(lambda: helper.set("Weight", 1000), iterations)
+
+
+def bench_scale(results: dict, iterations: int = 2000) -> None:
+    from FPJ_SCALE import Scale, SAMPLE_RECORD, decode_samples
+
+    with quiet():
+        scale = Scale("", connection=CannedSerial(b"WT,1234.56\n"))  # No port; framing and parsing only
+        results["scale.get_weight.parse"] = time_per_op(scale.get_weight, iterations)
+
+        scale = Scale("/dev/ttyUSB0")  # Fake ESP32 round-trip on the simulator
+        results["scale.get_weight.round_trip"] = time_per_op(scale.get_weight, iterations // 10)
+
+        scale.close()
+
+    # 256 samples as binary records decoded in one go, and as ASCII weight lines
+    record = bytearray(SAMPLE_RECORD.pack(0xA5, 1, 2000, 1234.56, 0))
+    record[-1] = sum(record[:-1]) & 0xFF
+    block = bytes(record) * 256
+    lines = [b"WT,1234.56\n"] * 256
+    results["scale.samples.decode_256"] = time_per_op(lambda: decode_samples(block), iterations // 10)
+    results["scale.samples.parse_ascii_256"] = time_per_op(
+        lambda: [Scale.parse_grams(line.decode("utf-8").strip()) for line in lines], iterations // 10
+    )
+
+
+def bench_lcd(results: dict, iterations: int = 2000) -> None:
+    from FPJ_LCD import FPJ_LCD
+
+    with quiet():
+        lcd = FPJ_LCD()
+        results["lcd.display_activity"] = time_per_op(lambda: lcd.display_activity(8), iterations)
+        results["lcd.display_weight"] = time_per_op(lambda: lcd.display_water_weight(1234), iterations)
+
+
+def bench_stepper(results: dict, steps: int = 20000) -> None:
+    import FPJ_STEPPER
+
+    slider = FPJ_STEPPER.Steppers().slider
+    with quiet():
+        slider.enable()
+        start = time.perf_counter()
+        slider.move_stepper(False, step=steps)
+        elapsed = time.perf_counter() - start
+        slider.move_stepper(True, step=steps)
+    results["stepper.move_stepper"] = result(elapsed / steps * 1_000_000, "us_per_op")
+
+
+BENCHMARKS = [bench_batch, bench_json, bench_scale, bench_lcd, bench_stepper]
+
+
+# === Baseline comparison ===
+def compare(results: dict, baseline: dict) -> list:
+    """
+    Returns a list of regression messages for metrics slower than baseline plus tolerance.
+
+    Metrics in REPORT_ONLY_UNITS are printed next to their baseline but never regress.
+    """
+    tolerances = dict(DEFAULT_TOLERANCES, **baseline.get("tolerances", {}))
+    regressions = []
+    for name, reference in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from results")
+            continue
+        if reference["unit"] in REPORT_ONLY_UNITS:
+            print(f"[BENCH] {'REPORT':10} {name}: {current['value']} {current['unit']} (baseline {reference['value']})")
+            continue
+        tolerance = tolerances.get(name, tolerances.get(reference["unit"], 0.0))
+        limit = reference["value"] * (1 + tolerance)
+        status = "OK"
+        if current["value"] > limit + 1e-9:
+            status = "REGRESSION"
+            regressions.append(f"{name}: {current['value']} > {reference['value']} (+{tolerance:.0%})")
+        print(f"[BENCH] {status:10} {name}: {current['value']} {current['unit']} (baseline {reference['value']})")
+    return regressions
+
+
+def run(output: Optional[str] = None, baseline_file: str = BASELINE_FILE, update_baseline: bool = False) -> int:
+    random.seed(0)  # Scale noise in the simulator
+    repo = os.path.dirname(os.path.abspath(__file__))
+    if repo not in sys.path:
+        sys.path.insert(0, repo)
+    os.chdir(tempfile.mkdtemp(prefix="fpj-bench-"))
+
+    results: dict = {}
+    for bench in BENCHMARKS:
+        bench(results)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"[BENCH] Results written to {output}")
+
+    if update_baseline:
+        previous = {}
+        if os.path.isfile(baseline_file):
+            with open(baseline_file) as f:
+                previous = json.load(f)
+        report["tolerances"] = previous.get("tolerances", DEFAULT_TOLERANCES)
+        with open(baseline_file, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"[BENCH] Baseline updated: {baseline_file}")
+        return 0
+
+    if not os.path.isfile(baseline_file):
+        print(f"[BENCH] No baseline at {baseline_file}; run with --update-baseline to create one.")
+        return 0
+    with open(baseline_file) as f:
+        regressions = compare(results, json.load(f))
+    for regression in regressions:
+        print(f"[BENCH] {regression}")
+    return 1 if regressions else 0
+
+
+# Usage:
+#   python3 FPJ_BENCHMARK.py [--output results.json] [--baseline FILE] [--update-baseline]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FPJ maker batch benchmarks on the simulator")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+    sys.exit(run(os.path.abspath(args.output) if args.output else None, os.path.abspath(args.baseline), args.update_baseline))
@@ -0,0 +1,243 @@
+import json
+import math
+import os
+import socket
+import sys
+import time
+from typing import Dict, Optional
+import FPJ_PCF
+
+# Calibrated pulse intervals, one entry per machine. FPJ_CALIBRATION= (empty)
+# ignores the file, e.g. for benchmarks that must run at the default speeds.
+CALIBRATION_FILE: str = os.environ.get(
+    "FPJ_CALIBRATION", os.path.join(os.path.dirname(os.path.abspath(__file__)), "FPJ_CALIBRATION.json")
+)
+MACHINE_ID: str = os.environ.get("FPJ_MACHINE_ID", socket.gethostname())
+
+SPEEDUP: float = 0.85        # Each trial's pulse interval as a fraction of the previous one
+MIN_INTERVAL: float = 0.00005  # Shortest pulse interval ever tried
+SAFETY_MARGIN: float = 1.25  # Stored interval = fastest reliable interval x margin (in whole bus words with bursts)
+REPEATS: int = 2             # Round trips per interval; all must come back without lost steps
+CREEP_STEPS: int = 50        # Steps left to creep onto the switch slowly after each round trip
+TRIAL_STEPS: Dict[str, int] = {"slider": 3000, "sealer": 300}
+
+
+def machine_key() -> str:
+    """Calibration key for this machine; simulated and replayed backends get their own."""
+    backend = FPJ_PCF.BACKEND
+    return MACHINE_ID if backend == "hardware" else f"{MACHINE_ID} ({backend})"
+
+
+def _read(filename: str) -> dict:
+    if not filename or not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[ERROR] Failed to read calibration {filename}: {e}")
+        return {}
+
+
+def load(filename: str = CALIBRATION_FILE) -> Dict[str, float]:
+    """Calibrated pulse intervals for this machine by axis ("slider", "sealer"); empty if never calibrated."""
+    entry = _read(filename).get(machine_key(), {})
+    return {axis: values["pulse_interval"] for axis, values in entry.items()}
+
+
+def save(axis: str, fastest: float, filename: str = CALIBRATION_FILE, burst: bool = False) -> float:
+    """
+    Stores an axis' fastest reliable interval with the safety margin; returns the interval to use.
+
+    Burst-written pulses only last whole bus words (FPJ_PCF.WORD_TIME), so
+    with burst the margin is added in whole words and the stored interval is
+    the quantized one the pulses actually get.
+    """
+    entry = {}
+    if burst:
+        words = math.ceil(FPJ_PCF.burst_words(fastest) * SAFETY_MARGIN)
+        interval = round(words * FPJ_PCF.WORD_TIME, 7)
+        entry["words"] = words
+    else:
+        interval = round(fastest * SAFETY_MARGIN, 7)
+    data = _read(filename)
+    data.setdefault(machine_key(), {})[axis] = dict(
+        entry,
+        pulse_interval=interval,
+        fastest=round(fastest, 7),
+        margin=SAFETY_MARGIN,
+        calibrated=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=4)
+    print(f"[CALIBRATE] {axis}: pulse interval {interval * 1e6:.0f}us saved for {machine_key()} in {filename}")
+    return interval
+
+
+class AxisCalibration:
+    """
+    Finds how fast one stepper axis can run without losing steps.
+
+    Each trial starts on the axis' reference limit switch, drives trial_steps
+    away from it and trial_steps - CREEP_STEPS back at the trial interval,
+    then creeps onto the switch at the known-good interval, checking it
+    before every step. Without lost steps the creep takes exactly CREEP_STEPS;
+    anything else means steps were lost at the trial interval. Lost steps on
+    the way out bring the axis back early; the way back stops on the switch
+    then, and the steps it did not need are the ones lost. An axis with a
+    switch at its far end (the sealer's cover up) stops on that one on the
+    way out, and the trial is aborted if it trips.
+
+    With burst writes a pulse lasts a whole number of bus words, so the trials
+    step down a word at a time at least instead of retrying intervals that
+    round to the same pulses.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        controller,
+        away: bool,
+        destination_func,
+        switch_pin: int,
+        trial_steps: int,
+        far_func=None,
+        far_pin: Optional[int] = None,
+    ) -> None:
+        self.name = name
+        self.controller = controller
+        self.away = away
+        self.destination_func = destination_func
+        self.switch_pin = switch_pin
+        self.trial_steps = trial_steps
+        self.far_func = far_func  # Limit switch at the other end of the travel, if any
+        self.far_pin = far_pin
+        self.burst = controller.burst
+        self.safe_interval = controller.pulse_interval
+
+    def faster(self, interval: float) -> float:
+        """The next trial interval after interval."""
+        if not self.burst:
+            return interval * SPEEDUP
+        words = FPJ_PCF.burst_words(interval)
+        return min(words - 1, math.floor(words * SPEEDUP)) * FPJ_PCF.WORD_TIME
+
+    def seek_switch(self, max_step: int) -> Optional[int]:
+        """Creeps onto the reference switch at the safe interval; returns the steps taken, None if not reached."""
+        controller = self.controller
+        check_interval = controller.check_interval
+        controller.pulse_interval = self.safe_interval
+        controller.check_interval = 1
+        try:
+            reached = controller.move_stepper_to_destination(
+                direction=not self.away,
+                max_step=max_step,
+                destination_func=self.destination_func,
+                switch_pin=self.switch_pin
+            )
+        finally:
+            controller.check_interval = check_interval
+        return controller.last_steps if reached else None
+
+    def trial(self, interval: float) -> Optional[int]:
+        """One round trip at interval; returns the steps lost (or gained) on it, None if the far switch tripped."""
+        controller = self.controller
+        controller.pulse_interval = interval
+        if self.far_func is None:
+            controller.move_stepper(self.away, step=self.trial_steps)
+        elif controller.move_stepper_to_destination(
+            direction=self.away,
+            max_step=self.trial_steps,
+            destination_func=self.far_func,
+            switch_pin=self.far_pin
+        ):
+            return None
+        if controller.move_stepper_to_destination(
+            direction=not self.away,
+            max_step=self.trial_steps - CREEP_STEPS,
+            destination_func=self.destination_func,
+            switch_pin=self.switch_pin
+        ):
+            return self.trial_steps - controller.last_steps
+        creep = self.seek_switch(self.trial_steps)
+        return self.trial_steps if creep is None else abs(creep - CREEP_STEPS)
+
+    def run(self) -> Optional[float]:
+        """Ramps the interval down until steps are lost; returns the fastest interval that lost none."""
+        print(f"[CALIBRATE] {self.name}: starting at {self.safe_interval * 1e6:.0f}us")
+        if self.seek_switch(100000) is None:
+            print(f"[ERROR] {self.name}: reference switch not reached; calibration aborted.")
+            return None
+
+        fastest = None
+        interval = FPJ_PCF.burst_words(self.safe_interval) * FPJ_PCF.WORD_TIME if self.burst else self.safe_interval
+        try:
+            while interval >= MIN_INTERVAL:
+                lost = 0
+                for _ in range(REPEATS):
+                    steps = self.trial(interval)
+                    if steps is None:
+                        print(f"[ERROR] {self.name}: far limit switch tripped during a trial; calibration aborted.")
+                        return None
+                    lost = max(lost, steps)
+                print(f"[CALIBRATE] {self.name}: {interval * 1e6:.0f}us -> {lost} steps lost")
+                if lost:
+                    break
+                fastest = interval
+                interval = self.faster(interval)
+        finally:
+            self.controller.pulse_interval = self.safe_interval
+        if fastest is None:
+            print(f"[ERROR] {self.name}: loses steps even at {self.safe_interval * 1e6:.0f}us; keeping it.")
+        return fastest
+
+
+def calibrate(axes=("slider", "sealer"), filename: str = CALIBRATION_FILE) -> Dict[str, float]:
+    """Calibrates the given axes, saves them for this machine and applies them; returns the new intervals."""
+    import FPJ_STEPPER
+    from FPJ_LIMITSWITCH import SliderHomeLimitSwitchPin, CoverLowerLimitSwitchPin, CoverUpperLimitSwitchPin
+
+    steppers = FPJ_STEPPER.stepper
+    limits = FPJ_STEPPER.limit_status
+    calibrations = {
+        "slider": lambda: AxisCalibration(
+            "slider", steppers.slider, False, limits.is_slider_home, SliderHomeLimitSwitchPin, TRIAL_STEPS["slider"]
+        ),
+        "sealer": lambda: AxisCalibration(
+            "sealer", steppers.sealer, True, limits.is_cover_down, CoverLowerLimitSwitchPin, TRIAL_STEPS["sealer"],
+            far_func=limits.is_cover_up, far_pin=CoverUpperLimitSwitchPin
+        ),
+    }
+
+    intervals = {}
+    for axis in axes:
+        if axis == "slider":
+            steppers.lift_cover()  # The slider only moves with the cover up
+        calibration = calibrations[axis]()
+        fastest = calibration.run()
+        if fastest is None:
+            continue
+        intervals[axis] = save(axis, fastest, filename, calibration.burst)
+        getattr(steppers, axis).pulse_interval = intervals[axis]
+
+    # Calibrated axes were left on their reference switches
+    if "slider" in intervals:
+        steppers.slider_homed = True
+        steppers.slider_steps_from_home = 0
+    if "sealer" in axes:
+        steppers.cover_steps_from_down = 0 if "sealer" in intervals else None
+        steppers.lift_cover()
+    return intervals
+
+
+# Usage:
+#   python3 FPJ_CALIBRATE.py [slider|sealer ...]     calibrate stepper speeds (default both) and save them
+if __name__ == "__main__":
+    import FPJ_STEPPER
+
+    try:
+        # Only axis names; FPJ_SIM's own arguments are still in sys.argv under the simulator
+        calibrate([arg for arg in sys.argv[1:] if arg in TRIAL_STEPS] or ("slider", "sealer"))
+    finally:
+        FPJ_STEPPER.stepper.disableSlider()
+        FPJ_STEPPER.stepper.disableSealer()
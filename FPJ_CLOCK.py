@@ -0,0 +1,190 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+class Clock:
+    """Wall clock: real monotonic time and real sleeps."""
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Simulated clock whose sleeps return immediately.
+
+    Every sleep advances virtual time by exactly the requested amount, so code
+    that waits on relays, settling and stepper pulses runs as fast as the CPU
+    allows while still seeing a consistent timeline. Used with FPJ_SIM.
+
+    Threads that run concurrently in virtual time (e.g. overlapping batches)
+    register as participants; a participant's sleep then blocks until every
+    participant is asleep, and time jumps to the earliest wake-up, so
+    concurrent sleeps overlap instead of adding up.
+    """
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now: float = start
+        self.condition = threading.Condition()
+        self.participants: set = set()
+        self.sleeping: dict = {}  # Thread ident -> virtual wake-up time
+        self.starting: int = 0  # Participants announced with expect() but not yet registered
+        self.listeners: list = []  # Called after every sleep, so simulated devices can sample in virtual time
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def expect(self) -> None:
+        """Holds time still until a participant being handed work registers itself."""
+        with self.condition:
+            self.starting += 1
+
+    def register(self, expected: bool = False) -> None:
+        with self.condition:
+            self.participants.add(threading.get_ident())
+            if expected:
+                self.starting -= 1
+
+    def unregister(self) -> None:
+        with self.condition:
+            ident = threading.get_ident()
+            self.participants.discard(ident)
+            self.sleeping.pop(ident, None)
+            self._advance()
+
+    def _advance(self) -> None:
+        while not self.starting and self.participants and self.participants <= self.sleeping.keys():
+            earliest = min(self.sleeping.values())
+            if earliest == math.inf:
+                return  # Everyone waits for something other than time
+            self.now = max(self.now, earliest)
+            for ident in [i for i, wake in self.sleeping.items() if wake <= self.now]:
+                del self.sleeping[ident]
+            self.condition.notify_all()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            return
+        ident = threading.get_ident()
+        with self.condition:
+            if ident not in self.participants:
+                self.now += seconds
+            else:
+                self.sleeping[ident] = self.now + seconds
+                self._advance()
+                while ident in self.sleeping:
+                    self.condition.wait()
+        for listener in list(self.listeners):
+            listener()
+
+    def idle(self, seconds: Optional[float], woken: Callable[[], bool], poll: float = 0.001) -> None:
+        """
+        Participant sleep that also ends as soon as woken() is true or wake() is called.
+
+        Used by an event loop waiting for either its next timer (seconds, None
+        for none) or I/O; woken() is polled every poll seconds of real time.
+        """
+        ident = threading.get_ident()
+        with self.condition:
+            self.sleeping[ident] = math.inf if seconds is None else self.now + seconds
+            self._advance()
+            while ident in self.sleeping:
+                self.condition.wait(poll)
+                if ident in self.sleeping and woken():
+                    del self.sleeping[ident]
+
+    def wake(self, ident: int) -> None:
+        """Ends an idle() of the given thread early, before time can move on."""
+        with self.condition:
+            if self.sleeping.pop(ident, None) is not None:
+                self.condition.notify_all()
+
+
+class Aborted(Exception):
+    """Raised from sleep() in a thread whose work has been aborted."""
+
+
+# === Active clock, shared by all FPJ modules ===
+# FPJ_CLOCK=virtual selects the virtual clock before the hardware modules load
+clock: Clock = VirtualClock() if os.environ.get("FPJ_CLOCK") == "virtual" else Clock()
+
+
+def use(new_clock: Clock) -> Clock:
+    """Replaces the active clock and returns the previous one."""
+    global clock
+    previous = clock
+    clock = new_clock
+    return previous
+
+
+def monotonic() -> float:
+    """Monotonic time in seconds from the active clock."""
+    return clock.monotonic()
+
+
+# Sleeps at least this long wait on a condition so abort() can cut them short;
+# shorter ones (stepper half-pulses) stay plain sleeps to keep their timing tight.
+INTERRUPTIBLE_SLEEP: float = 0.05
+
+_aborted: set = set()
+_abort_condition = threading.Condition()
+
+
+def abort(thread: threading.Thread) -> None:
+    """Makes the next (or current) sleep in the given thread raise Aborted."""
+    with _abort_condition:
+        _aborted.add(thread.ident)
+        _abort_condition.notify_all()
+
+
+def clear_abort(thread: threading.Thread) -> None:
+    """Lets the given thread sleep normally again."""
+    with _abort_condition:
+        _aborted.discard(thread.ident)
+
+
+def check_abort() -> None:
+    """Raises Aborted if the calling thread has been aborted."""
+    if _aborted and threading.get_ident() in _aborted:
+        raise Aborted("Aborted while waiting")
+
+
+def sleep(seconds: float) -> None:
+    """Sleeps on the active clock; raises Aborted if the calling thread is aborted."""
+    check_abort()
+    if seconds >= INTERRUPTIBLE_SLEEP and not is_virtual():
+        ident = threading.get_ident()
+        with _abort_condition:
+            _abort_condition.wait_for(lambda: ident in _aborted, timeout=seconds)
+    else:
+        clock.sleep(seconds)
+    check_abort()
+
+
+@contextmanager
+def participant(expected: bool = False):
+    """
+    Runs the calling thread as a participant of the virtual clock (no-op in real time).
+
+    Pass expected=True when the thread was announced with VirtualClock.expect().
+    """
+    active = clock if isinstance(clock, VirtualClock) else None
+    if active:
+        active.register(expected)
+    try:
+        yield
+    finally:
+        if active:
+            active.unregister()
+
+
+def is_virtual() -> bool:
+    return isinstance(clock, VirtualClock)
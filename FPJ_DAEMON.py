@@ -0,0 +1,222 @@
+import json as jsonlib
+import os
+import selectors
+import socket
+import sys
+import threading
+from typing import Callable, Optional
+
+SOCKET_PATH: str = os.environ.get("FPJ_SOCKET", "/tmp/fpj_maker.sock")
+POLL_INTERVAL: float = 0.05  # Seconds between Start/Reset button polls
+
+
+class FpjDaemon:
+    """
+    Resident batch controller.
+
+    The hardware is initialized once when main is imported: the serial port
+    to the ESP32 stays open (so it is not reset and keeps its tare), the
+    relay board is configured and the slider's homed state is remembered
+    between batches. Batches are then started, aborted or reset from the
+    Start/Reset buttons or from commands on a local Unix socket:
+
+        start   run a batch, resuming from the checkpointed state
+        abort   stop the running batch and switch off every relay
+        reset   abort if running, clear the batch state and re-home the slider
+        status  report the daemon state
+        quit    abort if running and exit
+    """
+
+    def __init__(self, socket_path: str = SOCKET_PATH) -> None:
+        import main  # Hardware initialization happens here, once
+        from FPJ_LIMITSWITCH import LimitStatus
+
+        self.main = main
+        self.limits = LimitStatus()
+        self.socket_path = socket_path
+        self.worker: Optional[threading.Thread] = None
+        self.activity: str = "idle"
+        self.batches: int = 0
+        self.last_result: str = ""
+        self.running: bool = True
+        self.buttons = {"start": False, "reset": False}
+        self.lock = threading.Lock()
+
+    # === Batch worker ===
+    def busy(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    def _spawn(self, activity: str, job: Callable[[], None]) -> str:
+        if self.busy():
+            return f"busy: {self.activity}"
+        self.activity = activity
+        self.worker = threading.Thread(target=self._run, args=(activity, job), name=f"fpj-{activity}", daemon=True)
+        self.worker.start()
+        return f"{activity} started"
+
+    def _run(self, activity: str, job: Callable[[], None]) -> None:
+        import FPJ_CLOCK
+
+        main = self.main
+        completed = False
+        if activity == "batch":
+            main.profiler.start_batch()
+        try:
+            main.controller.power_up()  # The previous batch's shutdown switched the supplies off
+            job()
+            completed = True
+            self.last_result = f"{activity} completed"
+        except FPJ_CLOCK.Aborted:
+            self.last_result = f"{activity} aborted"
+        except Exception as e:
+            self.last_result = f"{activity} failed: {e}"
+        finally:
+            FPJ_CLOCK.clear_abort(threading.current_thread())
+            # The shutdown switches the stepper supply off, so the steppers must be re-powered next time
+            main.stepper.disableSlider()
+            main.stepper.disableSealer()
+            main.controller.shutdown(force=not completed)
+            if activity == "batch":
+                main.profiler.end_batch(completed)
+                self.batches += completed
+            with self.lock:
+                self.activity = "idle"
+            print(f"[DAEMON] {self.last_result}.")
+
+    def start(self) -> str:
+        return self._spawn("batch", self.main.run_batch)
+
+    def abort(self) -> str:
+        import FPJ_CLOCK
+
+        if not self.busy():
+            return "idle"
+        with self.lock:
+            FPJ_CLOCK.abort(self.worker)
+            self.activity = "aborting"
+        return "aborting"
+
+    def reset(self) -> str:
+        if self.busy():
+            self.abort()
+            self.worker.join()
+        return self._spawn("reset", self._reset_batch)
+
+    def _reset_batch(self) -> None:
+        """Clears the batch state for a fresh container and re-homes the slider."""
+        from FPJ_STATE import BatchStateMachine, HomingError, HOME, UNKNOWN
+
+        main = self.main
+        machine = BatchStateMachine(main)
+        machine.reset()
+        main.LedIndicator.turn_off()
+        main.show_activity(1)
+        main.controller.mixer_up()
+        homed = main.stepper.moveSliderToHome(force=True)
+        machine.checkpoint(slider=HOME if homed else UNKNOWN)
+        if not homed:
+            raise HomingError("Slider did not reach home")
+        main.show_activity(0)
+
+    def status(self) -> str:
+        return jsonlib.dumps({
+            "activity": self.activity,
+            "batches": self.batches,
+            "last_result": self.last_result,
+            "slider_homed": self.main.stepper.slider_homed,
+        })
+
+    def handle(self, command: str) -> str:
+        commands = {
+            "start": self.start,
+            "abort": self.abort,
+            "reset": self.reset,
+            "status": self.status,
+        }
+        if command == "quit":
+            self.running = False
+            return self.abort()
+        if command not in commands:
+            return f"unknown command: {command}"
+        return commands[command]()
+
+    # === Inputs ===
+    def poll_buttons(self) -> None:
+        """Acts on Start/Reset presses (on the press edge, not while held)."""
+        limits = self.limits
+        for name, pressed in (("start", limits.is_start_btn_pressed()), ("reset", limits.is_reset_btn_pressed())):
+            if pressed and not self.buttons[name]:
+                if name == "reset" and self.busy():
+                    print(f"[DAEMON] Reset button: {self.abort()}")
+                else:
+                    print(f"[DAEMON] {name.capitalize()} button: {self.handle(name)}")
+            self.buttons[name] = pressed
+
+    def _open_socket(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        server.setblocking(False)
+        return server
+
+    def _serve_client(self, server: socket.socket) -> None:
+        connection, _ = server.accept()
+        with connection:
+            connection.settimeout(1.0)
+            try:
+                command = connection.recv(256).decode("utf-8").strip().lower()
+                reply = self.handle(command)
+                connection.sendall((reply + "\n").encode("utf-8"))
+                print(f"[DAEMON] {command}: {reply}")
+            except OSError as e:
+                print(f"[DAEMON] Client error: {e}")
+
+    def serve_forever(self) -> None:
+        """Initializes once, then waits for buttons and socket commands until quit."""
+        main = self.main
+        main.start_up()
+        main.show_activity(0)
+        server = self._open_socket()
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        print(f"[DAEMON] Ready. Listening on {self.socket_path}")
+        try:
+            while self.running:
+                for _ in selector.select(timeout=POLL_INTERVAL):
+                    self._serve_client(server)
+                self.poll_buttons()
+            if self.worker is not None:
+                self.worker.join()
+        except KeyboardInterrupt:
+            print("\n[DAEMON] Interrupted.")
+            self.abort()
+            if self.worker is not None:
+                self.worker.join()
+        finally:
+            selector.close()
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            main.controller.shutdown(force=True)
+            main.scale.close()
+            print("[DAEMON] System safely shut down.")
+
+
+def send(command: str, socket_path: str = SOCKET_PATH) -> str:
+    """Sends one command to a running daemon and returns its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((command + "\n").encode("utf-8"))
+        return client.recv(4096).decode("utf-8").strip()
+
+
+# Usage:
+#   python3 FPJ_DAEMON.py                 run the daemon
+#   python3 FPJ_DAEMON.py send <command>  send start/abort/reset/status/quit
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "send":
+        print(send(sys.argv[2]))
+    else:
+        FpjDaemon().serve_forever()
@@ -1,6 +1,7 @@
 import json
 import os
-from typing import Any
+from typing import Any, Optional
+from FPJ_RECIPE import Plan, PlanStep, load_plan
 
 
 class JsonHelper:
@@ -74,6 +75,19 @@ class JsonHelper:
         except Exception as e:
             print(f"[ERROR] Failed to write data: {e}")
 
+    def set_all(self, data: dict) -> None:
+        """
+        Replaces the entire JSON data in the file.
+
+        Args:
+            data (dict): The data to write.
+        """
+        try:
+            with open(self.filename, "w") as f:
+                json.dump(data, f, indent=4)
+        except Exception as e:
+            print(f"[ERROR] Failed to write data: {e}")
+
     def modify(self, key: str, value: Any) -> None:
         """
         Modifies an existing key-value pair or adds a new key-value pair if it doesn't exist.
@@ -209,37 +223,50 @@ class FpjJson:
         """Gets the mixing status."""
         return self.json_helper.get("IsMixingDone", False)
 
+    def get_batch_state(self) -> dict:
+        """Gets the checkpointed batch state machine state."""
+        return self.json_helper.get("BatchState", {})
+
+    def set_batch_state(self, state: dict) -> None:
+        """Checkpoints the batch state machine state."""
+        self.json_helper.set("BatchState", state)
+
+    def get_molasses_flow_table(self) -> list:
+        """Gets the calibrated molasses flow table as [angle, grams per second] pairs."""
+        return self.json_helper.get("MolassesFlowTable", [])
+
+    def set_molasses_flow_table(self, table: list) -> None:
+        """Sets the calibrated molasses flow table."""
+        self.json_helper.set("MolassesFlowTable", [list(point) for point in table])
+
 class FpjStatus:
-    def __init__(self) -> None:
+    def __init__(self, plan: Optional[Plan] = None) -> None:
         self.fpjson = FpjJson()
+        self.plan: Plan = plan or load_plan()
+
+    def is_enough(self, ingredient: PlanStep) -> bool:
+        weight = self.fpjson.get_weight(ingredient.json_key)
+        print(f"[STATUS] {ingredient.json_key} is {weight}g")
+        return ingredient.is_enough(weight)
+
+    def _is_actuator_enough(self, actuator: str) -> bool:
+        ingredient = self.plan.for_actuator(actuator)
+        return ingredient is None or self.is_enough(ingredient)
 
     def is_kakawate_enough(self) -> bool:
-        weight = self.fpjson.get_kakawate_weight()
-        print(f"[STATUS] KakawateWeight is {weight}g")
-        return weight >= 1000
+        return self._is_actuator_enough("kakawate")
 
     def is_neem_enough(self) -> bool:
-        weight = self.fpjson.get_neem_weight()
-        print(f"[STATUS] NeemWeight is {weight}g")
-        return weight >= 2000
+        return self._is_actuator_enough("neem")
 
     def is_molasses_enough(self) -> bool:
-        weight = self.fpjson.get_molasses_weight()
-        print(f"[STATUS] MolassesWeight is {weight}g")
-        return weight >= 4000
+        return self._is_actuator_enough("molasses")
 
     def is_water_enough(self) -> bool:
-        weight = self.fpjson.get_water_weight()
-        print(f"[STATUS] WaterWeight is {weight}g")
-        return weight >= 6000
+        return self._is_actuator_enough("water")
 
     def is_ingredients_enough(self) -> bool:
-        return (
-            self.is_kakawate_enough()
-            and self.is_neem_enough()
-            and self.is_molasses_enough()
-            and self.is_water_enough()
-        )
+        return all(self.is_enough(ingredient) for ingredient in self.plan.steps)
 
     def batch_done(self) -> bool:
         is_done = self.fpjson.is_already_fermenting()
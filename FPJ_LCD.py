@@ -1,12 +1,39 @@
-from RPLCD.i2c import CharLCD
-from smbus2 import SMBus
-from time import sleep
-
+import threading
+from FPJ_CLOCK import sleep
+import FPJ_PCF
+
+# Activity codes shown on lcd1, also used as batch phase keys by FPJ_PROFILER
+ActivityMap = {
+    0: "Waiting to load",
+    1: "Homing slider",
+    2: "Chopping Kakawate",
+    3: "Chopping Neem",
+    4: "Adding Molasses",
+    5: "Adding Water",
+    6: "Moving to Mixer",
+    7: "Moving Mixer Down",
+    8: "Mixing",
+    9: "Moving Mixer Up",
+    10: "Moving to Sealer",
+    11: "Sealing",
+    12: "Waiting to Ferment",
+    13: "Ready for Harvest"
+}
 
 class LCD_CONTROLLER:
     def __init__(self, address, cols=20, rows=4):
         self.address = address
         self.lcd = None
+        self.lock = threading.RLock()  # One writer at a time; the LCD is driven nibble by nibble
+        if FPJ_PCF.BACKEND != "hardware":
+            import FPJ_SIM
+
+            self.lcd = FPJ_SIM.SimCharLCD(cols=cols, rows=rows)
+            return
+
+        from RPLCD.i2c import CharLCD
+        from smbus2 import SMBus
+
         try:
             # Check if the device at address responds
             with SMBus(1) as bus:
@@ -24,7 +51,8 @@ class LCD_CONTROLLER:
     def clear(self):
         if self.lcd:
             try:
-                self.lcd.clear()
+                with self.lock:
+                    self.lcd.clear()
             except Exception as e:
                 print(f"❌ Error clearing LCD at 0x{self.address:02X}: {e}")
 
@@ -33,18 +61,19 @@ class LCD_CONTROLLER:
             print(f"⚠️ Cannot display: LCD at 0x{self.address:02X} not initialized.")
             return
 
-        if overwrite:
-            self.clear()
+        with self.lock:
+            if overwrite:
+                self.clear()
 
-        lines = [line1, line2, line3, line4]
-        for i, text in enumerate(lines):
-            if text:
-                try:
-                    centered = str(text).strip().center(20)[:20]  # Center-align and trim if needed
-                    self.lcd.cursor_pos = (i, 0)
-                    self.lcd.write_string(centered)
-                except Exception as e:
-                    print(f"❌ Error writing to line {i+1} on LCD at 0x{self.address:02X}: {e}")
+            lines = [line1, line2, line3, line4]
+            for i, text in enumerate(lines):
+                if text:
+                    try:
+                        centered = str(text).strip().center(20)[:20]  # Center-align and trim if needed
+                        self.lcd.cursor_pos = (i, 0)
+                        self.lcd.write_string(centered)
+                    except Exception as e:
+                        print(f"❌ Error writing to line {i+1} on LCD at 0x{self.address:02X}: {e}")
 
 class FPJ_LCD:
     def __init__(self):
@@ -95,33 +124,32 @@ class FPJ_LCD:
         3. 15th cell for weight.
         4. 20th cell for 'g'.
         """
-        # Format the weight as a string (up to 4 digits)
-        weight_str = f"{weight}"  # ensures weight has 4 digits, padding with spaces if necessary
+        with self.lcd2.lock:
+            # Format the weight as a string (up to 4 digits)
+            weight_str = f"{weight}"  # ensures weight has 4 digits, padding with spaces if necessary
         
-        # Clear the target line first to avoid leftovers from previous data
-        self.lcd2.lcd.cursor_pos = (line, 0)
-        self.lcd2.lcd.write_string(" " * 20)  # Clear the entire line by writing spaces
-
-        # Create the content for the line
-        line_content = f"{material_name}"
-
-        # Update the LCD for the specified line
-        self.lcd2.lcd.cursor_pos = (line, 0)  # Move cursor to start of the line
-        self.lcd2.lcd.write_string(line_content)  # Write the material name
+            # Clear the target line first to avoid leftovers from previous data
+            self.lcd2.lcd.cursor_pos = (line, 0)
+            self.lcd2.lcd.write_string(" " * 20)  # Clear the entire line by writing spaces
 
-        # Set cursor to the 12th cell and print ":"
-        self.lcd2.lcd.cursor_pos = (line, 12)
-        self.lcd2.lcd.write_string(":")
+            # Create the content for the line
+            line_content = f"{material_name}"
 
-        # Set cursor to the 15th cell and print the weight (ensuring it's in the correct format)
-        self.lcd2.lcd.cursor_pos = (line, 14)
-        self.lcd2.lcd.write_string(weight_str)
+            # Update the LCD for the specified line
+            self.lcd2.lcd.cursor_pos = (line, 0)  # Move cursor to start of the line
+            self.lcd2.lcd.write_string(line_content)  # Write the material name
 
-        # Set cursor to the 20th cell and print "g"
-        self.lcd2.lcd.cursor_pos = (line, 19)  # Adjusting to 0-index (column 19 is the 20th cell)
-        self.lcd2.lcd.write_string("g")
+            # Set cursor to the 12th cell and print ":"
+            self.lcd2.lcd.cursor_pos = (line, 12)
+            self.lcd2.lcd.write_string(":")
 
+            # Set cursor to the 15th cell and print the weight (ensuring it's in the correct format)
+            self.lcd2.lcd.cursor_pos = (line, 14)
+            self.lcd2.lcd.write_string(weight_str)
 
+            # Set cursor to the 20th cell and print "g"
+            self.lcd2.lcd.cursor_pos = (line, 19)  # Adjusting to 0-index (column 19 is the 20th cell)
+            self.lcd2.lcd.write_string("g")
 
     def display_kakawate_weight(self, weight):
         self.update_lcd_weight("Kakawate", weight, 0)
@@ -162,24 +190,7 @@ class FPJ_LCD:
         13 - Ready for Harvest
         """
 
-        activity_map = {
-            0: "Waiting to load",
-            1: "Homing slider",
-            2: "Chopping Kakawate",
-            3: "Chopping Neem",
-            4: "Adding Molasses",
-            5: "Adding Water",
-            6: "Moving to Mixer",
-            7: "Moving Mixer Down",
-            8: "Mixing",
-            9: "Moving Mixer Up",
-            10: "Moving to Sealer",
-            11: "Sealing",
-            12: "Waiting to Ferment",
-            13: "Ready for Harvest"
-        }
-
-        message = activity_map.get(activity, "Unknown Activity").upper()
+        message = ActivityMap.get(activity, "Unknown Activity").upper()
 
         self.lcd1.display(
             overwrite=True,
@@ -1,8 +1,5 @@
-import board
-import digitalio
-import time
-from adafruit_pcf8575 import PCF8575
 import FPJ_PCF
+import FPJ_CLOCK
 
 pcf = FPJ_PCF.pcf_limitswitch
 pcf_ready = FPJ_PCF.limit_switch_ready
@@ -17,7 +14,7 @@ class LimitSwitch:
         if self.available and pcf is not None:
             try:
                 self.pin = pcf.get_pin(pin_number)
-                self.pin.switch_to_input(pull=digitalio.Pull.UP)
+                self.pin.switch_to_input(pull=FPJ_PCF.PULL_UP)
             except Exception as e:
                 print(f"Error setting up pin {pin_number} for {name}: {e}")
                 self.available = False
@@ -83,8 +80,6 @@ class LimitStatus:
         return Start.is_triggered()
 
 if __name__ == "__main__":
-    import time
-
     limit_status = LimitStatus()
 
     try:
@@ -107,7 +102,7 @@ if __name__ == "__main__":
             if limit_status.is_loaded_btn_pressed():
                 print("Loaded Button Pressed")
 
-            time.sleep(0.1)  # Add delay to prevent excessive CPU usage
+            FPJ_CLOCK.sleep(0.1)  # Add delay to prevent excessive CPU usage
 
     except KeyboardInterrupt:
         print("\n\nTest stopped by user.")
@@ -1,6 +1,222 @@
 # pcf_controller.py
-from adafruit_pcf8575 import PCF8575
-import board
+import math
+import os
+import struct
+import threading
+from typing import Dict, Optional
+import FPJ_CLOCK
+import FPJ_TRACE
+
+# I2C bus clock (dtparam=i2c_arm_baudrate on the Pi). In a burst write every
+# 16-bit word takes two bytes of 8 bits plus ACK, which sets pulse timing.
+I2C_FREQUENCY: int = int(os.environ.get("FPJ_I2C_HZ", 100000))
+WORD_TIME: float = 18 / I2C_FREQUENCY
+BURST_MAX_BYTES: int = 1024  # Longest single burst; bounds how long the expander lock is held
+
+
+def burst_words(half_period: float) -> int:
+    """Bus words one pulse level is repeated for in a burst write to last at least half_period."""
+    return max(1, math.ceil(half_period / WORD_TIME - 1e-9))
+
+
+class PcfPin:
+    """Pin on a LockedPcf, same interface as adafruit_pcf8575.DigitalInOut."""
+
+    def __init__(self, pcf: "LockedPcf", pin_number: int) -> None:
+        self._pcf = pcf
+        self._pin = pin_number
+
+    def switch_to_output(self, value: bool = False, **kwargs) -> None:
+        self._pcf.write_pin(self._pin, value, force=True)
+
+    def switch_to_input(self, pull=None, **kwargs) -> None:
+        self._pcf.write_pin(self._pin, True, force=True)
+
+    @property
+    def value(self) -> bool:
+        return self._pcf.read_pin(self._pin)
+
+    @value.setter
+    def value(self, val: bool) -> None:
+        self._pcf.write_pin(self._pin, val)
+
+
+class LockedPcf:
+    """
+    Serializes access to one PCF8575.
+
+    write_pin is a read-modify-write of the expander's 16-bit output word, so
+    two threads switching different pins of the same chip (e.g. overlapping
+    batches driving the chopper and the mixer relays) would lose updates
+    without a lock.
+    """
+
+    def __init__(self, pcf) -> None:
+        self.pcf = pcf
+        self.lock = threading.RLock()
+        self.latch: int = 0xFFFF  # Output word as written; all high at power-on
+        self.known: int = 0  # Pins written since start-up, whose latch bit matches the chip
+        self.shared = None  # (memory, offset) of the output word once shared with another process
+        self.writes: int = 0
+        self.skipped: int = 0  # Pin writes left out because the pin already had that level
+
+    def share(self, memory, offset: int, lock) -> None:
+        """
+        Keeps the output word in shared memory behind a cross-process lock, so
+        another process (the stepper worker) can switch pins of this chip too
+        without either side overwriting the other's pins.
+        """
+        with self.lock:
+            struct.pack_into("<I", memory, offset, self.latch)
+            self.shared = (memory, offset)
+            self.lock = lock
+
+    def get_pin(self, pin: int) -> PcfPin:
+        assert 0 <= pin <= 15
+        return PcfPin(self, pin)
+
+    def write_pin(self, pin: int, val: bool, force: bool = False) -> bool:
+        """
+        Sets a pin, skipping the I2C write when the pin is known to be at val
+        already; force writes regardless. Returns whether it was written.
+        """
+        bit = 1 << pin
+        with self.lock:
+            if self.shared:
+                memory, offset = self.shared
+                self.latch = struct.unpack_from("<I", memory, offset)[0]
+            if not force and self.known & bit and bool(self.latch & bit) == val:
+                self.skipped += 1
+                return False
+            self.latch = self.latch | bit if val else self.latch & ~bit
+            if self.shared:
+                self.pcf.write_gpio(self.latch)
+                struct.pack_into("<I", memory, offset, self.latch)
+            else:
+                self.pcf.write_pin(pin, val)
+            self.known |= bit
+            self.writes += 1
+            return True
+
+    def read_pin(self, pin: int) -> bool:
+        with self.lock:
+            return self.pcf.read_pin(pin)
+
+    @property
+    def burst_capable(self) -> bool:
+        return hasattr(self.pcf, "write_burst")
+
+    @property
+    def exchange_capable(self) -> bool:
+        return hasattr(self.pcf, "exchange")
+
+    def burst_steps(self, half_period: float) -> int:
+        """Most steps one burst of at most BURST_MAX_BYTES can carry at this half period."""
+        return max(1, BURST_MAX_BYTES // (4 * burst_words(half_period)))
+
+    def _pulse_words(self, latch: int, pin: int, steps: int, half_period: float) -> bytes:
+        words = burst_words(half_period)
+        high = struct.pack("<H", latch | (1 << pin))
+        low = struct.pack("<H", latch & ~(1 << pin) & 0xFFFF)
+        return (high * words + low * words) * steps
+
+    def pulse_train(self, pin: int, steps: int, half_period: float) -> None:
+        """
+        Pulses a pin off/on for steps steps using burst writes.
+
+        The PCF8575 latches every word of a continuous write, so each step is
+        encoded as words with the pin high, then low, each level repeated
+        (padding words) until it lasts at least half_period at the bus clock.
+        Other pins keep their current levels. Long trains are split into
+        bursts of at most BURST_MAX_BYTES.
+        """
+        steps_per_burst = self.burst_steps(half_period)
+        while steps > 0:
+            count = min(steps, steps_per_burst)
+            with self.lock:
+                if self.shared:
+                    memory, offset = self.shared
+                    self.latch = struct.unpack_from("<I", memory, offset)[0]
+                remaining = self.pcf.write_burst(self._pulse_words(self.latch, pin, count, half_period), WORD_TIME)
+                self.latch &= ~(1 << pin)
+                self.known |= 1 << pin
+                self.writes += 1
+                if self.shared:
+                    struct.pack_into("<I", memory, offset, self.latch)
+            # Simulated and replayed expanders return at once; let the bus time pass outside the lock
+            FPJ_CLOCK.clock.sleep(remaining)
+            steps -= count
+
+    def exchange(
+        self, outputs: Optional[Dict[int, bool]] = None, pulse_pin: Optional[int] = None, steps: int = 0,
+        half_period: float = 0.0
+    ) -> int:
+        """
+        One control tick: sets outputs (pin -> level), makes steps pulses on
+        pulse_pin as pulse_train does, then reads all 16 pins back, in a single
+        I2C transaction (the write, a repeated start, the read). Returns the
+        input word. When nothing would change the write is left out. The
+        pulses must fit one burst (see burst_steps).
+        """
+        with self.lock:
+            if self.shared:
+                memory, offset = self.shared
+                self.latch = struct.unpack_from("<I", memory, offset)[0]
+            latch = self.latch
+            pins = 0
+            for pin, val in (outputs or {}).items():
+                pins |= 1 << pin
+                latch = latch | (1 << pin) if val else latch & ~(1 << pin)
+            if steps:
+                data = self._pulse_words(latch, pulse_pin, steps, half_period)
+                latch &= ~(1 << pulse_pin)
+                pins |= 1 << pulse_pin
+            elif latch != self.latch or pins & ~self.known:
+                data = struct.pack("<H", latch)
+            else:
+                data = b""
+                if pins:
+                    self.skipped += 1
+            inputs, remaining = self.pcf.exchange(data, WORD_TIME)
+            if data:
+                self.latch = latch
+                self.known |= pins
+                self.writes += 1
+                if self.shared:
+                    struct.pack_into("<I", memory, offset, self.latch)
+        FPJ_CLOCK.clock.sleep(remaining)
+        return inputs
+
+
+class PcfPort:
+    """
+    Port-level driver for a control loop on one expander.
+
+    Outputs set between ticks are only staged; tick() applies them all
+    together with an optional pulse train and reads every input back in the
+    same transaction, so a loop that steps a motor and watches a limit switch
+    on the same chip costs one bus transaction per tick instead of a write
+    per edge plus a read per switch.
+    """
+
+    def __init__(self, pcf: LockedPcf) -> None:
+        self.pcf = pcf
+        self.pending: Dict[int, bool] = {}
+        self.inputs: int = 0xFFFF  # Pin levels read by the last tick
+
+    def set(self, pin: int, val: bool) -> None:
+        self.pending[pin] = val
+
+    def tick(self, pulse_pin: Optional[int] = None, steps: int = 0, half_period: float = 0.0) -> int:
+        """Applies the staged outputs and steps pulses on pulse_pin; returns all inputs read after them."""
+        outputs, self.pending = self.pending, {}
+        self.inputs = self.pcf.exchange(outputs, pulse_pin, steps, half_period)
+        return self.inputs
+
+    def is_low(self, pin: int) -> bool:
+        """Whether a pin read low at the last tick (a closed active-low switch)."""
+        return not (self.inputs >> pin) & 1
+
 
 # === PCF8575 Instances ===
 pcf_limitswitch = None
@@ -10,27 +226,101 @@ pcf_relay = None
 limit_switch_ready = False
 relay_ready = False
 
-# === I2C Setup ===
-try:
-    i2c = board.I2C()
-except Exception as e:
-    print(f"❌ Failed to initialize I2C bus: {e}")
+# === Backend ===
+# "hardware" drives the real I2C bus, "sim" the FPJ_SIM machine model (FPJ_BACKEND=sim)
+# and "replay" serves the expanders from a recorded trace (FPJ_REPLAY)
+BACKEND = "replay" if FPJ_TRACE.player else os.environ.get("FPJ_BACKEND", "hardware")
+
+# Pull-up setting for limit switch inputs; only the real expander needs digitalio
+PULL_UP = None
+
+if BACKEND == "replay":
+    pcf_limitswitch = FPJ_TRACE.player.pcf(0x20)
+    pcf_relay = FPJ_TRACE.player.pcf(0x26)
+    limit_switch_ready = True
+    relay_ready = True
     i2c = None
+    print("✅ PCF8575 expanders replaying from trace.")
+elif BACKEND == "sim":
+    import FPJ_SIM
 
-# === Initialize PCF8575 for Limit Switches ===
-if i2c:
-    try:
-        pcf_limitswitch = PCF8575(i2c, address=0x20)
-        limit_switch_ready = True
-        print("✅ PCF8575 for Limit Switches initialized at 0x20.")
-    except Exception as e:
-        print(f"❌ Failed to initialize Limit Switch PCF8575 at 0x20: {e}")
+    machine = FPJ_SIM.start()
+    pcf_limitswitch = FPJ_TRACE.wrap_pcf(machine.pcf_limitswitch, 0x20)
+    pcf_relay = FPJ_TRACE.wrap_pcf(machine.pcf_relay, 0x26)
+    limit_switch_ready = True
+    relay_ready = True
+    i2c = None
+    print("✅ PCF8575 expanders simulated.")
+else:
+    from adafruit_pcf8575 import PCF8575
+    import board
+    import digitalio
+
+    PULL_UP = digitalio.Pull.UP
+
+    class BurstPCF8575(PCF8575):
+        """PCF8575 that can also write a run of output words in one I2C transaction."""
 
-# === Initialize PCF8575 for Relays ===
-if i2c:
+        def write_burst(self, data: bytes, word_time: float) -> float:
+            with self.i2c_device as i2c:
+                i2c.write(data)
+            self._writebuf[0], self._writebuf[1] = data[-2], data[-1]  # Keep write_pin's latch in step
+            return 0.0  # The write blocked for the whole transaction
+
+        def exchange(self, data: bytes, word_time: float):
+            """Writes data (if any), then reads the input word after a repeated start, in one transaction."""
+            with self.i2c_device as i2c:
+                if data:
+                    i2c.write_then_readinto(data, self._readbuf)
+                else:
+                    i2c.readinto(self._readbuf)
+            if data:
+                self._writebuf[0], self._writebuf[1] = data[-2], data[-1]
+            return self._readbuf[0] | self._readbuf[1] << 8, 0.0
+
+    # === I2C Setup ===
     try:
-        pcf_relay = PCF8575(i2c, address=0x26)
-        relay_ready = True
-        print("✅ PCF8575 for Relays initialized at 0x26.")
+        i2c = board.I2C()
     except Exception as e:
-        print(f"❌ Failed to initialize Relay PCF8575 at 0x26: {e}")
+        print(f"❌ Failed to initialize I2C bus: {e}")
+        i2c = None
+
+    # === Initialize PCF8575 for Limit Switches ===
+    if i2c:
+        try:
+            pcf_limitswitch = FPJ_TRACE.wrap_pcf(BurstPCF8575(i2c, address=0x20), 0x20)
+            limit_switch_ready = True
+            print("✅ PCF8575 for Limit Switches initialized at 0x20.")
+        except Exception as e:
+            print(f"❌ Failed to initialize Limit Switch PCF8575 at 0x20: {e}")
+
+    # === Initialize PCF8575 for Relays ===
+    if i2c:
+        try:
+            pcf_relay = FPJ_TRACE.wrap_pcf(PCF8575(i2c, address=0x26), 0x26)
+            relay_ready = True
+            print("✅ PCF8575 for Relays initialized at 0x26.")
+        except Exception as e:
+            print(f"❌ Failed to initialize Relay PCF8575 at 0x26: {e}")
+
+# === Shared access from concurrent control threads ===
+if pcf_limitswitch is not None:
+    pcf_limitswitch = LockedPcf(pcf_limitswitch)
+if pcf_relay is not None:
+    pcf_relay = LockedPcf(pcf_relay)
+
+
+def reopen_limitswitch() -> None:
+    """
+    Gives this process its own I2C file descriptor for the 0x20 expander.
+
+    Called in the forked stepper worker. Adafruit_PureIO selects the device
+    with an I2C_SLAVE ioctl on the descriptor before each transfer, so on the
+    descriptor inherited from the parent a relay write there could retarget
+    it between the worker's ioctl and its pulse words. board.I2C() would hand
+    back the parent's bus object, hence busio.
+    """
+    if BACKEND == "hardware" and pcf_limitswitch is not None:
+        import busio
+
+        pcf_limitswitch.pcf = BurstPCF8575(busio.I2C(board.SCL, board.SDA), address=0x20)
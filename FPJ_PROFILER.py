@@ -0,0 +1,213 @@
+import threading
+import FPJ_CLOCK
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from FPJ_JSON import JsonHelper
+
+# Upper bucket edges in seconds; durations above the last edge land in the overflow bucket
+BUCKET_EDGES: List[float] = [0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800]
+
+IDLE_PHASE: str = "--"  # Key for time spent outside any activity
+
+
+class Histogram:
+    """Fixed-bucket duration histogram that can be merged into a JSON dict."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKET_EDGES) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, seconds: float) -> None:
+        """Adds one duration sample."""
+        index = len(BUCKET_EDGES)
+        for i, edge in enumerate(BUCKET_EDGES):
+            if seconds <= edge:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge_into(self, stored: dict) -> dict:
+        """Merges this histogram into a stored histogram dict and returns it."""
+        counts = stored.get("counts", [0] * len(self.counts))
+        stored["counts"] = [a + b for a, b in zip(counts, self.counts)]
+        stored["count"] = stored.get("count", 0) + self.count
+        stored["total"] = round(stored.get("total", 0.0) + self.total, 6)
+        if self.min is not None:
+            stored["min"] = round(min(stored.get("min", self.min), self.min), 6)
+            stored["max"] = round(max(stored.get("max", self.max), self.max), 6)
+        stored["mean"] = round(stored["total"] / stored["count"], 6) if stored["count"] else 0.0
+        return stored
+
+
+class CycleProfiler:
+    """
+    Records how long every batch phase and every blocking wait takes.
+
+    Phases are keyed on the activity codes shown by FPJ_LCD.display_activity.
+    Waits (relay on-times, settle sleeps, stepper moves, scale round-trips) are
+    attributed to the phase that is active when they happen. Each thread keeps
+    its own phase, so overlapping batches book their waits separately; a
+    thread that never entered one (an async worker) waits in the phase entered
+    last. Worker threads run inside worker(), which closes their phase when
+    they finish instead of leaving it open until the batch ends. A wait nested
+    in another one on the same thread is booked as "outer > inner" (e.g.
+    "stepper_move > power_settle"), so the outer kinds still add up. Per-phase
+    histograms accumulate across batches in a local metrics file; the last
+    batch also keeps each ingredient's scale reads and cutoff error.
+    """
+
+    def __init__(self, filename: str = "FPJ_METRICS.json") -> None:
+        self.filename: str = filename
+        self.batch_start: Optional[float] = None
+        self.phase: str = IDLE_PHASE  # Phase entered last, by any thread
+        # Thread ident -> (phase, start) of the phase it is in; None holds the idle time before the first phase
+        self.open: Dict[Optional[int], Tuple[str, float]] = {None: (IDLE_PHASE, FPJ_CLOCK.monotonic())}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Per-thread stack of the waits in progress
+        self.transitions: List[dict] = []
+        self.phase_times: Dict[str, Histogram] = {}
+        self.wait_times: Dict[str, Dict[str, Histogram]] = {}
+        self.dispensing: Dict[str, dict] = {}
+
+    @staticmethod
+    def phase_key(activity: int, name: str = "") -> str:
+        """Builds the metrics key for an activity code."""
+        return f"{activity:02d} {name}".strip()
+
+    def start_batch(self) -> None:
+        """Starts timing a new batch and clears the per-batch samples."""
+        now = FPJ_CLOCK.monotonic()
+        self.batch_start = now
+        self.phase = IDLE_PHASE
+        self.open = {None: (IDLE_PHASE, now)}
+        self.transitions = []
+        self.phase_times = {}
+        self.wait_times = {}
+        self.dispensing = {}
+        print("[PROFILE] Batch timing started.")
+
+    def enter_phase(self, activity: int, name: str = "") -> None:
+        """Closes the calling thread's current phase and starts timing the given activity."""
+        now = FPJ_CLOCK.monotonic()
+        ident = threading.get_ident()
+        with self.lock:
+            for thread in (None, ident):
+                if thread in self.open:
+                    self._close_phase(*self.open.pop(thread), now)
+            self.phase = self.phase_key(activity, name)
+            self.open[ident] = (self.phase, now)
+            if self.batch_start is not None:
+                self.transitions.append({"phase": self.phase, "at": round(now - self.batch_start, 6)})
+
+    def leave_phase(self) -> None:
+        """Closes the calling thread's phase; waits without one go to the phase still open that started last."""
+        now = FPJ_CLOCK.monotonic()
+        with self.lock:
+            if threading.get_ident() not in self.open:
+                return
+            self._close_phase(*self.open.pop(threading.get_ident()), now)
+            self.phase = max(self.open.values(), key=lambda entry: entry[1], default=(IDLE_PHASE,))[0]
+
+    @contextmanager
+    def worker(self) -> Iterator[None]:
+        """Runs the enclosed block as a short-lived worker whose phase closes when the block ends."""
+        try:
+            yield
+        finally:
+            self.leave_phase()
+
+    def _close_phase(self, phase: str, start: float, now: float) -> None:
+        self.phase_times.setdefault(phase, Histogram()).add(now - start)
+
+    def current_phase(self) -> str:
+        """The calling thread's phase, or the one entered last if it has none."""
+        return self.open.get(threading.get_ident(), (self.phase,))[0]
+
+    def record_wait(self, kind: str, seconds: float) -> None:
+        """Attributes a blocking wait of the given kind to the calling thread's phase."""
+        with self.lock:
+            waits = self.wait_times.setdefault(self.current_phase(), {})
+            waits.setdefault(kind, Histogram()).add(seconds)
+
+    def record_dispense(self, name: str, reads: int, error: float) -> None:
+        """Records how many scale reads an ingredient took and how far past its target it ended."""
+        self.dispensing[name] = {"reads": reads, "cutoff_error": round(error, 1)}
+
+    @contextmanager
+    def wait(self, kind: str) -> Iterator[None]:
+        """Times the enclosed block as a blocking wait of the given kind, under the waits it is nested in."""
+        outer = getattr(self.local, "stack", [])
+        self.local.stack = outer + [kind]
+        start = FPJ_CLOCK.monotonic()
+        try:
+            yield
+        finally:
+            self.local.stack = outer
+            self.record_wait(" > ".join(outer + [kind]), FPJ_CLOCK.monotonic() - start)
+
+    def end_batch(self, completed: bool = True) -> None:
+        """Closes the batch and merges its samples into the metrics file."""
+        if self.batch_start is None:
+            return
+        now = FPJ_CLOCK.monotonic()
+        with self.lock:
+            for phase, start in self.open.values():
+                self._close_phase(phase, start, now)
+            self.open = {}
+        total = now - self.batch_start
+        self.batch_start = None
+
+        helper = JsonHelper(self.filename)
+        data = helper.get_all()
+        data["batches"] = data.get("batches", 0) + 1
+        self._single(total).merge_into(data.setdefault("batch", {}))
+
+        phases = data.setdefault("phases", {})
+        for phase, histogram in self.phase_times.items():
+            histogram.merge_into(phases.setdefault(phase, {}))
+
+        waits = data.setdefault("waits", {})
+        for phase, kinds in self.wait_times.items():
+            stored = waits.setdefault(phase, {})
+            for kind, histogram in kinds.items():
+                histogram.merge_into(stored.setdefault(kind, {}))
+
+        data["bucket_edges"] = BUCKET_EDGES
+        data["last_batch"] = {
+            "completed": completed,
+            "total": round(total, 6),
+            "transitions": self.transitions,
+            "phases": {phase: round(h.total, 6) for phase, h in self.phase_times.items()},
+            "waits": {
+                phase: {kind: round(h.total, 6) for kind, h in kinds.items()}
+                for phase, kinds in self.wait_times.items()
+            },
+            "dispensing": self.dispensing,
+        }
+        helper.set_all(data)
+        print(f"[PROFILE] Batch took {total:.1f}s. Metrics saved to {self.filename}.")
+
+    @staticmethod
+    def _single(seconds: float) -> Histogram:
+        histogram = Histogram()
+        histogram.add(seconds)
+        return histogram
+
+    def report(self) -> None:
+        """Prints where the time of the current batch went, slowest phase first."""
+        for phase, histogram in sorted(self.phase_times.items(), key=lambda item: -item[1].total):
+            print(f"[PROFILE] {phase}: {histogram.total:.2f}s")
+            for kind, wait in sorted(self.wait_times.get(phase, {}).items(), key=lambda item: -item[1].total):
+                print(f"[PROFILE]     {kind}: {wait.total:.2f}s over {wait.count} waits")
+        for name, dispense in self.dispensing.items():
+            print(f"[PROFILE] {name}: {dispense['reads']} scale reads, cutoff error {dispense['cutoff_error']:+.1f}g")
+
+
+profiler = CycleProfiler()  # Shared instance used by all FPJ modules
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+RECIPE_FILE: str = os.environ.get(
+    "FPJ_RECIPE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "FPJ_RECIPE.json")
+)
+
+# What the machine can dispense. A recipe refers to these by name; everything
+# else about a hopper (where its weight is saved, its LCD line and activity code,
+# whether its output goes through the chopper) is fixed by the hardware.
+ACTUATORS: Dict[str, dict] = {
+    "kakawate": {"json_key": "KakawateWeight", "label": "Kakawate", "lcd_line": 0, "activity": 2, "chopped": True},
+    "neem": {"json_key": "NeemWeight", "label": "Neem", "lcd_line": 1, "activity": 3, "chopped": True},
+    "molasses": {"json_key": "MolassesWeight", "label": "Molasses", "lcd_line": 2, "activity": 4, "chopped": False},
+    "water": {"json_key": "WaterWeight", "label": "Water", "lcd_line": 3, "activity": 5, "chopped": False},
+}
+
+
+class RecipeError(ValueError):
+    """Raised when a recipe file cannot be compiled into a plan."""
+
+
+class PlanStep:
+    """One ingredient of a compiled plan, with its targets already scaled."""
+
+    def __init__(self, name: str, actuator: str, target: int, tolerance: int, step: float) -> None:
+        self.name = name
+        self.actuator = actuator
+        self.target = target
+        self.tolerance = tolerance
+        self.step = step
+        hardware = ACTUATORS[actuator]
+        self.json_key: str = hardware["json_key"]
+        self.label: str = hardware["label"]
+        self.lcd_line: int = hardware["lcd_line"]
+        self.activity: int = hardware["activity"]
+        self.chopped: bool = hardware["chopped"]
+
+    def is_enough(self, weight: float) -> bool:
+        return weight >= self.target - self.tolerance
+
+    def __repr__(self) -> str:
+        return f"PlanStep({self.name}, {self.actuator}, {self.target}g ±{self.tolerance}g, step={self.step}s)"
+
+
+class Plan:
+    """A validated recipe: ingredients in dispensing order plus the mix duration."""
+
+    def __init__(self, name: str, steps: List[PlanStep], mix_duration: float, scale: float) -> None:
+        self.name = name
+        self.steps = steps
+        self.mix_duration = mix_duration
+        self.scale = scale
+
+    def step(self, name: str) -> PlanStep:
+        for step in self.steps:
+            if step.name == name:
+                return step
+        raise KeyError(f"Ingredient {name} is not in recipe {self.name}")
+
+    def for_actuator(self, actuator: str) -> Optional[PlanStep]:
+        for step in self.steps:
+            if step.actuator == actuator:
+                return step
+        return None
+
+    @property
+    def targets(self) -> Dict[str, int]:
+        return {step.name: step.target for step in self.steps}
+
+    def describe(self) -> None:
+        print(f"[RECIPE] {self.name} (scale x{self.scale}, mix {self.mix_duration}s)")
+        for number, step in enumerate(self.steps, start=1):
+            chopper = " [chopper]" if step.chopped else ""
+            print(f"[RECIPE]  {number}. {step.name}: {step.target}g ±{step.tolerance}g via {step.actuator}, {step.step}s pulses{chopper}")
+
+
+def _number(entry: dict, key: str, where: str, default: Optional[float] = None, minimum: float = 0.0) -> float:
+    value = entry.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RecipeError(f"{where}: '{key}' must be a number")
+    if value < minimum:
+        raise RecipeError(f"{where}: '{key}' must be at least {minimum}")
+    return value
+
+
+def _order(ingredients: List[dict]) -> List[dict]:
+    """Orders ingredients so every one comes after those in its 'after' list, otherwise keeping file order."""
+    remaining = list(ingredients)
+    placed: List[str] = []
+    ordered: List[dict] = []
+    while remaining:
+        for entry in remaining:
+            if all(name in placed for name in entry.get("after", [])):
+                break
+        else:
+            names = ", ".join(entry["name"] for entry in remaining)
+            raise RecipeError(f"Order constraints form a cycle between: {names}")
+        remaining.remove(entry)
+        placed.append(entry["name"])
+        ordered.append(entry)
+    return ordered
+
+
+def compile_recipe(data: dict, scale: Optional[float] = None) -> Plan:
+    """
+    Validates a recipe and compiles it into a plan.
+
+    Args:
+        data (dict): The parsed recipe file.
+        scale (float): Batch size multiplier; overrides the recipe's own 'batch_scale'.
+
+    Returns:
+        Plan: Ingredients in dispensing order with scaled targets.
+    """
+    name = data.get("name", "Unnamed recipe")
+    if scale is None:
+        scale = _number(data, "batch_scale", name, default=1.0)
+    if scale <= 0:
+        raise RecipeError(f"{name}: batch scale must be positive")
+    mix_duration = _number(data, "mix_duration", name)
+
+    ingredients = data.get("ingredients")
+    if not isinstance(ingredients, list) or not ingredients:
+        raise RecipeError(f"{name}: 'ingredients' must be a non-empty list")
+
+    names = set()
+    actuators = set()
+    for entry in ingredients:
+        where = f"{name}/{entry.get('name', '?')}"
+        if not entry.get("name"):
+            raise RecipeError(f"{where}: every ingredient needs a name")
+        if entry["name"] in names:
+            raise RecipeError(f"{where}: duplicate ingredient")
+        if entry.get("actuator") not in ACTUATORS:
+            raise RecipeError(f"{where}: unknown actuator '{entry.get('actuator')}', expected one of {sorted(ACTUATORS)}")
+        if entry["actuator"] in actuators:
+            raise RecipeError(f"{where}: actuator '{entry['actuator']}' is already used by another ingredient")
+        names.add(entry["name"])
+        actuators.add(entry["actuator"])
+
+    for entry in ingredients:
+        unknown = [other for other in entry.get("after", []) if other not in names]
+        if unknown:
+            raise RecipeError(f"{name}/{entry['name']}: 'after' refers to unknown ingredients {unknown}")
+
+    steps = []
+    for entry in _order(ingredients):
+        where = f"{name}/{entry['name']}"
+        target = _number(entry, "target", where)
+        tolerance = _number(entry, "tolerance", where, default=0)
+        if target <= 0 or tolerance >= target:
+            raise RecipeError(f"{where}: target must be positive and larger than the tolerance")
+        step = _number(entry, "step", where)
+        if step <= 0:
+            raise RecipeError(f"{where}: 'step' must be positive")
+        steps.append(PlanStep(entry["name"], entry["actuator"], round(target * scale), round(tolerance * scale), step))
+
+    return Plan(name, steps, mix_duration, scale)
+
+
+_plans: Dict[Tuple[str, int, Optional[float]], Plan] = {}
+
+
+def load_plan(filename: str = RECIPE_FILE, scale: Optional[float] = None) -> Plan:
+    """
+    Loads, validates and compiles a recipe file, caching the plan until the file changes.
+
+    The batch scale defaults to the FPJ_BATCH_SCALE environment variable, then the recipe's own.
+    """
+    if scale is None and os.environ.get("FPJ_BATCH_SCALE"):
+        scale = float(os.environ["FPJ_BATCH_SCALE"])
+    path = os.path.abspath(filename)
+    try:
+        key = (path, os.stat(path).st_mtime_ns, scale)
+    except OSError as e:
+        raise RecipeError(f"Cannot read recipe {filename}: {e}") from e
+    if key not in _plans:
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except ValueError as e:
+            raise RecipeError(f"{filename} is not valid JSON: {e}") from e
+        _plans[key] = compile_recipe(data, scale)
+        print(f"[RECIPE] Loaded {_plans[key].name} from {filename}")
+    return _plans[key]
+
+
+# Usage:
+#   python3 FPJ_RECIPE.py [recipe.json] [scale]     validate a recipe and print its plan
+if __name__ == "__main__":
+    try:
+        load_plan(
+            sys.argv[1] if len(sys.argv) > 1 else RECIPE_FILE,
+            float(sys.argv[2]) if len(sys.argv) > 2 else None,
+        ).describe()
+    except RecipeError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
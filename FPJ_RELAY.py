@@ -1,14 +1,13 @@
-import board
-import digitalio
-from time import sleep  # Importing only sleep
-from adafruit_pcf8575 import PCF8575
+from FPJ_CLOCK import sleep
 from FPJ_LIMITSWITCH import LimitStatus
 from FPJ_SERVO import ServoController
 import FPJ_PCF
+from FPJ_PROFILER import profiler
 
 pcf = FPJ_PCF.pcf_relay
 
 LimitSwitch = LimitStatus()
+outputs = []  # Every Relay and OutputController, for write_counts()
 
 class Relay:
     PcfRelay = pcf
@@ -19,6 +18,9 @@ class Relay:
         self.pin_number = pin_number
         self.pin = self.PcfRelay.get_pin(pin_number)
         self.pin.switch_to_output(value=True)  # Default OFF state
+        self.writes: int = 0
+        self.skipped: int = 0  # Writes left out because the relay already had that state
+        outputs.append(self)
         
         # Add the pin to the used_pins list
         Relay.used_pins.append(pin_number)
@@ -32,23 +34,39 @@ class Relay:
                 pin.switch_to_output(value=True)  # Set to OFF (active low logic)
                 print(f"Relay on pin {pin_number} is OFF (unused).")
 
-    def turn_on(self) -> None:
-        """Turn on the relay (set pin to LOW, since it's active low)."""
-        self.pin.value = False  # Active low logic
+    def turn_on(self, force: bool = False) -> None:
+        """Turn on the relay (set pin to LOW, since it's active low). Skipped if already on unless forced."""
+        self._count(self.PcfRelay.write_pin(self.pin_number, False, force))  # Active low logic
 
-    def turn_off(self) -> None:
-        """Turn off the relay (set pin to HIGH)."""
-        self.pin.value = True  # Active high logic
+    def turn_off(self, force: bool = False) -> None:
+        """Turn off the relay (set pin to HIGH). Skipped if already off unless forced."""
+        self._count(self.PcfRelay.write_pin(self.pin_number, True, force))  # Active high logic
 
-    def run(self, on_time: float) -> None:
-        """Turn on and off the relay with specified times."""
+    def _count(self, written: bool) -> None:
+        if written:
+            self.writes += 1
+        else:
+            self.skipped += 1
+
+    def run(self, on_time: float, until=None) -> None:
+        """
+        Turn on and off the relay with specified times. With until (a blocking
+        wait such as Scale.wait_hit), the relay stays on only until it returns.
+        """
         self.turn_on()
         print(f"{self.name} is turned ON.")
-        sleep(on_time)
-
-        self.turn_off()
-        print(f"{self.name} is turned OFF.")
-        sleep(3)
+        try:
+            with profiler.wait("relay_on"):
+                if until:
+                    until(on_time)
+                else:
+                    sleep(on_time)
+        finally:
+            # until does scale I/O and may raise; the dispenser must not keep running meanwhile
+            self.turn_off()
+            print(f"{self.name} is turned OFF.")
+        with profiler.wait("relay_cooldown"):
+            sleep(3)
 
 class RelayController:
     # Relay instances for each device
@@ -72,41 +90,45 @@ class RelayController:
         
         sleep(5)
 
-    def pump_water(self, duration: float) -> None:
+    def pump_water(self, duration: float, until=None) -> None:
         """Activate water pump for a specific duration."""
-        self.WaterPumpRelay.run(duration)
+        self.WaterPumpRelay.run(duration, until)
 
-    def dispense_neem(self, duration: float) -> None:
+    def dispense_neem(self, duration: float, until=None) -> None:
         """Activate neem dispenser for a specific duration."""
-        self.NeemRelay.run(duration)
+        self.NeemRelay.run(duration, until)
 
-    def dispense_kakawate(self, duration: float) -> None:
+    def dispense_kakawate(self, duration: float, until=None) -> None:
         """Activate kakawate dispenser for a specific duration."""
-        self.KakawateRelay.run(duration)
+        self.KakawateRelay.run(duration, until)
 
     def enable_stepper(self) -> None:
         """Enable the stepper motor power supply."""
         self.StepperPowerRelay.turn_on()
         print("Stepper motor power supply is turned ON.")
-        sleep(3)
+        with profiler.wait("power_settle"):
+            sleep(3)
 
     def disable_stepper(self) -> None:
         """Disable the stepper motor power supply."""
         self.StepperPowerRelay.turn_off()
         print("Stepper motor power supply is turned OFF.")
-        sleep(3)
+        with profiler.wait("power_settle"):
+            sleep(3)
 
     def enable_servo(self) -> None:
         """Enable the servo motor power supply."""
         self.ServoPowerRelay.turn_on()
         print("Servo motor power supply is turned ON.")
-        sleep(3)
+        with profiler.wait("power_settle"):
+            sleep(3)
 
     def disable_servo(self) -> None:
         """Disable the servo motor power supply."""
         self.ServoPowerRelay.turn_off()
         print("Servo motor power supply is turned OFF.")
-        sleep(3)
+        with profiler.wait("power_settle"):
+            sleep(3)
 
     def mix(self, duration: float) -> None:
         """Activate the mixer motor for a specific duration."""
@@ -116,34 +138,38 @@ class RelayController:
         """Move the mixer down."""
         print("Moving mixer down...")
         self.MixerDownRelay.turn_on()
-        while not LimitSwitch.is_mixer_down():
-            print("Waiting to reach down position...")
-            sleep(1)
+        with profiler.wait("mixer_travel"):
+            while not LimitSwitch.is_mixer_down():
+                print("Waiting to reach down position...")
+                sleep(1)
         self.MixerDownRelay.turn_off()
         print("Mixer reached down position.")
-        sleep(3)
+        with profiler.wait("mixer_settle"):
+            sleep(3)
 
     def mixer_up(self) -> None:
         """Move the mixer up."""
         print("Moving mixer up...")
         self.MixerUpRelay.turn_on()
-        while not LimitSwitch.is_mixer_up():
-            print("Waiting to reach up position...")
-            sleep(1)
+        with profiler.wait("mixer_travel"):
+            while not LimitSwitch.is_mixer_up():
+                print("Waiting to reach up position...")
+                sleep(1)
         self.MixerUpRelay.turn_off()
         print("Mixer reached up position.")
-        sleep(3)
+        with profiler.wait("mixer_settle"):
+            sleep(3)
 
     def add_molasses(self, duration: int = 5) -> None:
         """Dispense molasses for a given duration (default is 5 seconds)."""
-        self.enable_servo()
-        print(f"Starting to dispense molasses for {duration} seconds...")
-        self.MolassesDispenser.open()
-        sleep(duration)
-        self.MolassesDispenser.close()
-        self.disable_servo()
+        with self.molasses_session() as session:
+            session.dispense(duration)
         print("Finished dispensing molasses.")
 
+    def molasses_session(self, approach_time: float = 10.0) -> "MolassesSession":
+        """Create a molasses session that keeps the servo powered between pulses."""
+        return MolassesSession(self, approach_time=approach_time)
+
     def turn_on_chopper(self) -> None:
         """Turn on the chopper via the relay."""
         if not self.IsChopperRunning:
@@ -170,26 +196,94 @@ class RelayController:
         print("Charge")
         self.ChargerRelay.turn_on()
 
-    def shutdown(self) -> None:
-        """Shutdown all relays."""
-        
-        self.ChopperRelay.turn_off()
-        self.MixerRelay.turn_off()
-        self.WaterPumpRelay.turn_off()
-        self.ServoPowerRelay.turn_off()
-        self.NeemRelay.turn_off()
-        self.KakawateRelay.turn_off()
-        self.StepperPowerRelay.turn_off()
-        self.MixerDownRelay.turn_off()
-        self.MixerUpRelay.turn_off()
-        self.SmpsRelay.turn_off()
-        self.ChargerRelay.turn_off()
+    def shutdown(self, force: bool = False) -> None:
+        """
+        Shutdown all relays. Relays already off are skipped; force writes
+        every one, for exits after an error when the chip state is in doubt.
+        """
+        self.IsChopperRunning = False
+        self.ChopperRelay.turn_off(force)
+        self.MixerRelay.turn_off(force)
+        self.WaterPumpRelay.turn_off(force)
+        self.ServoPowerRelay.turn_off(force)
+        self.NeemRelay.turn_off(force)
+        self.KakawateRelay.turn_off(force)
+        self.StepperPowerRelay.turn_off(force)
+        self.MixerDownRelay.turn_off(force)
+        self.MixerUpRelay.turn_off(force)
+        self.SmpsRelay.turn_off(force)
+        self.ChargerRelay.turn_off(force)
+
+class MolassesSession:
+    """
+    Keeps the molasses servo powered for a whole dispensing run.
+
+    The servo supply is switched on once when the session starts and off once
+    when it stops. In between the valve is held at the angle for the flow rate
+    the servo's calibrated flow table gives for the remaining deficit: wide
+    open far from the target, throttled down on the final approach.
+    """
+
+    def __init__(self, controller: RelayController, approach_time: float = 10.0) -> None:
+        self.controller = controller
+        self.servo = controller.MolassesDispenser
+        self.approach_time = approach_time  # Seconds of flow left when throttling starts
+        self.flow_rate: float = self.servo.max_flow
+        self.pulses: int = 0
+        self.active: bool = False
+
+    def __enter__(self) -> "MolassesSession":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Power the servo and make sure the valve starts closed."""
+        if not self.active:
+            self.controller.enable_servo()
+            self.servo.close()
+            self.active = True
+            print("Molasses session started.")
+
+    def stop(self) -> None:
+        """Close the valve and power the servo down."""
+        if self.active:
+            self.servo.close()
+            self.controller.disable_servo()
+            self.active = False
+            print(f"Molasses session finished after {self.pulses} pulses.")
+
+    def update(self, weight: float, deficit: float) -> None:
+        """Command the flow rate for the weight still missing."""
+        self.flow_rate = self.servo.flow_for_deficit(deficit - weight, self.approach_time)
+        if self.active:
+            self.servo.command_flow(self.flow_rate)
+
+    def dispense(self, duration: float, until=None) -> None:
+        """Hold the valve at the commanded flow rate for the given duration, or until until() returns."""
+        if not self.active:
+            self.start()
+        print(f"Dispensing molasses for {duration} seconds at {self.flow_rate:.1f} g/s...")
+        self.servo.command_flow(self.flow_rate)
+        with profiler.wait("valve_open"):
+            if until:
+                if until(duration):
+                    self.servo.close()  # Target reached; stop the flow now, not at the next update
+            else:
+                sleep(duration)
+        self.pulses += 1
 
 class OutputController:
     def __init__(self, pin_number: int, name: str) -> None:
         self.name = name
+        self.pin_number = pin_number
         self.available = FPJ_PCF.limit_switch_ready
         self.pcf = FPJ_PCF.pcf_limitswitch
+        self.writes: int = 0
+        self.skipped: int = 0  # Writes left out because the output already had that state
+        outputs.append(self)
 
         if self.available and self.pcf is not None:
             try:
@@ -199,17 +293,33 @@ class OutputController:
                 print(f"Error setting up pin {pin_number} for {name}: {e}")
                 self.available = False
 
-    def turn_on(self) -> None:
-        """Turn on the output device."""
+    def turn_on(self, force: bool = False) -> None:
+        """Turn on the output device. Skipped if already on unless forced."""
         if self.available:
             #print(f"Turning ON {self.name}")
-            self.pin.value = False
+            self._count(self.pcf.write_pin(self.pin_number, False, force))
 
-    def turn_off(self) -> None:
-        """Turn off the output device."""
+    def turn_off(self, force: bool = False) -> None:
+        """Turn off the output device. Skipped if already off unless forced."""
         if self.available:
             #print(f"Turning OFF {self.name}")
-            self.pin.value = True
+            self._count(self.pcf.write_pin(self.pin_number, True, force))
+
+    def _count(self, written: bool) -> None:
+        if written:
+            self.writes += 1
+        else:
+            self.skipped += 1
+
+
+def write_counts() -> dict:
+    """Pin writes made and skipped so far by each relay and output, by name."""
+    counts = {}
+    for output in outputs:
+        count = counts.setdefault(output.name, {"writes": 0, "skipped": 0})
+        count["writes"] += output.writes
+        count["skipped"] += output.skipped
+    return counts
 
 # Test function (not in production)
 def test_all_relays():
@@ -1,60 +1,847 @@
-import serial
+import glob
+import os
+import struct
+import threading
 import time
+import serial
+import FPJ_CLOCK
 import math
+from typing import Callable, Dict, List, Optional, Tuple
+from FPJ_PROFILER import profiler
+import FPJ_PCF
+import FPJ_TRACE
+
+try:
+    import numpy as np
+except ImportError:  # Optional: without NumPy, samples decode to lists of (seq, ms, grams) tuples
+    np = None
+
+SCALE_PORT: str = os.environ.get("FPJ_SCALE_PORT", "")  # Port to try first; others are probed if it has no ESP32
+PORT_PATTERNS = ("/dev/ttyUSB*", "/dev/ttyACM*")  # Where else a USB serial adapter can enumerate
+FIRMWARE_ID: str = "FPJ-SCALE"  # First field of the firmware's ID reply
+CONNECT_TIMEOUT: float = 3.0    # Seconds a port gets to answer ID after it is opened (ESP32 reset and boot)
+PROBE_INTERVAL: float = 0.1     # Seconds between ID probes while the ESP32 boots
+PROBE_TIMEOUT: float = 0.05     # Seconds a booted ESP32 takes at most to answer a probe
+RECONNECT_TIMEOUT: float = 15.0  # Seconds to keep looking for the ESP32 after the link failed
+RECONNECT_INTERVAL: float = 0.5  # Seconds between rounds of looking
+ORIGINAL_BOOT: float = 2.0      # Seconds the original firmware, which has no ID, gets to boot after the port opens
+REPLY_TIMEOUT: float = 5.0  # Seconds to wait for a tagged reply before giving up on it
+READ_POLL: float = 0.0005   # Seconds a waiting thread sleeps between checks for input (real time)
+ARM_TIMEOUT: float = 0.5    # Seconds to wait for ARMED; firmware without the alarm answers ERR or nothing
+HIT_POLL: float = 0.005     # Seconds between checks for a HIT line while waiting for one
+CONVERSION_TIME: float = 1 / 80  # Seconds per HX711 conversion (80 samples per second)
+MAX_AVERAGE: int = 255      # Most conversions one WEIGHT,<n> averages
+DRIFT_LIMIT: float = 10.0   # Grams the scale may read off the baseline before zero() makes a full tare
+TARE_SETTLE: float = 0.5    # Seconds the HX711 gets to settle after a full tare
+SAMPLE_INTERVAL: float = 0.2       # Seconds of flow between dispensing reads until the flow rate is known
+MIN_SAMPLE_INTERVAL: float = 0.025  # Densest dispensing reads, about two HX711 conversions apart
+MAX_SAMPLE_INTERVAL: float = 10.0  # Sparsest dispensing reads, in seconds of flow
+APPROACH_FRACTION: float = 0.5     # Share of the predicted flow time to the limit before the next read
+RATE_SMOOTHING: float = 0.5        # Weight of the newest flow rate in the running estimate
+MAX_TAG: int = 255          # Request tags run 1..MAX_TAG and wrap
+STREAM_CHUNK: int = 4096    # Most bytes read at once while streaming
+
+# Firmware that does not tag its replies: the reply lines each command can get, by command name
+UNTAGGED_REPLIES: Dict[str, Tuple[str, ...]] = {
+    "ID": ("ID,",),
+    "TARE": ("TARED",),
+    "WEIGHT": ("WT,", "WS,"),
+    "STATUS": ("STATUS,",),
+    "CAL": ("CAL,",),
+    "ARM": ("ARMED",),
+    "DISARM": ("DISARMED",),
+    "STREAM": ("STREAMING",),
+}
+
+# === Binary sample stream ===
+# After 'STREAM,<hz>' the firmware pushes one fixed-size little-endian record per sample:
+#   <BHIfB  sync 0xA5, sequence number, ms since boot, grams, checksum (sum of the other bytes mod 256)
+# Text lines (replies, HIT) go on between records; none starts with 0xA5.
+SAMPLE_SYNC: int = 0xA5
+SAMPLE_RECORD = struct.Struct("<BHIfB")
+SAMPLE_DTYPE = None if np is None else np.dtype(
+    [("sync", "u1"), ("seq", "<u2"), ("ms", "<u4"), ("grams", "<f4"), ("checksum", "u1")]
+)
+
+
+def decode_samples(data, offset: int = 0):
+    """
+    Decodes the run of valid sample records in data (bytes, bytearray or
+    memoryview) starting at offset. Returns (records, end), end being the
+    offset after the last valid record. With NumPy, records is a structured
+    array viewing data without copying (fields seq, ms, grams); otherwise a
+    list of (seq, ms, grams) tuples.
+    """
+    size = SAMPLE_RECORD.size
+    count = (len(data) - offset) // size
+    if np is not None:
+        raw = np.frombuffer(data, np.uint8, count * size, offset).reshape(count, size)
+        valid = (raw[:, 0] == SAMPLE_SYNC) & (raw[:, :-1].sum(axis=1, dtype=np.uint8) == raw[:, -1])
+        count = count if valid.all() else int(valid.argmin())
+        return np.frombuffer(data, SAMPLE_DTYPE, count, offset), offset + count * size
+
+    records = []
+    view = memoryview(data)
+    for start in range(offset, offset + count * size, size):
+        sync, seq, ms, grams, checksum = SAMPLE_RECORD.unpack_from(view, start)
+        if sync != SAMPLE_SYNC or sum(view[start:start + size - 1]) & 0xFF != checksum:
+            return records, start
+        records.append((seq, ms, grams))
+    return records, offset + count * size
+
+
+class ScaleTimeout(Exception):
+    """Raised when the ESP32 does not answer a request in time."""
+
+
+class ScaleRequest:
+    """One tagged command in flight; result() waits for its reply."""
+
+    def __init__(self, scale: "Scale", tag: int, command: str) -> None:
+        self.scale = scale
+        self.tag = tag
+        self.command = command
+        self.sent: float = time.perf_counter()
+        self.reply: Optional[str] = None
+        self.round_trip: Optional[float] = None  # Seconds from write to reply
+
+    @property
+    def done(self) -> bool:
+        return self.reply is not None
+
+    def result(self, timeout: float = REPLY_TIMEOUT) -> str:
+        """Returns the reply line without its tag, reading (and routing) lines until it arrives."""
+        return self.scale._wait(self, timeout)
+
 
 class Scale:
-    def __init__(self, port: str, baud_rate: int = 115200) -> None:
-        self.serial_connection = serial.Serial(port, baud_rate)
-        time.sleep(2)  # Wait for the connection to be established
+    """
+    Client for the ESP32 scale firmware.
+
+    Commands are framed as ``<tag>:<COMMAND>`` and answered ``<tag>:<reply>``,
+    so several requests (tare, weight, status, calibration) can be in flight
+    at once and every reply reaches the caller that sent it, however late it
+    arrives. The only untagged lines are the firmware's unsolicited ``HIT``
+    alarms. Firmware that answers without tags (the original TARE/WEIGHT
+    firmware) is detected by its first bare reply; from then on commands go
+    out bare, one at a time. send() returns a ScaleRequest without waiting;
+    request() waits.
+    While stream() is on, binary sample records arrive between the lines;
+    read_samples() collects them.
+    Both are thread-safe: whichever waiting thread holds the read lock reads
+    the next line and routes it, so no reader thread is needed and replays
+    see the lines in the recorded order.
+
+    Weights are net of a software baseline: the settled reading captured at
+    the end of the previous ingredient (capture_baseline()), so ingredients
+    follow each other without a hardware tare. zero() only tares when there
+    is no baseline yet or the scale has drifted off it. Streamed samples are
+    the firmware's grams, before the baseline is taken off.
+
+    The ESP32 is looked for on the given port, then on every other USB serial
+    port, and is ready as soon as its firmware answers ``ID``. If no port
+    answers, the original firmware (no ID, bare TARE and WEIGHT only) is
+    assumed on the first one, opened and given ORIGINAL_BOOT. When the link
+    fails (the adapter drops off the bus), the next read or write finds the
+    ESP32 again, wherever it re-enumerates, and resends the requests in flight.
+    """
+
+    def __init__(self, port: str, baud_rate: int = 115200, connection=None) -> None:
+        """Finds the ESP32, trying port first; connection is an already open serial-like object to use instead."""
+        # Opening the port resets the ESP32, so a tare is only valid for this connection
+        self.session: str = os.urandom(4).hex()
+        self.port = port
+        self.baud_rate = baud_rate
+        self.firmware: Optional[str] = None
+        self.generation: int = 0            # Connections made so far
+        self.connecting: Optional[int] = None  # Thread making the connection; its link errors are not retried
+        self.tares: int = 0                 # Zero references (tares and baselines) this session
+        self.baseline: Optional[float] = None  # Firmware grams net weights start from; None until tared
+        self.armed: bool = False
+        self.hit: Optional[Tuple[float, int]] = None  # (grams, firmware ms) of an alarm not yet waited for
+        self.on_hit: Optional[Callable[[float, int], None]] = None
+        self.lock = threading.Lock()        # Tags, in-flight requests and writes
+        self.read_lock = threading.RLock()  # Held by the thread reading the next line
+        self.routed = threading.Condition()  # Notified whenever a line has been read and routed
+        self.tag: int = 0
+        self.tagged: bool = True            # False once the firmware answered without a tag
+        self.turn = threading.Lock()        # Untagged: held while waiting for the wire to be free
+        self.in_flight: Dict[int, ScaleRequest] = {}
+        self.round_trips: int = 0
+        self.round_trip_time: float = 0.0   # Seconds, summed over all replies
+        self.streaming: bool = False
+        self.stream_rate: float = 0.0
+        self.stream_buffer: bytes = b""     # Incomplete record or line left from the last stream read
+        self.samples: List = []             # Decoded sample blocks not collected yet
+        self.last_seq: Optional[int] = None
+        self.samples_received: int = 0
+        self.samples_lost: int = 0          # Sequence numbers skipped (firmware buffer overruns)
+        self.sample_errors: int = 0         # Bytes skipped to resync after a bad record
+        if connection is not None:
+            self.serial_connection = connection
+            return
+        self.connect()
+
+    # === Connection ===
+    def candidate_ports(self) -> List[str]:
+        """Ports to probe for the ESP32, most likely first."""
+        if FPJ_TRACE.player:
+            return ["replay"]
+        if FPJ_PCF.BACKEND == "sim":
+            import FPJ_SIM
+
+            return [FPJ_SIM.esp32.port]  # Fake ESP32 on a pseudo-terminal, wherever it is plugged now
+        ports = [port for port in (SCALE_PORT, self.port) if port]
+        for pattern in PORT_PATTERNS:
+            ports += sorted(glob.glob(pattern))
+        return list(dict.fromkeys(ports))
+
+    def _open(self, port: str):
+        if FPJ_TRACE.player:
+            return FPJ_TRACE.player.serial()
+        return FPJ_TRACE.wrap_serial(serial.Serial(port, self.baud_rate))
+
+    def connect(self, timeout: float = CONNECT_TIMEOUT) -> None:
+        """
+        Opens the first candidate port whose firmware answers ID. If none does,
+        opens the first candidate for the original firmware; raises
+        ScaleTimeout only if there is no port to open.
+        """
+        candidates = self.candidate_ports()
+        self.connecting = threading.get_ident()
+        self.tagged = True  # Until the firmware on the new connection answers without a tag
+        try:
+            for port in candidates:
+                try:
+                    self.serial_connection = self._open(port)
+                    self.firmware = self._handshake(timeout)
+                except OSError as e:
+                    print(f"[SCALE] {port}: {e}")
+                    continue
+                if self.firmware:
+                    break
+                print(f"[SCALE] {port}: no ESP32 scale answered.")
+                self.serial_connection.close()
+            else:
+                port = self._open_original(candidates)
+        finally:
+            self.connecting = None
+        # Opening the port reset the ESP32: its tare, alarm and stream are gone
+        self.port = port
+        self.generation += 1
+        self.session = os.urandom(4).hex()
+        self.baseline = None
+        self.armed = False
+        self.stream_buffer = b""
+        print(f"[SCALE] {self.firmware or 'Original firmware'} ready on {port}.")
+
+    def _open_original(self, candidates: List[str]) -> str:
+        """Opens the most likely port the old way, for firmware that cannot identify itself."""
+        if not candidates:
+            raise ScaleTimeout("No serial port found for the ESP32 scale")
+        port = candidates[0]
+        print(f"[WARNING] No ESP32 answered ID; assuming the original scale firmware on {port}.")
+        try:
+            self.serial_connection = self._open(port)
+        except OSError as e:
+            raise ScaleTimeout(f"No ESP32 scale found on {', '.join(candidates)}: {e}")
+        self.firmware = None
+        self.tagged = False  # It only knows bare TARE and WEIGHT
+        FPJ_CLOCK.sleep(ORIGINAL_BOOT)  # Wait for the connection to be established
+        return port
+
+    def _handshake(self, timeout: float) -> Optional[str]:
+        """Probes with ID every PROBE_INTERVAL while the ESP32 boots; returns its identification, None if it is not one."""
+        deadline = FPJ_CLOCK.monotonic() + timeout
+        probes: List[ScaleRequest] = []
+        try:
+            while FPJ_CLOCK.monotonic() < deadline:
+                probes.append(self.send("ID"))
+                answer_by = time.monotonic() + PROBE_TIMEOUT  # Serial latency, so real time
+                while time.monotonic() < answer_by:
+                    answered = [probe.reply for probe in probes if probe.done]
+                    if answered:
+                        fields = answered[0].split(",")
+                        return ",".join(fields[1:]) if fields[:2] == ["ID", FIRMWARE_ID] else None
+                    if not self._pump(block=False):
+                        self._idle()
+                FPJ_CLOCK.sleep(PROBE_INTERVAL)  # Still booting, or not an ESP32
+            return None
+        finally:
+            with self.lock:
+                for probe in probes:
+                    self.in_flight.pop(probe.tag, None)
+
+    def _reconnect(self, generation: int, error: Exception) -> None:
+        """Finds the ESP32 again after the link failed and resends the requests in flight."""
+        with self.read_lock:
+            if self.generation != generation:
+                return  # Another thread reconnected already
+            print(f"[SCALE] Connection lost ({error}); looking for the ESP32 again...")
+            try:
+                self.serial_connection.close()
+            except OSError:
+                pass
+            deadline = FPJ_CLOCK.monotonic() + RECONNECT_TIMEOUT
+            while True:
+                try:
+                    self.connect()
+                    break
+                except ScaleTimeout:
+                    if FPJ_CLOCK.monotonic() >= deadline:
+                        raise
+                    FPJ_CLOCK.sleep(RECONNECT_INTERVAL)
+            with self.lock:
+                for request in self.in_flight.values():
+                    self._write(request)
+            if self.streaming:
+                self.send(f"STREAM,{self.stream_rate:g}")
+
+    # === Tagged requests ===
+    def _write(self, request: ScaleRequest) -> None:
+        line = f"{request.tag}:{request.command}" if self.tagged else request.command
+        self.serial_connection.write(f"{line}\n".encode("utf-8"))
+
+    def send(self, command: str) -> ScaleRequest:
+        """
+        Writes a command with a fresh tag and returns without waiting for its
+        reply. To firmware that does not tag, the command only goes out once
+        the request before it is answered (or has timed out).
+        """
+        if self.tagged:
+            return self._send(command)
+        with self.turn:
+            self._wait_turn()
+            return self._send(command)
+
+    def _wait_turn(self) -> None:
+        deadline = time.monotonic() + REPLY_TIMEOUT  # Serial latency, so real time
+        while self.in_flight:
+            if self._pump():
+                continue
+            if time.monotonic() >= deadline:
+                with self.lock:
+                    for request in self.in_flight.values():
+                        print(f"[SCALE] No reply to {request.command}; sending the next command anyway.")
+                    self.in_flight.clear()
+            else:
+                self._idle()
+
+    def _send(self, command: str) -> ScaleRequest:
+        with self.lock:
+            self.tag = self.tag % MAX_TAG + 1
+            request = ScaleRequest(self, self.tag, command)
+            self.in_flight[request.tag] = request
+            generation = self.generation
+            try:
+                self._write(request)
+                return request
+            except OSError as e:
+                if self.connecting == threading.get_ident():
+                    raise
+                error = e
+        self._reconnect(generation, error)
+        return request
+
+    def request(self, command: str, timeout: float = REPLY_TIMEOUT) -> str:
+        """Sends a command and returns its reply line (without the tag)."""
+        return self.send(command).result(timeout)
+
+    def _wait(self, request: ScaleRequest, timeout: float) -> str:
+        deadline = time.monotonic() + timeout  # Serial latency, so real time
+        generation = self.generation
+        while request.reply is None:
+            if self.generation != generation:
+                # Reconnected and resent; the ESP32 answers from scratch
+                generation = self.generation
+                deadline = time.monotonic() + timeout
+            if self._pump():
+                continue
+            if time.monotonic() >= deadline:
+                with self.lock:
+                    self.in_flight.pop(request.tag, None)
+                raise ScaleTimeout(f"No reply to {request.command} (tag {request.tag}) within {timeout}s")
+            self._idle()
+        return request.reply
+
+    def _idle(self) -> None:
+        """Waits until another thread routes a line, or READ_POLL for input to arrive."""
+        with self.routed:
+            self.routed.wait(READ_POLL)
+
+    def _pump(self, block: bool = True) -> bool:
+        """
+        Reads and routes one line if one is waiting; returns False if there was
+        none, or, unless block is set, another thread is reading.
+        """
+        if not self.read_lock.acquire(blocking=block):
+            return False
+        try:
+            generation = self.generation
+            try:
+                waiting = self.serial_connection.in_waiting
+                if waiting <= 0:
+                    return False
+                if self.streaming or self.stream_buffer:
+                    self._read_stream(waiting)
+                else:
+                    self._route(self.serial_connection.readline().decode('utf-8', 'replace').strip())
+            except OSError as e:
+                if self.connecting == threading.get_ident():
+                    raise
+                self._reconnect(generation, e)
+            with self.routed:
+                self.routed.notify_all()
+            return True
+        finally:
+            self.read_lock.release()
+
+    def _route(self, line: str) -> None:
+        """Hands a reply to its request; an unsolicited HIT line is taken care of here, whoever reads it."""
+        tag, sep, reply = line.partition(":")
+        if sep and tag.isdigit():
+            with self.lock:
+                request = self.in_flight.pop(int(tag), None)
+            if request is None:
+                print(f"[SCALE] Reply for no pending request: {line}")
+                return
+            self._resolve(request, reply)
+        elif line.startswith("HIT,"):
+            self._on_hit_line(line)
+        elif line:
+            self._route_untagged(line)
+
+    def _route_untagged(self, line: str) -> None:
+        """Gives a bare reply line to the oldest request it can answer and stops tagging commands."""
+        with self.lock:
+            requests = sorted(self.in_flight.values(), key=lambda request: request.sent)
+            request = next((request for request in requests if self.answers(request.command, line)), None)
+            if request is not None:
+                self.in_flight.pop(request.tag)
+        if request is None:
+            print(f"[SCALE] Untagged line ignored: {line}")
+            return
+        if self.tagged:
+            print("[SCALE] The firmware answers without tags; sending one command at a time.")
+            self.tagged = False
+        self._resolve(request, line)
+
+    @staticmethod
+    def answers(command: str, line: str) -> bool:
+        """Whether an untagged line can be the reply to command."""
+        name = command.split(",")[0]
+        return line.startswith(UNTAGGED_REPLIES.get(name, ())) or line == f"ERR,{command}"
+
+    def _resolve(self, request: ScaleRequest, reply: str) -> None:
+        request.round_trip = time.perf_counter() - request.sent
+        self.round_trips += 1
+        self.round_trip_time += request.round_trip
+        request.reply = reply
+
+    def _read_stream(self, waiting: int) -> None:
+        """Reads raw bytes: runs of sample records are decoded in one go, text lines routed as usual."""
+        data = self.stream_buffer + self.serial_connection.read(min(waiting, STREAM_CHUNK))
+        position = 0
+        while position < len(data):
+            if data[position] == SAMPLE_SYNC:
+                if len(data) - position < SAMPLE_RECORD.size:
+                    break
+                records, end = decode_samples(data, position)
+                if end == position:
+                    self.sample_errors += 1  # Corrupt record; resync on the next byte
+                    position += 1
+                    continue
+                self._add_samples(records)
+                position = end
+            else:
+                newline = data.find(b"\n", position)
+                sync = data.find(SAMPLE_SYNC, position, newline if newline >= 0 else len(data))
+                if sync >= 0:
+                    # No text line holds the sync byte: this is the rest of a corrupt record
+                    self.sample_errors += sync - position
+                    position = sync
+                    continue
+                if newline < 0:
+                    break
+                self._route(data[position:newline].decode("utf-8", "replace").strip())
+                position = newline + 1
+        self.stream_buffer = data[position:]
+
+    def _add_samples(self, records) -> None:
+        last = records[-1][0] if np is None else int(records["seq"][-1])
+        if self.last_seq is not None:
+            self.samples_lost += (last - self.last_seq) % 0x10000 - len(records)
+        self.last_seq = last
+        self.samples_received += len(records)
+        self.samples.append(records)
 
-    def trigger_tare(self) -> bool:
+    def mean_round_trip(self) -> float:
+        """Mean seconds from writing a command to reading its reply, over this connection."""
+        return self.round_trip_time / self.round_trips if self.round_trips else 0.0
+
+    # === Commands ===
+    def trigger_tare(self, timeout: float = REPLY_TIMEOUT) -> bool:
         """
         Sends 'TARE' to the ESP32 and waits for the 'TARED' response.
         Returns True if tare is successful, False otherwise.
         """
-        self.serial_connection.write(b"TARE\n")
-        print("Sent TARE command to ESP32.")
-        
-        # Wait for the "TARED" response
-        while True:
-            if self.serial_connection.in_waiting > 0:
-                response = self.serial_connection.readline().decode('utf-8').strip()
-                print("ESP32 Response:", response)
-                if response == "TARED":
-                    return True
-        return False  # If the "TARED" response is never received, return False
+        with profiler.wait("scale_tare"):
+            request = self.send("TARE")
+            print("Sent TARE command to ESP32.")
+            try:
+                response = request.result(timeout)
+            except ScaleTimeout as e:
+                print(f"[ERROR] {e}")
+                return False
+            print("ESP32 Response:", response)
+            if response == "TARED":
+                self.tares += 1
+                self.baseline = 0.0
+                return True
+        return False
+
+    @property
+    def tare_id(self) -> str:
+        """Identifies what weights are measured from; it changes with every tare, baseline and new connection."""
+        return f"{self.session}/{self.tares}"
+
+    def net(self, grams: float) -> float:
+        """Firmware grams less the baseline."""
+        return grams - (self.baseline or 0.0)
 
     def get_weight(self) -> int:
         """
         Sends 'WEIGHT' to the ESP32 and waits for the weight value (format: 'WT,value').
-        Returns the rounded weight value (rounded to nearest 10) as an integer.
+        Returns the weight above the baseline, rounded to nearest 10, as an integer.
+        Raises ScaleTimeout if the ESP32 does not answer.
+        """
+        grams = self.read_grams()
+        return 0 if grams is None else self.round_weight(self.net(grams))
+
+    def read_grams(self) -> Optional[float]:
+        """One conversion in firmware grams, None if the reply is not a weight."""
+        with profiler.wait("scale_weight"):
+            request = self.send("WEIGHT")
+            print("Sent WEIGHT command to ESP32.")
+            return self.parse_grams(request.result())
+
+    @staticmethod
+    def parse_grams(response: str) -> Optional[float]:
+        """Returns a 'WT,value' reply's grams, or None if it is not one."""
+        if not response.startswith("WT,"):
+            print(f"Error: Unexpected weight reply: {response}")
+            return None
+        # Extract the weight value from the response
+        weight_value = response.split(",")[1]
+        try:
+            return float(weight_value)
+        except ValueError:
+            print("Error: Invalid weight value received.")
+            return None
+
+    @staticmethod
+    def round_weight(weight: float) -> int:
+        """Rounds grams up to the next 10, as every weight the Pi works with."""
+        return int(math.ceil(weight / 10.0) * 10)
+
+    def read_average(self, samples: int) -> Optional[Tuple[float, float, int]]:
+        """
+        Sends 'WEIGHT,<samples>': the ESP32 averages that many conversions and
+        answers 'WS,<mean>,<std>,<count>' in one reply. Returns (mean grams,
+        standard deviation, count) in firmware grams, or None if the firmware
+        cannot average.
+        """
+        if self.firmware is None:
+            return None  # The original firmware only answers single conversions
+        samples = max(1, min(samples, MAX_AVERAGE))
+        with profiler.wait("scale_average"):
+            request = self.send(f"WEIGHT,{samples}")
+            print(f"Sent WEIGHT,{samples} command to ESP32.")
+            FPJ_CLOCK.sleep(samples * CONVERSION_TIME)  # The conversions take this long anyway
+            response = request.result()
+        try:
+            if response.startswith("WS,"):
+                _, mean, std, count = response.split(",")
+                return float(mean), float(std), int(count)
+        except ValueError:
+            pass
+        print(f"[SCALE] No averaged weight: {response}")
+        return None
+
+    def read_stable_grams(self, samples: int) -> Optional[float]:
+        """Firmware grams averaged over samples conversions; a single conversion without averaging."""
+        average = self.read_average(samples)
+        if average is None:
+            return self.read_grams()
+        mean, std, count = average
+        print(f"[SCALE] {mean:.2f}g +/- {std:.2f}g over {count} conversions.")
+        return mean
+
+    def get_stable_weight(self, samples: int) -> int:
+        """Weight averaged over samples conversions, rounded like get_weight()."""
+        grams = self.read_stable_grams(samples)
+        return 0 if grams is None else self.round_weight(self.net(grams))
+
+    # === Baseline ===
+    def capture_baseline(self, samples: int) -> int:
+        """
+        Takes a settled, averaged reading as the new baseline, so the next
+        weights start from 0 without a tare. Returns the reading's weight
+        above the old baseline, e.g. what the ingredient just finished added.
+        """
+        grams = self.read_stable_grams(samples)
+        if grams is None:
+            return 0
+        weight = self.round_weight(self.net(grams))
+        self.baseline = grams
+        self.tares += 1
+        return weight
+
+    def reset_baseline(self) -> None:
+        """Forgets the baseline, e.g. for a new container, so the next zero() makes a full tare."""
+        self.baseline = None
+        self.tares += 1
+
+    def zero(self) -> bool:
+        """
+        Starts the weights from 0 for the next ingredient. The baseline is
+        kept while the scale reads within DRIFT_LIMIT of it; otherwise, or
+        without one, a full tare is made and left to settle. Returns True if
+        it tared.
+        """
+        if self.baseline is not None:
+            grams = self.read_grams()
+            drift = None if grams is None else self.net(grams)
+            if drift is not None and abs(drift) <= DRIFT_LIMIT:
+                return False
+            print(f"[SCALE] {'No reading' if drift is None else f'{drift:+.1f}g off the baseline'}; taring.")
+        self.trigger_tare()
+        with profiler.wait("scale_settle"):
+            FPJ_CLOCK.sleep(TARE_SETTLE)  # Allow some settling time
+        return True
+
+    def status(self) -> Dict[str, float]:
+        """Sends 'STATUS'; returns the firmware's uptime_ms, armed (0/1) and calibration factor."""
+        response = self.request("STATUS")
+        try:
+            _, uptime, armed, calibration = response.split(",")
+            return {"uptime_ms": int(uptime), "armed": int(armed), "calibration": float(calibration)}
+        except ValueError:
+            print(f"Error: Invalid status reply: {response}")
+            return {}
+
+    def calibration(self, factor: Optional[float] = None) -> Optional[float]:
+        """Reads the HX711 calibration factor (counts per gram), or sets it first; None if not answered."""
+        response = self.request("CAL" if factor is None else f"CAL,{factor:.4f}")
+        try:
+            return float(response.split(",")[1]) if response.startswith("CAL,") else None
+        except (IndexError, ValueError):
+            return None
+
+    # === Sample stream ===
+    def stream(self, rate: float) -> bool:
+        """Starts the binary sample stream at rate samples per second; False if the firmware cannot stream."""
+        if self.firmware is None:
+            print("[SCALE] The original firmware has no binary sample stream.")
+            return False
+        self.streaming = True  # Records can follow the reply at once
+        self.stream_rate = rate
+        self.last_seq = None
+        try:
+            response = self.request(f"STREAM,{rate:g}")
+        except ScaleTimeout:
+            response = ""
+        if not response.startswith("STREAMING"):
+            self.streaming = False
+            print("[SCALE] No STREAMING reply; the firmware has no binary sample stream.")
+        return self.streaming
+
+    def stop_stream(self) -> None:
+        """Stops the sample stream; records already sent are still collected by read_samples()."""
+        if self.streaming:
+            try:
+                self.request("STREAM,0")
+            except ScaleTimeout as e:
+                print(f"[ERROR] {e}")
+        self.streaming = False
+
+    def read_samples(self, timeout: float = 0.0):
+        """
+        Returns the samples received since the last call, waiting up to timeout
+        for the first ones: a structured array (seq, ms, grams) with NumPy,
+        otherwise a list of (seq, ms, grams) tuples.
         """
-        self.serial_connection.write(b"WEIGHT\n")
-        print("Sent WEIGHT command to ESP32.")
-        
-        # Wait for the weight response (e.g., "WT, value")
+        deadline = FPJ_CLOCK.monotonic() + timeout
         while True:
-            if self.serial_connection.in_waiting > 0:
-                response = self.serial_connection.readline().decode('utf-8').strip()
-                
-                if response.startswith("WT,"):
-                    # Extract the weight value from the response
-                    weight_value = response.split(",")[1]
-                    try:
-                        weight = float(weight_value)
-                        
-                        # Round to the nearest 10 and return as an integer
-                        rounded_weight = math.ceil(weight / 10.0) * 10
-                        return int(rounded_weight)
-                    except ValueError:
-                        print("Error: Invalid weight value received.")
-                        return 0  # Return 0 if the weight value is invalid
+            while self._pump(block=False):
+                pass
+            if self.samples or FPJ_CLOCK.monotonic() >= deadline:
+                break
+            FPJ_CLOCK.sleep(HIT_POLL)
+        blocks, self.samples = self.samples, []
+        if np is None:
+            return [record for block in blocks for record in block]
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks) if blocks else np.empty(0, SAMPLE_DTYPE)
+
+    def _on_hit_line(self, line: str) -> None:
+        try:
+            _, grams, ms = line.split(",")
+            hit = (self.net(float(grams)), int(ms))
+        except ValueError:
+            print(f"Error: Invalid alarm line received: {line}")
+            return
+        print(f"[SCALE] Threshold hit at {hit[0]}g (firmware {hit[1]}ms).")
+        self.armed = False
+        self.hit = hit
+        if self.on_hit:
+            self.on_hit(*hit)
+
+    # === Threshold alarm ===
+    def arm(self, grams: float, callback: Optional[Callable[[float, int], None]] = None) -> bool:
+        """
+        Sends 'ARM,<grams>' (above the baseline): the ESP32 pushes
+        'HIT,<grams>,<ms>' as soon as its filtered weight reaches them, then
+        disarms. Wait for it with wait_hit() or pass callback(grams, ms),
+        called by whichever read sees the line. Returns False if the firmware
+        does not confirm with 'ARMED'.
+        """
+        self.hit = None
+        self.on_hit = None
+        if self.firmware is None:
+            self.armed = False
+            return False  # The original firmware has no alarm; asking would only wait out ARM_TIMEOUT
+        self.on_hit = callback
+        self.armed = True  # Before the reply: a HIT can be routed by another thread right after it
+        try:
+            response = self.request(f"ARM,{grams + (self.baseline or 0.0):.1f}", ARM_TIMEOUT)
+        except ScaleTimeout:
+            response = ""
+        if not response.startswith("ARMED"):
+            self.armed = False
+            print("[SCALE] No ARMED reply; the firmware has no threshold alarm.")
+        return self.armed
+
+    def disarm(self) -> None:
+        """Cancels the alarm without waiting; the 'DISARMED' reply is routed by a later read."""
+        if self.armed:
+            self.send("DISARM")
+        self.armed = False
+        self.on_hit = None
+
+    def wait_hit(self, timeout: float) -> Optional[Tuple[float, int]]:
+        """Blocks until the armed threshold is hit or timeout passes; returns (grams, firmware ms) or None."""
+        deadline = FPJ_CLOCK.monotonic() + timeout
+        while self.hit is None:
+            if self._pump(block=False):
+                continue
+            remaining = deadline - FPJ_CLOCK.monotonic()
+            if remaining <= 0:
+                return None
+            FPJ_CLOCK.sleep(min(HIT_POLL, remaining))
+        hit, self.hit = self.hit, None
+        return hit
 
     def close(self) -> None:
         """Close the serial connection."""
         self.serial_connection.close()
 
 
+class ApproachSampler:
+    """
+    Decides when to read the scale while one ingredient is dispensed.
+
+    The flow rate is estimated in grams per second of flow (dispenser on
+    time), so relay cooldowns and settling do not dilute it. The next read
+    is due once APPROACH_FRACTION of the predicted flow time to the limit
+    has flowed: reads are sparse while the deficit is large and closer
+    together as the crossing approaches. Dispensers report their on time
+    with flowed(), or through pulse() and watch() as a relay's until.
+    """
+
+    def __init__(self, scale: Scale, limit: float) -> None:
+        self.scale = scale
+        self.limit = limit
+        self.start: float = scale.baseline or 0.0  # Firmware grams the dispensed weight is measured from
+        self.reads: int = 0
+        self.weight: Optional[int] = None
+        self.rate: Optional[float] = None  # Grams per second of flow
+        self.flow: float = 0.0             # Seconds of flow since the last read
+        self.gap: float = 0.0              # Seconds of flow from the last read to the next
+
+    def read(self) -> int:
+        """Reads the weight, updates the flow rate from it and schedules the next read."""
+        weight = self.scale.get_weight()
+        self.reads += 1
+        if self.weight is not None and self.flow > 0 and weight > self.weight:
+            rate = (weight - self.weight) / self.flow
+            self.rate = rate if self.rate is None else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.rate
+        self.weight = weight
+        self.flow = 0.0
+        self.gap = self.interval()
+        return weight
+
+    def interval(self) -> float:
+        """Seconds of flow until the next read, from the last weight and the flow rate."""
+        if self.rate is None or self.weight is None:
+            return SAMPLE_INTERVAL
+        eta = max(0.0, self.limit - self.weight) / self.rate
+        return min(max(APPROACH_FRACTION * eta, MIN_SAMPLE_INTERVAL), MAX_SAMPLE_INTERVAL)
+
+    def flowed(self, seconds: float) -> None:
+        self.flow += seconds
+
+    def due(self) -> bool:
+        """Whether enough has flowed since the last read for the next one."""
+        # A microsecond early counts: shorter waits vanish in the clock's float rounding
+        return self.weight is None or self.flow >= self.gap - 1e-6
+
+    def wait_time(self) -> float:
+        """Seconds of flow until the next read is due."""
+        return max(0.0, self.gap - self.flow)
+
+    def pulse(self, until: Callable[[float], object]) -> Callable[[float], object]:
+        """Wraps a relay's until (e.g. Scale.wait_hit) so its on time counts as flow."""
+        def timed(duration: float):
+            start = FPJ_CLOCK.monotonic()
+            try:
+                return until(duration)
+            finally:
+                self.flowed(FPJ_CLOCK.monotonic() - start)
+        return timed
+
+    def watch(self, duration: float) -> bool:
+        """
+        A relay's until for firmware without the alarm: reads the scale
+        whenever a read is due while the dispenser runs. Returns True as soon
+        as the limit is reached, False after duration.
+        """
+        last = FPJ_CLOCK.monotonic()
+        end = last + duration
+        while True:
+            now = FPJ_CLOCK.monotonic()
+            self.flowed(now - last)
+            last = now
+            if self.due() and self.read() >= self.limit:
+                self.flowed(FPJ_CLOCK.monotonic() - last)
+                return True
+            remaining = end - FPJ_CLOCK.monotonic()
+            if remaining <= 0:
+                self.flowed(FPJ_CLOCK.monotonic() - last)
+                return False
+            FPJ_CLOCK.sleep(min(self.wait_time(), remaining))
+
+    def dispensed(self) -> float:
+        """Firmware grams added since the sampler started, by the baseline capture_baseline() just took."""
+        return (self.scale.baseline or 0.0) - self.start
+
+    def report(self, name: str, error: float) -> None:
+        """Prints and records the ingredient's read count and cutoff error (grams over the target)."""
+        print(f"[SCALE] {name}: {self.reads} reads, cutoff error {error:+.1f}g")
+        profiler.record_dispense(name, self.reads, error)
+
+
 # Usage example:
 if __name__ == "__main__":
     # Replace with the correct port for your ESP32
@@ -68,13 +855,14 @@ if __name__ == "__main__":
         print("Tare successful.")
     else:
         print("Tare failed.")
+    print(f"Status: {scale.status()}")
     
     # Continuously get weight every 1 second
     try:
         while True:
             weight = scale.get_weight()
             print(f"Rounded Weight: {weight} g")
-            time.sleep(1)  # Wait for 1 second before getting the weight again
+            FPJ_CLOCK.sleep(1)  # Wait for 1 second before getting the weight again
     except KeyboardInterrupt:
         print("\nProgram terminated.")
     finally:
@@ -0,0 +1,246 @@
+import os
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List
+import FPJ_CLOCK
+from FPJ_PROFILER import profiler
+from FPJ_STATE import HomingError
+
+RESOURCE_POLL: float = 0.1  # Seconds between attempts to grab a busy resource
+BATCHES: int = int(os.environ.get("FPJ_BATCHES", "2"))  # Batches to run when started as a script
+
+
+class Stage:
+    """One step of a batch and the shared actuators it needs exclusively while it runs."""
+
+    def __init__(self, name: str, resources: Iterable[str], action: Callable[[int], None]) -> None:
+        self.name = name
+        self.resources = sorted(resources)
+        self.action = action  # Called with the batch number
+
+
+class ResourceLocks:
+    """
+    Named locks for the shared actuators (slider, scale, mixer, ...).
+
+    A stage grabs all of its resources at once or none of them, so two
+    batches can never hold one resource each while waiting for the other.
+    Waiting is done on the FPJ clock so it also works in virtual time.
+    """
+
+    def __init__(self) -> None:
+        self.locks: Dict[str, threading.Lock] = {}
+        self.guard = threading.Lock()
+
+    def _lock(self, name: str) -> threading.Lock:
+        with self.guard:
+            return self.locks.setdefault(name, threading.Lock())
+
+    def acquire(self, names: List[str]) -> None:
+        while True:
+            taken = []
+            for name in names:
+                if not self._lock(name).acquire(blocking=False):
+                    break
+                taken.append(name)
+            else:
+                return
+            for name in taken:
+                self._lock(name).release()
+            FPJ_CLOCK.sleep(RESOURCE_POLL)
+
+    def release(self, names: List[str]) -> None:
+        for name in names:
+            self._lock(name).release()
+
+
+class PipelineScheduler:
+    """
+    Runs consecutive batches with their safe phases overlapped.
+
+    Every batch walks the same list of stages in its own thread. Batches
+    take turns on each resource in order: batch N+1 may only use a resource
+    once batch N has finished its last stage needing it. So batches never
+    overtake each other, and stages that share no resource with the stages
+    still running in the batch before overlap with them.
+    """
+
+    def __init__(self, stages: List[Stage]) -> None:
+        self.stages = stages
+        self.resources = ResourceLocks()
+        self.turn = threading.Condition()
+        self.last_use: Dict[str, int] = {
+            name: index for index, stage in enumerate(stages) for name in stage.resources
+        }
+        self.next_batch: Dict[str, int] = {name: 0 for name in self.last_use}
+        self.timeline: List[dict] = []
+        self.errors: List[str] = []
+        self.threads: List[threading.Thread] = []
+        self.failed = False
+
+    def _wait_turn(self, stage: Stage, batch: int) -> None:
+        while True:
+            with self.turn:
+                if self.failed:
+                    raise FPJ_CLOCK.Aborted("Pipeline stopped")
+                if all(self.next_batch[name] == batch for name in stage.resources):
+                    return
+            FPJ_CLOCK.sleep(RESOURCE_POLL)
+
+    def _pass_on(self, index: int, batch: int) -> None:
+        """Hands the resources this batch no longer needs to the next batch."""
+        with self.turn:
+            for name in self.stages[index].resources:
+                if self.last_use[name] == index:
+                    self.next_batch[name] = batch + 1
+
+    def _run_batch(self, batch: int, ready: threading.Barrier) -> None:
+        with FPJ_CLOCK.participant(), profiler.worker():
+            ready.wait()
+            try:
+                for index, stage in enumerate(self.stages):
+                    self._wait_turn(stage, batch)
+                    self.resources.acquire(stage.resources)
+                    start = FPJ_CLOCK.monotonic()
+                    print(f"[PIPELINE] Batch {batch + 1}: {stage.name} started")
+                    try:
+                        stage.action(batch)
+                    finally:
+                        self.resources.release(stage.resources)
+                    self._pass_on(index, batch)
+                    self.timeline.append({
+                        "batch": batch + 1,
+                        "stage": stage.name,
+                        "start": start,
+                        "end": FPJ_CLOCK.monotonic(),
+                    })
+            except FPJ_CLOCK.Aborted:
+                pass
+            except Exception as e:
+                self.errors.append(f"Batch {batch + 1}: {e}")
+                self.stop()
+
+    def stop(self) -> None:
+        """Stops every batch at its next wait."""
+        with self.turn:
+            self.failed = True
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                FPJ_CLOCK.abort(thread)
+
+    def run(self, batches: int) -> dict:
+        """Runs the given number of batches and returns throughput figures."""
+        start = FPJ_CLOCK.monotonic()
+        ready = threading.Barrier(batches)
+        self.threads = [
+            threading.Thread(target=self._run_batch, args=(batch, ready), name=f"fpj-batch-{batch + 1}")
+            for batch in range(batches)
+        ]
+        try:
+            for thread in self.threads:
+                thread.start()
+            for thread in self.threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            print("\n[PIPELINE] Interrupted. Stopping all batches...")
+            self.stop()
+            for thread in self.threads:
+                thread.join()
+        finally:
+            for thread in self.threads:
+                FPJ_CLOCK.clear_abort(thread)
+        return self.report(start, FPJ_CLOCK.monotonic())
+
+    def report(self, start: float, end: float) -> dict:
+        elapsed = end - start
+        completed = {entry["batch"] for entry in self.timeline if entry["stage"] == self.stages[-1].name}
+        serial = sum(entry["end"] - entry["start"] for entry in self.timeline)
+        summary = {
+            "batches": len(completed),
+            "elapsed": round(elapsed, 1),
+            "serial_time": round(serial, 1),
+            "batches_per_hour": round(len(completed) / elapsed * 3600, 2) if elapsed > 0 else 0.0,
+            "overlap_saving": round(serial - elapsed, 1) or 0.0,  # Not -0.0
+            "errors": self.errors,
+        }
+        for entry in sorted(self.timeline, key=lambda e: e["start"]):
+            print(
+                f"[PIPELINE] {entry['start'] - start:8.1f}s - {entry['end'] - start:8.1f}s  "
+                f"batch {entry['batch']} {entry['stage']}"
+            )
+        for key, value in summary.items():
+            print(f"[PIPELINE] {key}: {value}")
+        return summary
+
+
+def batch_stages(main) -> List[Stage]:
+    """
+    The main.py batch split into pipeline stages.
+
+    The machine has one container, carried by the slider, and one scale
+    under the dispensers at home: every ingredient goes straight into the
+    container, so every stage that dispenses, mixes or seals holds the
+    slider. Batches therefore cannot overlap on this machine; the next batch
+    starts loading as soon as the previous one is sealed and releases the
+    slider. A stage needing no container (e.g. a weighing hopper with its own
+    scale and a discharge step) is what would let batches overlap.
+    """
+    chopped_steps = [ingredient for ingredient in main.plan.steps if ingredient.chopped]
+    other_steps = [ingredient for ingredient in main.plan.steps if not ingredient.chopped]
+
+    def load(batch: int) -> None:
+        main.json.reset_weights()
+        main.json.set_mixing_status(False)
+        main.LedIndicator.turn_off()
+        main.show_activity(1)
+        main.controller.mixer_up()
+        if not main.stepper.moveSliderToHome():
+            raise HomingError("Slider did not reach home")
+        main.scale.reset_baseline()  # New container: the first ingredient starts with a full tare
+
+    def chop(batch: int) -> None:
+        main.controller.turn_on_chopper()
+        for ingredient in chopped_steps:
+            main.add_ingredient(ingredient)
+        main.controller.turn_off_chopper()
+
+    def liquids(batch: int) -> None:
+        for ingredient in other_steps:
+            main.add_ingredient(ingredient)
+
+    return [
+        Stage("load", ["slider", "mixer"], load),
+        Stage("chop", ["chopper", "scale", "slider"], chop),
+        Stage("liquids", ["scale", "molasses", "water", "slider"], liquids),
+        Stage("mix", ["slider", "mixer"], lambda batch: main.mix()),
+        Stage("seal", ["slider", "sealer"], lambda batch: main.seal()),
+    ]
+
+
+def run(batches: int) -> dict:
+    import main
+
+    main.start_up()
+    main.profiler.start_batch()
+    completed = False
+    try:
+        summary = PipelineScheduler(batch_stages(main)).run(batches)
+        completed = not summary["errors"]
+    finally:
+        main.controller.shutdown(force=not completed)
+        main.profiler.end_batch(completed)
+    return summary
+
+
+# Usage:
+#   python3 FPJ_SCHEDULER.py [--batches N]     run back-to-back batches (default FPJ_BATCHES or 2)
+#   FPJ_BATCHES=3 python3 FPJ_SIM.py DIR --module FPJ_SCHEDULER
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Back-to-back FPJ batches")
+    parser.add_argument("--batches", type=int, default=BATCHES, help="number of batches to run")
+    args, _ = parser.parse_known_args()  # FPJ_SIM's own arguments are still in sys.argv under the simulator
+    result = run(args.batches)
+    sys.exit(1 if result["errors"] else 0)
@@ -1,28 +1,146 @@
 #!/usr/bin/env python3
 
-from gpiozero import AngularServo
-from time import sleep
+from FPJ_CLOCK import sleep
+from FPJ_JSON import FpjJson
+from FPJ_PROFILER import profiler
+import FPJ_PCF
+import FPJ_TRACE
 
 
 class ServoController:
+    OpenAngle = 0
+    ClosedAngle = -90
+
+    # Uncalibrated flow curve as (angle, grams per second) pairs, closed to open
+    DefaultFlowTable = [(-90, 0.0), (-75, 2.0), (-60, 6.0), (-45, 12.0), (-30, 18.0), (-15, 22.0), (0, 25.0)]
+
     def __init__(self, gpio_pin=18, min_pulse=0.0005, max_pulse=0.0025):
-        self.servo = AngularServo(
-            gpio_pin,
-            min_pulse_width=min_pulse,
-            max_pulse_width=max_pulse
-        )
+        if FPJ_TRACE.player:
+            self.servo = FPJ_TRACE.player.servo()
+        elif FPJ_PCF.BACKEND == "sim":
+            self.servo = FPJ_TRACE.wrap_servo(FPJ_PCF.machine.servo)
+        else:
+            from gpiozero import AngularServo
+
+            self.servo = FPJ_TRACE.wrap_servo(AngularServo(
+                gpio_pin,
+                min_pulse_width=min_pulse,
+                max_pulse_width=max_pulse
+            ))
+        self.angle = None  # Last commanded angle, None until the first write
+        self.skipped_writes = 0
+        self._flow_table = None  # Read on first use: RelayController builds this at import
 
     def move_to(self, angle, wait=0.5):
         """Move servo to specified angle and hold briefly (optional)"""
+        if angle == self.angle:
+            self.skipped_writes += 1
+            return
         self.servo.angle = angle
-        sleep(wait)  # Give it time to reach position
+        self.angle = angle
+        with profiler.wait("servo_travel"):
+            sleep(wait)  # Give it time to reach position
+
+    def load_flow_table(self):
+        """Load the calibrated flow table, falling back to the default curve"""
+        table = FpjJson().get_molasses_flow_table()
+        if not table:
+            return list(self.DefaultFlowTable)
+        return sorted((float(angle), float(rate)) for angle, rate in table)
+
+    @property
+    def flow_table(self):
+        """(angle, g/s) pairs, closed to open, loaded from FPJ_DATA.json the first time they are needed"""
+        if self._flow_table is None:
+            self._flow_table = self.load_flow_table()
+        return self._flow_table
+
+    @property
+    def max_flow(self):
+        """Highest flow rate (g/s) in the flow table"""
+        return max(rate for _, rate in self.flow_table)
+
+    def flow_for_angle(self, angle):
+        """Interpolate the flow rate (g/s) at a given angle"""
+        points = self.flow_table
+        if angle <= points[0][0]:
+            return points[0][1]
+        for (a0, r0), (a1, r1) in zip(points, points[1:]):
+            if angle <= a1:
+                return r0 + (r1 - r0) * (angle - a0) / (a1 - a0)
+        return points[-1][1]
+
+    def angle_for_flow(self, rate):
+        """Smallest angle that gives at least the requested flow rate (g/s)"""
+        points = self.flow_table
+        if rate <= 0:
+            return self.ClosedAngle
+        for (a0, r0), (a1, r1) in zip(points, points[1:]):
+            if r0 < rate <= r1:
+                return round(a0 + (a1 - a0) * (rate - r0) / (r1 - r0))
+        return self.OpenAngle
+
+    def flow_for_deficit(self, deficit, approach_time=10.0, min_flow=1.0):
+        """
+        Flow rate (g/s) to command for the weight still missing.
+
+        Far from the target this saturates at the full flow; once the deficit
+        could be covered in less than approach_time seconds the rate shrinks
+        with it, never dropping below min_flow until the target is reached.
+        """
+        if deficit <= 0:
+            return 0.0
+        return max(min_flow, min(self.max_flow, deficit / approach_time))
+
+    def command_flow(self, rate, wait=0.2):
+        """Hold the valve at the angle for the given flow rate"""
+        self.move_to(self.angle_for_flow(rate), wait=wait)
+
+    def calibrate(self, read_grams, angles=(-75, -60, -45, -30, -15, 0), duration=5.0, settle=1.0):
+        """
+        Measure the flow rate at each angle using scale feedback and store the result.
+
+        The readings must be unrounded: get_weight()'s 10 g steps would only
+        resolve 2 g/s over a 5 s window, so pass an averaged read such as
+        lambda: scale.read_stable_grams(16).
+
+        :param read_grams: Function returning the current scale reading in grams, None if it failed
+        :param angles: Angles to sample, from nearly closed to fully open
+        :param duration: Seconds the valve is held open at each angle
+        :param settle: Seconds to wait after closing before reading the scale
+        """
+        table = [(self.ClosedAngle, 0.0)]
+        self.close()
+        for angle in angles:
+            start_weight = read_grams()
+            self.move_to(angle)
+            sleep(duration)
+            self.close()
+            sleep(settle)
+            end_weight = read_grams()
+            if start_weight is None or end_weight is None:
+                print("Calibration failed: no scale reading, keeping previous flow table.")
+                return self.flow_table
+            rate = max(0.0, (end_weight - start_weight) / duration)
+            print(f"Angle {angle}: {rate:.2f} g/s")
+            # Keep the table monotonic so it can be inverted
+            table.append((angle, max(rate, table[-1][1])))
+
+        if table[-1][1] <= 0:
+            print("Calibration failed: no flow measured, keeping previous flow table.")
+            return self.flow_table
+
+        self._flow_table = table
+        FpjJson().set_molasses_flow_table(table)
+        print("Molasses flow calibration saved.")
+        return table
 
     def open(self):
         """Open by moving to 0 degrees"""
         print("Opening...")
-        self.move_to(0)
+        self.move_to(self.OpenAngle)
 
     def close(self):
         """Close by moving to -90 degrees"""
         print("Closing...")
-        self.move_to(-90)
+        self.move_to(self.ClosedAngle)
@@ -0,0 +1,668 @@
+import fcntl
+import math
+import os
+import random
+import select
+import struct
+import sys
+import threading
+import termios
+import tty
+import FPJ_CLOCK
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# === Wiring modelled by the simulator (mirrors FPJ_RELAY / FPJ_LIMITSWITCH / FPJ_STEPPER) ===
+LIMITSWITCH_ADDRESS: int = 0x20
+RELAY_ADDRESS: int = 0x26
+
+# 0x26 relay board (active low)
+ServoPowerPin: int = 2
+MixerDownPin: int = 3
+StepperPowerPin: int = 5
+WaterPumpPin: int = 6
+KakawatePin: int = 7
+NeemPin: int = 9
+MixerUpPin: int = 12
+
+# 0x20 inputs (active low)
+CoverDownPin: int = 4
+CoverUpPin: int = 5
+MixerUpSwitchPin: int = 6
+MixerDownSwitchPin: int = 7
+ResetPin: int = 9
+StartPin: int = 10
+SliderHomePin: int = 11
+
+# 0x20 stepper outputs
+SealerDirectionPin: int = 12
+SealerPulsePin: int = 13
+SliderDirectionPin: int = 14
+SliderPulsePin: int = 15
+
+# Flow rates into the scale in grams per second while the relay is on
+RelayFlowRates: Dict[int, float] = {
+    KakawatePin: 20.0,
+    NeemPin: 20.0,
+    WaterPumpPin: 50.0,
+}
+
+# True molasses flow curve as (angle, grams per second), closed to open
+MolassesFlowTable: List[Tuple[float, float]] = [
+    (-90, 0.0), (-75, 1.5), (-60, 5.0), (-45, 11.0), (-30, 17.0), (-15, 21.0), (0, 24.0)
+]
+
+
+class SimPin:
+    """Pin of a simulated PCF8575, same interface as adafruit_pcf8575.DigitalInOut."""
+
+    def __init__(self, pcf: "SimPcf", pin_number: int) -> None:
+        self._pcf = pcf
+        self._pin = pin_number
+
+    def switch_to_output(self, value: bool = False, **kwargs) -> None:
+        self.value = value
+
+    def switch_to_input(self, pull=None, **kwargs) -> None:
+        self._pcf.write_pin(self._pin, True)
+
+    @property
+    def value(self) -> bool:
+        return self._pcf.read_pin(self._pin)
+
+    @value.setter
+    def value(self, val: bool) -> None:
+        self._pcf.write_pin(self._pin, val)
+
+
+class SimPcf:
+    """Simulated PCF8575: a 16-bit output latch plus inputs driven by the machine model."""
+
+    def __init__(self, machine: "SimMachine", address: int) -> None:
+        self.machine = machine
+        self.address = address
+        self.latch: int = 0xFFFF
+        self.writes: int = 0
+        self.reads: int = 0
+        self.exchanges: int = 0  # Combined write + read transactions
+
+    def get_pin(self, pin: int) -> SimPin:
+        assert 0 <= pin <= 15
+        return SimPin(self, pin)
+
+    def write_gpio(self, val: int) -> None:
+        old = self.latch
+        self.latch = val & 0xFFFF
+        self.writes += 1
+        self.machine.outputs_changed(self.address, old, self.latch)
+
+    def read_gpio(self) -> int:
+        self.reads += 1
+        return self.latch & self.machine.inputs(self.address)
+
+    def write_burst(self, data: bytes, word_time: float) -> float:
+        """
+        One multi-word write: every word is latched as it arrives, word_time
+        apart. Returns at once with the bus time still to elapse.
+        """
+        self.writes += 1
+        return self._latch_words(data, word_time)
+
+    def exchange(self, data: bytes, word_time: float) -> Tuple[int, float]:
+        """
+        A burst write (possibly empty) followed by a read of every pin in the
+        same transaction. Returns the input word seen after the last word and
+        the bus time still to elapse.
+        """
+        self.exchanges += 1
+        remaining = self._latch_words(data, word_time)
+        return self.latch & self.machine.inputs(self.address), remaining
+
+    def _latch_words(self, data: bytes, word_time: float) -> float:
+        start = FPJ_CLOCK.monotonic()
+        for index, (word,) in enumerate(struct.iter_unpack("<H", data)):
+            if word != self.latch:
+                old = self.latch
+                self.latch = word
+                self.machine.outputs_changed(self.address, old, word, at=start + (index + 1) * word_time)
+        return len(data) // 2 * word_time
+
+    def write_pin(self, pin: int, val: bool) -> None:
+        if val:
+            self.write_gpio(self.latch | (1 << pin))
+        else:
+            self.write_gpio(self.latch & ~(1 << pin))
+
+    def read_pin(self, pin: int) -> bool:
+        return ((self.read_gpio() >> pin) & 0x1) == 1
+
+
+class SimServo:
+    """Simulated molasses valve servo; the angle sets the molasses flow."""
+
+    def __init__(self, machine: "SimMachine") -> None:
+        self.machine = machine
+        self._angle: Optional[float] = None
+
+    @property
+    def angle(self) -> Optional[float]:
+        return self._angle
+
+    @angle.setter
+    def angle(self, value: float) -> None:
+        with self.machine.lock:
+            self.machine.update()
+            self._angle = value
+
+
+class SimCharLCD:
+    """Character buffer standing in for RPLCD's CharLCD."""
+
+    def __init__(self, cols: int = 20, rows: int = 4) -> None:
+        self.cols = cols
+        self.rows = rows
+        self.cursor_pos: Tuple[int, int] = (0, 0)
+        self.lines: List[str] = [" " * cols for _ in range(rows)]
+        self.writes: int = 0
+
+    def clear(self) -> None:
+        self.lines = [" " * self.cols for _ in range(self.rows)]
+        self.cursor_pos = (0, 0)
+        self.writes += 1
+
+    def write_string(self, text: str) -> None:
+        row, col = self.cursor_pos
+        line = self.lines[row]
+        text = text[:self.cols - col]
+        self.lines[row] = line[:col] + text + line[col + len(text):]
+        self.cursor_pos = (row, col + len(text))
+        self.writes += 1
+
+
+class SimMachine:
+    """
+    Physics model of the FPJ maker driven by the simulated expanders.
+
+    Relays on 0x26 pour ingredients into the scale at fixed rates, the servo
+    angle sets the molasses flow, the mixer travels between its limit switches
+    while its relays are on, and every stepper pulse moves the slider or the
+    sealer cover so their limit switches trip after a known number of steps.
+    Pulses closer together than an axis' minimum step period are lost, like a
+    real stepper stalling when driven too fast.
+    """
+
+    def __init__(
+        self,
+        slider_steps_from_home: int = 1500,
+        cover_travel_steps: int = 400,
+        mixer_travel_time: float = 4.0,
+        noise: float = 0.5,
+        slider_min_step_period: float = 0.0003,
+        sealer_min_step_period: float = 0.0006,
+    ) -> None:
+        self.lock = threading.RLock()
+        self.pcf_limitswitch = SimPcf(self, LIMITSWITCH_ADDRESS)
+        self.pcf_relay = SimPcf(self, RELAY_ADDRESS)
+        self.servo = SimServo(self)
+
+        self.slider_position: int = slider_steps_from_home  # Steps away from the home switch
+        self.cover_position: int = 0                        # Steps above the down switch
+        self.cover_travel_steps = cover_travel_steps
+        self.mixer_position: float = 0.0                    # 0.0 up .. 1.0 down
+        self.mixer_travel_time = mixer_travel_time
+        self.gross_weight: float = 0.0
+        self.tare_offset: float = 0.0
+        self.noise = noise
+        self.buttons: Dict[int, bool] = {ResetPin: False, StartPin: False}
+        self.steps: Dict[str, int] = {"slider": 0, "sealer": 0}
+        self.min_step_period: Dict[str, float] = {"slider": slider_min_step_period, "sealer": sealer_min_step_period}
+        self.last_pulse: Dict[str, float] = {"slider": -1.0, "sealer": -1.0}
+        self.lost_steps: Dict[str, int] = {"slider": 0, "sealer": 0}
+        self.last_update: float = FPJ_CLOCK.monotonic()
+
+    # === Time integration ===
+    def relay_on(self, pin: int) -> bool:
+        return not (self.pcf_relay.latch >> pin) & 1
+
+    def flow_rate(self) -> float:
+        rate = sum(r for pin, r in RelayFlowRates.items() if self.relay_on(pin))
+        if self.relay_on(ServoPowerPin) and self.servo.angle is not None:
+            rate += self.molasses_flow(self.servo.angle)
+        return rate
+
+    @staticmethod
+    def molasses_flow(angle: float) -> float:
+        points = MolassesFlowTable
+        if angle <= points[0][0]:
+            return points[0][1]
+        for (a0, r0), (a1, r1) in zip(points, points[1:]):
+            if angle <= a1:
+                return r0 + (r1 - r0) * (angle - a0) / (a1 - a0)
+        return points[-1][1]
+
+    def update(self) -> None:
+        """Advances the continuous parts of the model (flows, mixer travel) to now."""
+        now = FPJ_CLOCK.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        if elapsed <= 0:
+            return
+        self.gross_weight += self.flow_rate() * elapsed
+        travel = elapsed / self.mixer_travel_time
+        if self.relay_on(MixerDownPin):
+            self.mixer_position = min(1.0, self.mixer_position + travel)
+        if self.relay_on(MixerUpPin):
+            self.mixer_position = max(0.0, self.mixer_position - travel)
+
+    # === Expander hooks ===
+    def outputs_changed(self, address: int, old: int, new: int, at: Optional[float] = None) -> None:
+        """Reacts to new expander outputs; at is when they took effect if not now (burst writes)."""
+        with self.lock:
+            if address == RELAY_ADDRESS:
+                # Integrate up to the switching instant with the old relay states
+                latch = self.pcf_relay.latch
+                self.pcf_relay.latch = old
+                self.update()
+                self.pcf_relay.latch = latch
+                return
+            falling = old & ~new
+            if falling & (1 << SliderPulsePin):
+                self.step_slider(not (new >> SliderDirectionPin) & 1, at)
+            if falling & (1 << SealerPulsePin):
+                self.step_sealer(not (new >> SealerDirectionPin) & 1, at)
+
+    def stalled(self, axis: str, at: Optional[float] = None) -> bool:
+        """Whether a pulse on an axis came too soon after the previous one to move it."""
+        now = FPJ_CLOCK.monotonic() if at is None else at
+        too_soon = now - self.last_pulse[axis] < self.min_step_period[axis]
+        self.last_pulse[axis] = now
+        if too_soon:
+            self.lost_steps[axis] += 1
+        return too_soon
+
+    def step_slider(self, toward_home: bool, at: Optional[float] = None) -> None:
+        if not self.relay_on(StepperPowerPin) or self.stalled("slider", at):
+            return
+        self.steps["slider"] += 1
+        self.slider_position += -1 if toward_home else 1
+        self.slider_position = max(0, self.slider_position)
+
+    def step_sealer(self, up: bool, at: Optional[float] = None) -> None:
+        if not self.relay_on(StepperPowerPin) or self.stalled("sealer", at):
+            return
+        self.steps["sealer"] += 1
+        self.cover_position += 1 if up else -1
+        self.cover_position = max(0, min(self.cover_travel_steps, self.cover_position))
+
+    def inputs(self, address: int) -> int:
+        """Input levels for an expander; a cleared bit is a closed (active low) switch."""
+        if address != LIMITSWITCH_ADDRESS:
+            return 0xFFFF
+        with self.lock:
+            self.update()
+            closed = {
+                SliderHomePin: self.slider_position <= 0,
+                CoverDownPin: self.cover_position <= 0,
+                CoverUpPin: self.cover_position >= self.cover_travel_steps,
+                MixerUpSwitchPin: self.mixer_position <= 0.0,
+                MixerDownSwitchPin: self.mixer_position >= 1.0,
+                ResetPin: self.buttons[ResetPin],
+                StartPin: self.buttons[StartPin],
+            }
+        levels = 0xFFFF
+        for pin, is_closed in closed.items():
+            if is_closed:
+                levels &= ~(1 << pin)
+        return levels
+
+    # === Scale ===
+    def net_weight(self) -> float:
+        with self.lock:
+            self.update()
+            return self.gross_weight - self.tare_offset + random.uniform(-self.noise, self.noise)
+
+    def tare(self) -> None:
+        with self.lock:
+            self.update()
+            self.tare_offset = self.gross_weight
+
+    # === Operator ===
+    def press(self, pin: int, pressed: bool = True) -> None:
+        """Presses or releases the Start or Reset button."""
+        with self.lock:
+            self.buttons[pin] = pressed
+
+    def empty_container(self) -> None:
+        """Swaps in an empty container on the scale."""
+        with self.lock:
+            self.update()
+            self.gross_weight = 0.0
+
+
+class FakeEsp32:
+    """
+    ESP32 stand-in on a pseudo-terminal speaking the scale's line protocol.
+
+    Scale opens ``port`` like the real /dev/ttyUSB0. Like the ESP32 it ignores
+    commands for BOOT_TIME after (re)starting, then answers ``ID`` with
+    ``ID,FPJ-SCALE,<version>``; replug() simulates a USB hiccup. ``TARE`` is answered with
+    ``TARED``, ``WEIGHT`` with ``WT,<grams>`` from the machine model,
+    ``WEIGHT,<n>`` with ``WS,<mean>,<std>,<n>`` over n conversions,
+    ``STATUS`` with ``STATUS,<ms since boot>,<armed 0/1>,<calibration>`` and
+    ``CAL[,<counts per gram>]`` with ``CAL,<counts per gram>``. A command
+    framed as ``<tag>:<COMMAND>`` is answered ``<tag>:<reply>`` (``ERR,...``
+    if it has none), in the order received; untagged commands get the bare
+    reply line, as from the original firmware. With replies = "bare" tagged
+    commands are answered without their tag too, like firmware that ignores
+    the framing; with replies = "original" it is the original firmware, which
+    knows only bare ``TARE`` and ``WEIGHT`` lines and ignores everything else.
+
+    It is also the reference for the firmware's threshold alarm: ``ARM,<grams>``
+    (answered ``ARMED,<grams>``) makes it sample the load cell every
+    SAMPLE_PERIOD, and the first time the moving average of the last
+    FILTER_SAMPLES samples reaches the threshold it pushes an unsolicited
+    ``HIT,<grams>,<ms since boot>`` line and disarms. ``DISARM`` (answered
+    ``DISARMED``) cancels the alarm.
+
+    ``STREAM,<hz>`` (answered ``STREAMING,<hz>``; 0 stops) pushes one binary
+    sample record per period, laid out as FPJ_SCALE.SAMPLE_RECORD, between the
+    text lines. Records that would overflow the UART buffer are dropped, so
+    the reader sees a gap in the sequence numbers. On the virtual clock the
+    records of the periods within one sleep share its reading.
+    """
+
+    SAMPLE_PERIOD: float = 0.0125  # HX711 at 80 samples per second
+    FILTER_SAMPLES: int = 4
+    CALIBRATION: float = 420.0     # HX711 counts per gram the machine model's grams correspond to
+    MAX_STREAM_RATE: float = 960.0  # Records per second that fit through 115200 baud
+    STREAM_RECORD = struct.Struct("<BHIfB")  # Mirrors FPJ_SCALE.SAMPLE_RECORD
+    STREAM_BUFFER: int = 4096      # Bytes the UART may hold unread before records are dropped
+    BOOT_TIME: float = 0.4         # Seconds from reset until the firmware reads commands
+    VERSION: str = "1.0"
+    POLL: float = 0.1              # Seconds between checks for a replug while idle
+
+    def __init__(self, machine: SimMachine) -> None:
+        self.machine = machine
+        self.commands: int = 0
+        self.replies: str = "tagged"  # "bare": answer tagged commands without the tag; "original": no tags, no ID
+        self.calibration: float = self.CALIBRATION
+        self.threshold: Optional[float] = None
+        self.samples: Deque[float] = deque(maxlen=self.FILTER_SAMPLES)
+        self.last_sample: float = -math.inf
+        self.stream_period: Optional[float] = None
+        self.stream_seq: int = 0
+        self.last_record: float = -math.inf
+        self.records_dropped: int = 0
+        self.clock: Optional[FPJ_CLOCK.VirtualClock] = None  # Virtual clock sampled on while armed or streaming
+        self.loop_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self._plug()
+
+    def _plug(self) -> None:
+        """Enumerates on a new pseudo-terminal and boots."""
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port: str = os.ttyname(self.slave_fd)
+        self.boot: float = FPJ_CLOCK.monotonic()
+        threading.Thread(target=self._serve, args=(self.master_fd,), name="FakeEsp32", daemon=True).start()
+
+    def replug(self) -> None:
+        """
+        A USB hiccup: the old port hangs up, the adapter comes back on a new
+        one and the ESP32 resets, forgetting its alarm and stream (the machine
+        model keeps its tare).
+        """
+        old_slave = self.slave_fd
+        with self.loop_lock:
+            self.threshold = None
+            self.stream_period = None
+            self._listen()
+        with self.write_lock:
+            self._plug()
+        os.close(old_slave)  # The old master is closed by its serve thread
+        print(f"[SIM] Fake ESP32 replugged on {self.port}")
+
+    def _serve(self, master_fd: int) -> None:
+        buffer = b""
+        while master_fd == self.master_fd:
+            sampling = self._sampling() and not FPJ_CLOCK.is_virtual()
+            # Real time: sample between commands
+            period = min(self.SAMPLE_PERIOD, self.stream_period or math.inf) if sampling else self.POLL
+            ready, _, _ = select.select([master_fd], [], [], period)
+            if sampling:
+                self.loop()
+            if not ready:
+                continue
+            try:
+                chunk = os.read(master_fd, 1024)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if FPJ_CLOCK.monotonic() - self.boot < self.BOOT_TIME:
+                    continue  # Still booting; the command is lost
+                tag, sep, command = line.decode("utf-8").strip().rpartition(":")
+                if self.replies == "original" and (sep or command not in ("TARE", "WEIGHT")):
+                    continue  # The original firmware compares whole lines with the two it knows
+                reply = self.handle(command)
+                if sep and self.replies == "tagged":
+                    self._send(f"{tag}:{reply if reply is not None else 'ERR,' + command}")
+                elif reply is not None:
+                    self._send(reply)
+        os.close(master_fd)
+
+    def _send(self, line: str) -> None:
+        self._write((line + "\n").encode("utf-8"))
+
+    def _write(self, data: bytes) -> None:
+        with self.write_lock:
+            os.write(self.master_fd, data)
+
+    def handle(self, command: str) -> Optional[str]:
+        """Returns the firmware's reply line for a command, or None for no reply."""
+        self.commands += 1
+        if command == "ID":
+            return f"ID,FPJ-SCALE,{self.VERSION}"
+        if command == "TARE":
+            self.machine.tare()
+            return "TARED"
+        if command == "WEIGHT":
+            return f"WT,{self.grams():.2f}"
+        if command.startswith("WEIGHT,"):
+            try:
+                count = int(command[7:])
+            except ValueError:
+                return None
+            if not 1 <= count <= 255:
+                return None
+            # The firmware converts them one after another; the Scale waits that long before reading
+            readings = [self.grams() for _ in range(count)]
+            mean = sum(readings) / count
+            std = math.sqrt(sum((grams - mean) ** 2 for grams in readings) / count)
+            return f"WS,{mean:.2f},{std:.3f},{count}"
+        if command == "STATUS":
+            armed = int(self.threshold is not None)
+            return f"STATUS,{int((FPJ_CLOCK.monotonic() - self.boot) * 1000)},{armed},{self.calibration:.4f}"
+        if command.startswith("CAL"):
+            if command.startswith("CAL,"):
+                try:
+                    self.calibration = float(command[4:])
+                except ValueError:
+                    return None
+            elif command != "CAL":
+                return None
+            return f"CAL,{self.calibration:.4f}"
+        if command.startswith("ARM,"):
+            try:
+                threshold = float(command[4:])
+            except ValueError:
+                return None
+            self.arm(threshold)
+            return f"ARMED,{threshold:.2f}"
+        if command == "DISARM":
+            with self.loop_lock:
+                self._disarm()
+            return "DISARMED"
+        if command.startswith("STREAM,"):
+            try:
+                rate = float(command[7:])
+            except ValueError:
+                return None
+            if rate > self.MAX_STREAM_RATE:
+                return None
+            self.stream(rate)
+            return f"STREAMING,{rate:g}"
+        return None
+
+    def grams(self) -> float:
+        """Net weight as the firmware converts it with its current calibration factor."""
+        return self.machine.net_weight() * self.CALIBRATION / self.calibration
+
+    # === Firmware loop ===
+    def _sampling(self) -> bool:
+        return self.threshold is not None or self.stream_period is not None
+
+    def _listen(self) -> None:
+        """Keeps loop() running whenever virtual time moves on, as the firmware's would, while it has work."""
+        if self._sampling() and self.clock is None and FPJ_CLOCK.is_virtual():
+            self.clock = FPJ_CLOCK.clock
+            self.clock.listeners.append(self.loop)
+        elif not self._sampling() and self.clock is not None:
+            self.clock.listeners.remove(self.loop)
+            self.clock = None
+
+    def loop(self) -> None:
+        """One pass of the firmware's main loop."""
+        virtual = self.clock is not None
+        sent = self.sample()
+        sent = self.send_records() or sent
+        if sent and virtual:
+            # Virtual time must not move on before what was sent can be read
+            select.select([self.slave_fd], [], [], 1.0)
+
+    # === Threshold alarm ===
+    def arm(self, threshold: float) -> None:
+        with self.loop_lock:
+            self.threshold = threshold
+            self.samples.clear()
+            self.last_sample = -math.inf
+            self._listen()
+
+    def _disarm(self) -> None:
+        self.threshold = None
+        self._listen()
+
+    def sample(self) -> bool:
+        """Filters a new reading and fires the armed alarm; returns True if it sent a HIT line."""
+        with self.loop_lock:
+            now = FPJ_CLOCK.monotonic()
+            if self.threshold is None or now - self.last_sample < self.SAMPLE_PERIOD:
+                return False
+            self.last_sample = now
+            self.samples.append(self.grams())
+            filtered = sum(self.samples) / len(self.samples)
+            if filtered < self.threshold:
+                return False
+            self._disarm()
+            self._send(f"HIT,{filtered:.2f},{int((now - self.boot) * 1000)}")
+            return True
+
+    # === Sample stream ===
+    def stream(self, rate: float) -> None:
+        with self.loop_lock:
+            self.stream_period = 1.0 / rate if rate > 0 else None
+            self.stream_seq = 0
+            self.last_record = FPJ_CLOCK.monotonic()
+            self._listen()
+
+    def _unread(self) -> int:
+        """Bytes sent that the Scale has not read yet."""
+        return struct.unpack("i", fcntl.ioctl(self.slave_fd, termios.FIONREAD, b"\0\0\0\0"))[0]
+
+    def send_records(self) -> bool:
+        """Sends a sample record for every stream period that has passed; returns True if it sent any."""
+        with self.loop_lock:
+            if self.stream_period is None:
+                return False
+            due = int((FPJ_CLOCK.monotonic() - self.last_record) / self.stream_period)
+            if due <= 0:
+                return False
+            grams = self.grams()
+            room = max(0, (self.STREAM_BUFFER - self._unread()) // self.STREAM_RECORD.size)
+            self.records_dropped += max(0, due - room)
+            data = bytearray()
+            for i in range(due):
+                self.last_record += self.stream_period
+                self.stream_seq = (self.stream_seq + 1) & 0xFFFF
+                if i < due - room:
+                    continue  # Dropped; the oldest go first
+                record = bytearray(self.STREAM_RECORD.pack(
+                    0xA5, self.stream_seq, int((self.last_record - self.boot) * 1000) & 0xFFFFFFFF, grams, 0
+                ))
+                record[-1] = sum(record[:-1]) & 0xFF
+                data += record
+            if data:
+                self._write(bytes(data))
+            return bool(data)
+
+
+# === Module state, created when FPJ_PCF selects the "sim" backend ===
+machine: Optional[SimMachine] = None
+esp32: Optional[FakeEsp32] = None
+
+
+def start() -> SimMachine:
+    """Creates the simulated machine and its fake ESP32 once and returns the machine."""
+    global machine, esp32
+    if machine is None:
+        machine = SimMachine()
+        esp32 = FakeEsp32(machine)
+        print(f"[SIM] Simulated machine ready, fake ESP32 on {esp32.port}")
+    return machine
+
+
+def run(module: str = "main", workdir: Optional[str] = None, realtime: bool = False) -> None:
+    """
+    Runs a script against the simulated machine.
+
+    Must run in a fresh process: the backend is chosen when FPJ_PCF is imported.
+    The script runs inside workdir so it starts from its own empty FPJ_DATA.json.
+    Unless realtime is set, the script runs on the virtual clock and finishes
+    as fast as the CPU allows.
+    """
+    import runpy
+    import tempfile
+    import time
+
+    os.environ["FPJ_BACKEND"] = "sim"
+    if not realtime:
+        FPJ_CLOCK.use(FPJ_CLOCK.VirtualClock())
+    workdir = workdir or tempfile.mkdtemp(prefix="fpj-sim-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"[SIM] Running {module} in {os.getcwd()}")
+    start = FPJ_CLOCK.monotonic()
+    wall_start = time.perf_counter()
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    print(
+        f"[SIM] {module} finished: {FPJ_CLOCK.monotonic() - start:.1f}s machine time "
+        f"in {time.perf_counter() - wall_start:.2f}s wall time"
+    )
+
+
+# Usage:
+#   python3 FPJ_SIM.py [workdir] [--realtime] [--module NAME]
+#       run one full main.py batch (or the given script, e.g. FPJ_ASYNC) on the simulator
+if __name__ == "__main__":
+    import argparse
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Run a batch against the simulated machine")
+    parser.add_argument("workdir", nargs="?", help="directory for the batch's JSON files")
+    parser.add_argument("--realtime", action="store_true", help="use the wall clock instead of virtual time")
+    parser.add_argument("--module", default="main", help="script to run (default: main)")
+    args = parser.parse_args()
+    run(args.module, workdir=args.workdir, realtime=args.realtime)
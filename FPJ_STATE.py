@@ -0,0 +1,231 @@
+import threading
+from typing import Callable, List
+
+# Batch phases, in order
+IDLE = "IDLE"
+HOMING = "HOMING"
+DISPENSING = "DISPENSING"
+MIXING = "MIXING"
+SEALING = "SEALING"
+FERMENTING = "FERMENTING"
+PHASES: List[str] = [IDLE, HOMING, DISPENSING, MIXING, SEALING, FERMENTING]
+
+# Known slider locations, in the order the slider visits them from home
+HOME = "home"
+MIXER = "mixer"
+SEALER = "sealer"
+MOVING = "moving"  # Interrupted mid-move; the position must be re-established
+UNKNOWN = "unknown"
+SLIDER_ROUTE: List[str] = [HOME, MIXER, SEALER]
+
+
+class HomingError(Exception):
+    """The slider did not reach its home switch."""
+
+
+def run_in_turn(actions: List[Callable[[], None]]) -> None:
+    """Runs independent sub-steps one after another."""
+    for action in actions:
+        action()
+
+
+def new_state() -> dict:
+    return {
+        "phase": IDLE,
+        "steps": [],         # Sub-steps of the current phase already done
+        "slider": UNKNOWN,
+        "ingredient": None,  # Ingredient being dispensed
+        "dispensed": 0,      # Grams of it on the scale since its tare, as of the last settled read
+        "tare": None,        # Scale tare id those grams were measured against
+    }
+
+
+class BatchStateMachine:
+    """
+    The batch as an explicit state machine that checkpoints to FPJ_DATA.json.
+
+    Every phase transition, completed sub-step, slider move and dispensing
+    reading is saved as the "BatchState" entry, so after a restart the batch
+    resumes where it stopped: the slider is only homed when its position is
+    not known, the scale is only re-zeroed when its zero is gone, and grams
+    already in the container are not dispensed again.
+
+    Sub-steps that do not depend on each other go through together(), which
+    runs them in turn by default; FPJ_ASYNC passes one that overlaps them.
+    """
+
+    def __init__(self, main, together: Callable[[List[Callable[[], None]]], None] = run_in_turn) -> None:
+        self.main = main
+        self.json = main.json
+        self.together = together
+        self.lock = threading.Lock()  # Overlapped sub-steps checkpoint from their own threads
+        self.state = self.load()
+        self.handlers = {
+            IDLE: self._idle,
+            HOMING: self._homing,
+            DISPENSING: self._dispensing,
+            MIXING: self._mixing,
+            SEALING: self._sealing,
+        }
+
+    # === Checkpoints ===
+    def load(self) -> dict:
+        state = self.json.get_batch_state()
+        if state:
+            return dict(new_state(), **state)
+        # Older data files only have the flags; start from the furthest one set
+        state = new_state()
+        if self.json.is_already_fermenting():
+            state["phase"] = FERMENTING
+        elif self.json.get_mixing_status():
+            state["phase"] = SEALING
+        return state
+
+    def checkpoint(self, **changes) -> None:
+        self.state.update(changes)
+        self.json.set_batch_state(self.state)
+
+    def advance(self, phase: str) -> None:
+        print(f"[STATE] {self.state['phase']} -> {phase}")
+        self.checkpoint(phase=phase, steps=[])
+
+    def reset(self) -> None:
+        """Starts over with a fresh container; the slider position is kept."""
+        self.state = dict(new_state(), slider=self.state["slider"])
+        self.json.set_batch_state(self.state)
+        self.json.set_fermenting(False)
+        self.json.set_mixing_status(False)
+        self.json.reset_weights()
+
+    # === Running ===
+    def run(self) -> None:
+        """Runs the batch from the checkpointed phase until it is fermenting."""
+        if self.state["phase"] != IDLE:
+            print(f"[STATE] Resuming batch at {self.state['phase']} {self.state['steps']}")
+        while self.state["phase"] != FERMENTING:
+            self.handlers[self.state["phase"]]()
+        self._fermenting()
+
+    def _step(self, name: str, action: Callable[[], None]) -> None:
+        """Runs one sub-step of the current phase unless it is already done."""
+        if name in self.state["steps"]:
+            print(f"[STATE] {self.state['phase']}/{name} already done.")
+            return
+        action()
+        with self.lock:
+            self.checkpoint(steps=self.state["steps"] + [name])
+
+    def _steps(self, *steps) -> None:
+        """Runs independent sub-steps of the current phase through together(), each checkpointed on its own."""
+        self.together([lambda name=name, action=action: self._step(name, action) for name, action in steps])
+
+    def move_slider(self, target: str) -> None:
+        """Brings the slider to a location, homing only when its position is not known."""
+        stepper = self.main.stepper
+        position = self.state["slider"]
+        if position == HOME and stepper.slider.is_slider_at_home():
+            stepper.slider_homed = True
+            stepper.slider_steps_from_home = 0
+        if position == target and (target != HOME or stepper.slider_homed):
+            print(f"[STATE] Slider already at {target}.")
+            return
+
+        if (
+            position not in SLIDER_ROUTE
+            or SLIDER_ROUTE.index(position) > SLIDER_ROUTE.index(target)
+            or (position == HOME and not stepper.slider_homed)
+        ):
+            self.checkpoint(slider=MOVING)
+            self.main.show_activity(1)
+            homed = stepper.moveSliderToHome(force=True)
+            self.checkpoint(slider=HOME if homed else UNKNOWN)
+            if not homed:
+                # Carrying on would dispense, mix or seal wherever the container happens to be
+                raise HomingError("Slider did not reach home")
+
+        moves = {MIXER: self.main.move_to_mixer, SEALER: self.main.move_to_sealer}
+        start = SLIDER_ROUTE.index(self.state["slider"]) if self.state["slider"] in SLIDER_ROUTE else 0
+        for location in SLIDER_ROUTE[start + 1:SLIDER_ROUTE.index(target) + 1]:
+            self.checkpoint(slider=MOVING)
+            moves[location]()
+            self.checkpoint(slider=location)
+
+    # === Phases ===
+    def _idle(self) -> None:
+        self.main.LedIndicator.turn_off()
+        self.main.scale.reset_baseline()  # New container: the first ingredient starts with a full tare
+        self.advance(HOMING)
+
+    def _homing(self) -> None:
+        self._steps(("mixer_up", self.main.controller.mixer_up), ("lift_cover", self.main.stepper.lift_cover))
+        self._step("slider_home", lambda: self.move_slider(HOME))
+        self.advance(DISPENSING)
+
+    def _dispensing(self) -> None:
+        main = self.main
+        self.move_slider(HOME)
+        for ingredient in main.plan.steps:
+            if main.status.is_enough(ingredient):
+                main.display_ingredient_weight(ingredient, self.json.get_weight(ingredient.json_key))
+                continue
+            if ingredient.chopped:
+                main.controller.turn_on_chopper()
+            else:
+                main.controller.turn_off_chopper()
+
+            tare = True
+            if self.state["ingredient"] == ingredient.name and self.state["dispensed"] > 0:
+                if self.state["tare"] == main.scale.tare_id:
+                    print(f"[STATE] Continuing {ingredient.name} on the existing zero ({self.state['dispensed']}g so far).")
+                    tare = False
+                else:
+                    # The scale was re-opened since; book what is already in the container
+                    print(f"[STATE] {ingredient.name}: {self.state['dispensed']}g were dispensed before the restart.")
+                    self.json.set_weight(ingredient.json_key, self.json.get_weight(ingredient.json_key) + self.state["dispensed"])
+                    self.checkpoint(dispensed=0)
+                    if main.status.is_enough(ingredient):
+                        continue
+
+            print(f"[DISPENSE] {ingredient.name} not enough. Dispensing...")
+            main.add_ingredient(
+                ingredient,
+                tare=tare,
+                progress_func=lambda weight, deficit, name=ingredient.name: self.checkpoint(
+                    ingredient=name, dispensed=weight, tare=main.scale.tare_id
+                )
+            )
+            self.checkpoint(ingredient=None, dispensed=0, tare=None)
+
+        main.controller.turn_off_chopper()
+        self.advance(MIXING)
+
+    def _mixing(self) -> None:
+        main = self.main
+        print("[SYSTEM] Starting mix process...")
+        for name, action in (
+            ("to_mixer", lambda: self.move_slider(MIXER)),
+            ("mixer_down", main.lower_mixer),
+            ("mixing", main.run_mixer),
+        ):
+            self._step(name, action)
+        self._steps(("mixer_up", main.raise_mixer), ("lift_cover", main.stepper.lift_cover))
+        self.json.set_mixing_status(True)
+        print("[SYSTEM] Mixing process completed.")
+        self.advance(SEALING)
+
+    def _sealing(self) -> None:
+        main = self.main
+        print("[ACTION] Proceeding to packaging...")
+        for name, action in (
+            ("lift_cover", main.stepper.lift_cover),
+            ("to_sealer", lambda: self.move_slider(SEALER)),
+            ("seal", main.seal_container),
+        ):
+            self._step(name, action)
+        self.json.set_fermenting(True)
+        self.advance(FERMENTING)
+
+    def _fermenting(self) -> None:
+        print("[STATUS] Batch already fermenting. Skipping process.")
+        self.main.show_activity(12)
+        self.main.LedIndicator.turn_on()
@@ -1,15 +1,36 @@
-from time import sleep
+from typing import Optional
+import os
+from FPJ_CLOCK import sleep, check_abort
+import FPJ_CALIBRATE
 import FPJ_PCF
 from FPJ_RELAY import RelayController, OutputController
-from FPJ_LIMITSWITCH import LimitStatus
+from FPJ_LIMITSWITCH import LimitStatus, SliderHomeLimitSwitchPin, CoverUpperLimitSwitchPin, CoverLowerLimitSwitchPin
+from FPJ_PROFILER import profiler
+import FPJ_STEPWORKER
 
 # Pin definitions
 SliderPulsePin: int = 15
 SliderDirectionPin: int = 14
-SliderPulseInterval: float = 0.0005
 SealerPulsePin: int = 13
 SealerDirectionPin: int = 12
-SealerPulseInterval: float = 0.001
+
+# Pulse half periods; a machine calibrated with FPJ_CALIBRATE uses its own
+calibration = FPJ_CALIBRATE.load()
+SliderPulseInterval: float = calibration.get("slider", 0.0005)
+SealerPulseInterval: float = calibration.get("sealer", 0.001)
+
+# Destination moves check their limit switch only every CheckInterval steps, so
+# they may overshoot it by at most CheckInterval - 1 steps. Within ApproachSteps
+# of where the switch is expected they slow down and check before every step.
+SliderCheckInterval: int = 10
+SliderApproachSteps: int = 500
+SealerCheckInterval: int = 5
+SealerApproachSteps: int = 50
+ApproachSlowdown: float = 2.0  # Pulse interval multiplier on final approach
+
+# Send pulse trains as multi-word I2C writes timed by the bus clock instead of
+# one write per edge with a sleep in between (FPJ_STEPPER_BURST=0 to disable)
+BurstMode: bool = os.environ.get("FPJ_STEPPER_BURST", "1") != "0"
 
 limit_status = LimitStatus()  # Create only one instance globally
 
@@ -23,13 +44,22 @@ class StepperController:
     controller = RelayController()
     motor_enabled = False  # Track motor power state
 
-    def __init__(self, pulse_pin: int, direction_pin: int, pulse_interval: float):
+    def __init__(
+        self, pulse_pin: int, direction_pin: int, pulse_interval: float, check_interval: int = 1, approach_steps: int = 0
+    ):
         self.ready = FPJ_PCF.relay_ready
         self.pulse_interval = pulse_interval
+        self.check_interval = check_interval
+        self.approach_steps = approach_steps
+        self.last_steps = 0  # Steps made by the last destination move
+
+        self.pulse_pin_number = pulse_pin
+        self.direction_pin_number = direction_pin
+        self.burst = BurstMode and FPJ_PCF.pcf_limitswitch is not None and FPJ_PCF.pcf_limitswitch.burst_capable
 
         if self.ready:
-            self.pulse_pin = OutputController(pulse_pin, "Pulse Pin")
-            self.direction_pin = OutputController(direction_pin, "Direction Pin")
+            self.pulse_pin = OutputController(pulse_pin, f"Pulse Pin {pulse_pin}")
+            self.direction_pin = OutputController(direction_pin, f"Direction Pin {direction_pin}")
             print("StepperController initialized successfully.")
         else:
             print("PCF for relay not ready!")
@@ -52,40 +82,123 @@ class StepperController:
 
         if not self.motor_enabled:
             self.enable()
-        
+
+        worker = FPJ_STEPWORKER.get_worker()
+        if worker is not None:
+            print(f"Moving stepper: direction={direction}, steps={step}")
+            with profiler.wait("stepper_move"):
+                self._report(worker.move(
+                    self.pulse_pin_number, self.direction_pin_number, direction, step, self.pulse_interval, burst=self.burst
+                ))
+            print("Stepper movement complete.")
+            return
+
         self.direction_pin.turn_on() if direction else self.direction_pin.turn_off()
         print(f"Moving stepper: direction={direction}, steps={step}")
 
-        for current_step in range(step):
-            self.pulse_pin.turn_off()
-            sleep(self.pulse_interval)
-            self.pulse_pin.turn_on()
-            sleep(self.pulse_interval)
-            #print(f"Step {current_step + 1} of {step}")
+        with profiler.wait("stepper_move"):
+            self._pulse(step, self.pulse_interval)
 
         print("Stepper movement complete.")
 
-    def move_stepper_to_destination(self, direction: bool = True, max_step: int = 1000, destination_func=None) -> None:
+    def move_stepper_to_destination(
+        self,
+        direction: bool = True,
+        max_step: int = 1000,
+        destination_func=None,
+        switch_pin: int = None,
+        expected_steps: Optional[int] = None,
+    ) -> bool:
+        """
+        Steps until destination_func() is true; returns whether the destination was reached.
+
+        The destination is checked every check_interval steps at full speed.
+        With expected_steps (the known distance to the switch), the last
+        approach_steps before it run slower with a check before every step.
+        With switch_pin (the destination's limit switch) the pulse worker makes
+        the move and checks the switch itself.
+        """
         if not self.ready or self.pulse_pin is None or self.direction_pin is None:
             print("StepperController not ready or pins not initialized.")
-            return
+            return False
 
         if not self.motor_enabled:
             self.enable()
-        
-        self.direction_pin.turn_on() if direction else self.direction_pin.turn_off()
-        print(f"Moving stepper toward destination, direction={direction}")
 
-        for current_step in range(max_step):
-            if destination_func and destination_func():
-                break
+        fast_steps = max_step if expected_steps is None else max(0, expected_steps - self.approach_steps)
+        approach_interval = self.pulse_interval * ApproachSlowdown
+
+        worker = FPJ_STEPWORKER.get_worker()
+        if worker is not None and (switch_pin is not None or destination_func is None):
+            print(f"Moving stepper toward destination, direction={direction}")
+            with profiler.wait("stepper_move"):
+                report = worker.move(
+                    self.pulse_pin_number, self.direction_pin_number, direction, max_step, self.pulse_interval,
+                    switch_pin, self.check_interval, fast_steps, approach_interval, self.burst
+                )
+            self._report(report)
+            self.last_steps = report["steps"]
+            print("Stepper destination movement complete.")
+            return report["result"] == "reached"
+
+        # With the switch on the same expander as the pulses, each pulse train reads it back in one tick
+        pcf = FPJ_PCF.pcf_limitswitch
+        port = FPJ_PCF.PcfPort(pcf) if self.burst and switch_pin is not None and pcf.exchange_capable else None
+        if port:
+            port.set(self.direction_pin_number, not direction)  # Active low, like OutputController.turn_on
+            port.tick()
+        else:
+            self.direction_pin.turn_on() if direction else self.direction_pin.turn_off()
+        print(f"Moving stepper toward destination, direction={direction}")
 
+        reached = False
+        current_step = 0
+        with profiler.wait("stepper_move"):
+            while current_step < max_step:
+                approach = current_step >= fast_steps
+                if (
+                    destination_func
+                    and (approach or current_step % self.check_interval == 0)
+                    and (port.is_low(switch_pin) if port else destination_func())
+                ):
+                    reached = True
+                    break
+
+                count = 1
+                interval = approach_interval if approach else self.pulse_interval
+                if self.burst and not approach:
+                    # Everything up to the next check in one pulse train
+                    count = min(self.check_interval - current_step % self.check_interval, fast_steps - current_step)
+                if port:
+                    count = min(count, pcf.burst_steps(interval))
+                    port.tick(self.pulse_pin_number, count, interval)
+                    check_abort()
+                else:
+                    self._pulse(count, interval)
+                current_step += count
+
+        self.last_steps = current_step
+        print("Stepper destination movement complete.")
+        return reached
+
+    def _pulse(self, steps: int, interval: float) -> None:
+        """Makes steps steps, as burst writes when the expander supports them."""
+        if self.burst:
+            while steps > 0:
+                count = min(steps, FPJ_STEPWORKER.BURST_STEPS)
+                FPJ_PCF.pcf_limitswitch.pulse_train(self.pulse_pin_number, count, interval)
+                check_abort()
+                steps -= count
+            return
+        for _ in range(steps):
             self.pulse_pin.turn_off()
-            sleep(self.pulse_interval)
+            sleep(interval)
             self.pulse_pin.turn_on()
-            sleep(self.pulse_interval)
+            sleep(interval)
 
-        print("Stepper destination movement complete.")
+    def _report(self, report: dict) -> None:
+        if report["max_late"] > self.pulse_interval:
+            print(f"[STEPPER] Pulse edges up to {report['max_late'] * 1000:.2f}ms late during move {report['seq']}.")
 
     def enable(self) -> None:
         if not self.motor_enabled:
@@ -105,52 +218,86 @@ class Steppers:
         self.sealer = StepperController(
             pulse_pin=SealerPulsePin,
             direction_pin=SealerDirectionPin,
-            pulse_interval=SealerPulseInterval
+            pulse_interval=SealerPulseInterval,
+            check_interval=SealerCheckInterval,
+            approach_steps=SealerApproachSteps
         )
 
         self.slider = StepperController(
             pulse_pin=SliderPulsePin,
             direction_pin=SliderDirectionPin,
-            pulse_interval=SliderPulseInterval
+            pulse_interval=SliderPulseInterval,
+            check_interval=SliderCheckInterval,
+            approach_steps=SliderApproachSteps
         )
+        self.slider_homed = False  # Slider known to be at the home switch
+        self.slider_steps_from_home: Optional[int] = None  # Known once homed
+        self.cover_steps_from_down: Optional[int] = None  # Known once sealed
+        self.cover_travel: Optional[int] = None  # Steps from cover down to cover up, learned on a full lift
 
     def lift_cover(self) -> None:
         print("Lifting cover...")
-        self.sealer.move_stepper_to_destination(
+        start = self.cover_steps_from_down
+        expected = None if start is None or self.cover_travel is None else self.cover_travel - start
+        reached = self.sealer.move_stepper_to_destination(
             direction=True,
             max_step=1000,
-            destination_func=limit_status.is_cover_up
+            destination_func=limit_status.is_cover_up,
+            switch_pin=CoverUpperLimitSwitchPin,
+            expected_steps=expected
         )
+        if reached and start is not None:
+            self.cover_travel = start + self.sealer.last_steps
+        self.cover_steps_from_down = self.cover_travel if reached else None
 
     def seal(self) -> None:
         print("Sealing...")
-        self.sealer.move_stepper_to_destination(
+        reached = self.sealer.move_stepper_to_destination(
             direction=False,
             max_step=1000,
-            destination_func=limit_status.is_cover_down
+            destination_func=limit_status.is_cover_down,
+            switch_pin=CoverLowerLimitSwitchPin,
+            expected_steps=self.cover_steps_from_down
         )
+        self.cover_steps_from_down = 0 if reached else None
 
-    def moveSliderToHome(self) -> None:
+    def moveSliderToHome(self, force: bool = False) -> bool:
+        """Homes the slider (unless known to be home) and returns whether it is at the home switch."""
+        if self.slider_homed and not force:
+            print("Slider already at home.")
+            return True
         print("Moving slider to home...")
         self.slider.enable()
         self.lift_cover()
-        self.slider.move_stepper_to_destination(
+        self.slider_homed = self.slider.move_stepper_to_destination(
             direction=True,
             max_step=100000,  # Safety max steps to prevent endless loop
-            destination_func=limit_status.is_slider_home
+            destination_func=limit_status.is_slider_home,
+            switch_pin=SliderHomeLimitSwitchPin,
+            expected_steps=self.slider_steps_from_home
         )
+        self.slider_steps_from_home = 0 if self.slider_homed else None
+        return self.slider_homed
 
     def moveSliderToMixer(self) -> None:
         print("Moving slider to mixer...")
+        self.slider_homed = False
         self.slider.enable()
         self.lift_cover()
         self.slider.move_stepper(False, step=21000)
+        self._slider_moved(21000)
 
     def moveSliderToSealer(self) -> None:
         print("Moving slider to sealer...")
+        self.slider_homed = False
         self.slider.enable()
         self.lift_cover()
         self.slider.move_stepper(False, step=37000)
+        self._slider_moved(37000)
+
+    def _slider_moved(self, steps: int) -> None:
+        if self.slider_steps_from_home is not None:
+            self.slider_steps_from_home += steps
 
     def disableSealer(self) -> None:
         print("Disabling sealer...")
@@ -0,0 +1,362 @@
+import gc
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from typing import Optional
+import FPJ_CLOCK
+import FPJ_PCF
+import FPJ_TRACE
+
+# A real-time, spinning worker needs a CPU of its own; on a single core it would
+# starve the control code (and the scale reader) for the length of every move.
+CPUS: int = os.cpu_count() or 1
+
+# "process" runs the pulse loop in a forked worker process, "thread" in a thread of
+# this process (simulator, trace replay and recording, where the expanders only
+# exist here, and single-core hosts) and "off" keeps the old inline loop.
+MODE: str = os.environ.get(
+    "FPJ_STEPPER_WORKER",
+    "process" if FPJ_PCF.BACKEND == "hardware" and not FPJ_TRACE.recorder and CPUS > 1 else "thread",
+)
+WORKER_CPU: int = int(os.environ.get("FPJ_STEPPER_CPU", CPUS - 1))
+WORKER_PRIORITY: int = 50  # SCHED_FIFO priority with a spare CPU; otherwise a negative nice value
+SPIN_TIME: float = 0.0002  # Seconds before a pulse edge the worker stops sleeping and spins (spare CPU only)
+WAIT_POLL: float = 0.05  # Seconds between abort checks while waiting for a move
+
+# Commands: seq, op, pulse pin, direction pin, direction, flags, switch pin (-1 = none),
+# switch check interval, steps, fast steps, half period, approach half period
+COMMAND = struct.Struct("<IBBBBBbHIIdd")
+OP_MOVE = 1
+OP_QUIT = 2
+FLAG_PARTICIPATE = 1  # Thread mode: sleep as a virtual clock participant
+FLAG_BURST = 2        # Send pulses as burst writes timed by the I2C bus clock
+BURST_STEPS: int = 256  # Most steps sent between two stop-request checks in burst mode
+
+# Reports: seq, result, steps done, duration, worst lateness of a pulse edge (0 for
+# burst moves, which the I2C bus clock times)
+REPORT = struct.Struct("<IBIdd")
+DONE = 0      # All steps made
+REACHED = 1   # Stopped at the limit switch
+STOPPED = 2   # Stopped on request
+RESULTS = {DONE: "done", REACHED: "reached", STOPPED: "stopped"}
+
+# Status block: running seq, steps done in it, stop request, shared 0x20 output latch,
+# then one signed step position per expander pin
+STATUS = struct.Struct("<IIII16q")
+STATUS_SEQ = 0
+STATUS_STEPS = 4
+STATUS_STOP = 8
+STATUS_LATCH = 12
+STATUS_POSITIONS = 16
+
+
+class RingBuffer:
+    """
+    Single-producer, single-consumer ring of fixed-size records in shared memory.
+
+    Layout: head and tail counters (uint64) followed by the slots. Only the
+    producer advances head and only the consumer advances tail, and a record
+    is written before head moves past it, so no lock is needed.
+    """
+
+    COUNTERS = struct.Struct("<QQ")
+
+    def __init__(self, memory: memoryview, record: struct.Struct, slots: int) -> None:
+        self.memory = memory
+        self.record = record
+        self.slots = slots
+
+    @classmethod
+    def size(cls, record: struct.Struct, slots: int) -> int:
+        return cls.COUNTERS.size + record.size * slots
+
+    def push(self, *values) -> bool:
+        head, tail = self.COUNTERS.unpack_from(self.memory, 0)
+        if head - tail >= self.slots:
+            return False
+        self.record.pack_into(self.memory, self.COUNTERS.size + (head % self.slots) * self.record.size, *values)
+        struct.pack_into("<Q", self.memory, 0, head + 1)
+        return True
+
+    def pop(self) -> Optional[tuple]:
+        head, tail = self.COUNTERS.unpack_from(self.memory, 0)
+        if head == tail:
+            return None
+        values = self.record.unpack_from(self.memory, self.COUNTERS.size + (tail % self.slots) * self.record.size)
+        struct.pack_into("<Q", self.memory, 8, tail + 1)
+        return values
+
+
+class StepperWorker:
+    """
+    Generates stepper pulse trains away from the control code.
+
+    The main process submits whole moves (pins, direction, step count, half
+    period and an optional limit switch to stop at, with how often to check
+    it and where the slower final approach starts) through a command ring
+    and gets completion reports (result, steps made, duration and worst pulse
+    lateness) back through a report ring. A status block in the same shared
+    memory shows the running move's progress and every motor's position.
+
+    In process mode the worker is pinned to its own CPU, runs at real-time
+    priority with the garbage collector off and times edges against absolute
+    deadlines, so prints, LCD updates and GC pauses in the main process no
+    longer stretch the pulses. Both processes drive the 0x20 expander through
+    one shared output latch, each on its own I2C file descriptor. Without a
+    spare CPU (process mode forced on a single core) it only raises its nice
+    value and sleeps to every edge.
+    """
+
+    def __init__(self, mode: str = MODE, slots: int = 16) -> None:
+        if mode == "process" and (FPJ_PCF.BACKEND != "hardware" or FPJ_TRACE.recorder):
+            # Simulated, traced and replayed expanders only exist in this process
+            raise ValueError("FPJ_STEPPER_WORKER=process needs the hardware backend without FPJ_TRACE")
+        self.mode = mode
+        self.pcf = FPJ_PCF.pcf_limitswitch
+        sizes = [STATUS.size, RingBuffer.size(COMMAND, slots), RingBuffer.size(REPORT, slots)]
+        if mode == "process":
+            context = multiprocessing.get_context("fork")
+            self.shared = context.RawArray("B", sum(sizes))
+            memory = memoryview(self.shared).cast("B")
+            self.doorbell = context.Semaphore(0)
+            self.done_bell = context.Semaphore(0)
+            lock = context.RLock()
+        else:
+            self.shared = bytearray(sum(sizes))
+            memory = memoryview(self.shared)
+            self.doorbell = threading.Semaphore(0)
+            self.done_bell = threading.Semaphore(0)
+            lock = None
+        self.status = memory[:sizes[0]]
+        self.commands = RingBuffer(memory[sizes[0]:sizes[0] + sizes[1]], COMMAND, slots)
+        self.reports = RingBuffer(memory[sizes[0] + sizes[1]:], REPORT, slots)
+        self.seq = 0
+        self.spin = False  # Set in a worker process that has a CPU to itself
+        self.pending: dict = {}  # Reports collected for moves not waited on yet
+        self.submit_lock = threading.Lock()
+
+        if mode == "process":
+            self.pcf.share(self.status, STATUS_LATCH, lock)
+            self.worker = context.Process(target=self._run_process, name="fpj-stepper", daemon=True)
+        else:
+            self.worker = threading.Thread(target=self._run, name="fpj-stepper", daemon=True)
+        self.worker.start()
+        print(f"[STEPPER] Pulse worker started ({mode}).")
+
+    # === Main process side ===
+    def submit(
+        self,
+        pulse_pin: int,
+        direction_pin: int,
+        direction: bool,
+        steps: int,
+        half_period: float,
+        switch_pin: Optional[int] = None,
+        check_interval: int = 1,
+        fast_steps: Optional[int] = None,
+        approach_half_period: Optional[float] = None,
+        burst: bool = False,
+    ) -> int:
+        """
+        Queues a move and returns its sequence number.
+
+        The first fast_steps steps (default: all) run at half_period and check
+        the switch every check_interval steps; the rest run at
+        approach_half_period and check it before every step. With burst, steps
+        between two switch checks go out as one pulse train that also reads
+        the switch back (a PcfPort tick).
+        """
+        flags = FLAG_BURST if burst and self.pcf.exchange_capable else 0
+        clock = FPJ_CLOCK.clock
+        if self.mode == "thread" and isinstance(clock, FPJ_CLOCK.VirtualClock) and threading.get_ident() in clock.participants:
+            flags |= FLAG_PARTICIPATE
+            clock.expect()
+        with self.submit_lock:
+            self.seq += 1
+            seq = self.seq
+            while not self.commands.push(
+                seq, OP_MOVE, pulse_pin, direction_pin, direction, flags,
+                -1 if switch_pin is None else switch_pin, max(1, check_interval), steps,
+                steps if fast_steps is None else min(fast_steps, steps),
+                half_period, half_period if approach_half_period is None else approach_half_period,
+            ):
+                time.sleep(0.001)  # Queue full; the worker frees a slot per finished move
+        self.doorbell.release()
+        return seq
+
+    def wait(self, seq: int, abortable: bool = True) -> dict:
+        """Waits for a move's report; aborting the waiting thread stops the move."""
+        clock = FPJ_CLOCK.clock
+        participant = isinstance(clock, FPJ_CLOCK.VirtualClock) and threading.get_ident() in clock.participants
+        while True:
+            with self.submit_lock:
+                while (report := self.reports.pop()) is not None:
+                    self.pending[report[0]] = report
+                report = self.pending.pop(seq, None)
+            if report is not None:
+                seq, result, steps, duration, max_late = report
+                return {"seq": seq, "result": RESULTS[result], "steps": steps, "duration": duration, "max_late": max_late}
+            try:
+                if abortable:
+                    FPJ_CLOCK.check_abort()
+                if participant:
+                    clock.sleep(WAIT_POLL)  # Lets the worker's virtual time pass
+                else:
+                    self.done_bell.acquire(timeout=WAIT_POLL)
+            except FPJ_CLOCK.Aborted:
+                self.stop()
+                self.wait(seq, abortable=False)
+                raise
+
+    def move(self, *args, **kwargs) -> dict:
+        """Submits a move and waits for its report."""
+        return self.wait(self.submit(*args, **kwargs))
+
+    def stop(self) -> None:
+        """Asks the worker to end the running move after the current step."""
+        struct.pack_into("<I", self.status, STATUS_STOP, 1)
+
+    def position(self, pulse_pin: int) -> int:
+        """Net steps made on a pulse pin (positive for direction=True moves)."""
+        return struct.unpack_from("<q", self.status, STATUS_POSITIONS + 8 * pulse_pin)[0]
+
+    def progress(self) -> dict:
+        seq, steps = struct.unpack_from("<II", self.status, STATUS_SEQ)
+        return {"seq": seq, "steps": steps}
+
+    def close(self) -> None:
+        with self.submit_lock:
+            self.commands.push(0, OP_QUIT, 0, 0, 0, 0, -1, 1, 0, 0, 0.0, 0.0)
+        self.doorbell.release()
+        self.worker.join(timeout=2)
+
+    # === Worker side ===
+    def _run_process(self) -> None:
+        """Process entry: isolate the pulse loop, then run it with wall-clock deadlines."""
+        FPJ_PCF.reopen_limitswitch()
+        if CPUS > 1:
+            try:
+                os.sched_setaffinity(0, {WORKER_CPU})
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(WORKER_PRIORITY))
+                self.spin = True
+            except (AttributeError, OSError) as e:
+                print(f"[WARN] Stepper worker not isolated: {e}")
+        if not self.spin:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, -10)
+            except OSError as e:
+                print(f"[WARN] Stepper worker priority not raised: {e}")
+        gc.freeze()
+        gc.disable()
+        self._run(realtime=True)
+
+    def _run(self, realtime: bool = False) -> None:
+        while True:
+            self.doorbell.acquire()
+            command = self.commands.pop()
+            if command is None:
+                continue
+            seq, op, flags = command[0], command[1], command[5]
+            move = command[:1] + command[2:5] + command[6:]
+            if op == OP_QUIT:
+                return
+            if flags & FLAG_PARTICIPATE:
+                with FPJ_CLOCK.participant(expected=True):
+                    self._report(self._move(*move, realtime, bool(flags & FLAG_BURST)))
+            else:
+                self._report(self._move(*move, realtime, bool(flags & FLAG_BURST)))
+
+    def _report(self, report: tuple) -> None:
+        while not self.reports.push(*report):
+            time.sleep(0.001)
+        self.done_bell.release()
+
+    def _move(
+        self, seq, pulse_pin, direction_pin, direction, switch_pin, check_interval, steps, fast_steps,
+        half_period, approach_half_period, realtime, burst
+    ) -> tuple:
+        pcf = self.pcf
+        status = self.status
+        struct.pack_into("<III", status, STATUS_SEQ, seq, 0, 0)
+        position_offset = STATUS_POSITIONS + 8 * pulse_pin
+        position = struct.unpack_from("<q", status, position_offset)[0]
+        delta = 1 if direction else -1
+        port = FPJ_PCF.PcfPort(pcf) if burst else None
+        if port:
+            port.set(direction_pin, not direction)  # Outputs are active low, like OutputController.turn_on
+            port.tick()  # Direction and the first switch reading in one transaction
+        else:
+            pcf.write_pin(direction_pin, not direction)
+
+        result = DONE
+        done = 0
+        max_late = 0.0
+        start = time.perf_counter() if realtime else FPJ_CLOCK.monotonic()
+        edge = start
+        while True:
+            approach = done >= fast_steps
+            if (
+                switch_pin >= 0
+                and (approach or done % check_interval == 0)
+                and (port.is_low(switch_pin) if port else not pcf.read_pin(switch_pin))  # Active low
+            ):
+                result = REACHED
+                break
+            if done == steps:
+                break
+            if struct.unpack_from("<I", status, STATUS_STOP)[0]:
+                result = STOPPED
+                break
+            period = approach_half_period if approach else half_period
+            count = 1
+            if port:
+                # Everything up to the next switch check in one tick, which reads the switch after it
+                if not approach:
+                    count = min(fast_steps, steps) - done
+                    if switch_pin >= 0:
+                        count = min(count, check_interval - done % check_interval)
+                count = min(count, BURST_STEPS, pcf.burst_steps(period))
+                port.tick(pulse_pin, count, period)
+            else:
+                for level in (True, False):  # Pulse off, then on
+                    pcf.write_pin(pulse_pin, level)
+                    if realtime:
+                        max_late = max(max_late, time.perf_counter() - edge)
+                        edge += period
+                        self._sleep_until(edge, self.spin)
+                    else:
+                        FPJ_CLOCK.clock.sleep(period)
+            done += count
+            position += delta * count
+            struct.pack_into("<I", status, STATUS_STEPS, done)
+            struct.pack_into("<q", status, position_offset, position)
+
+        duration = (time.perf_counter() if realtime else FPJ_CLOCK.monotonic()) - start
+        struct.pack_into("<I", status, STATUS_STOP, 0)
+        return (seq, result, done, duration, max_late)
+
+    @staticmethod
+    def _sleep_until(deadline: float, spin: bool) -> None:
+        """Sleeps until shortly before deadline, then spins onto it; without spin sleeps all the way."""
+        remaining = deadline - time.perf_counter()
+        if not spin:
+            if remaining > 0:
+                time.sleep(remaining)
+            return
+        if remaining > SPIN_TIME:
+            time.sleep(remaining - SPIN_TIME)
+        while time.perf_counter() < deadline:
+            os.sched_yield()  # Lets anything else runnable on the worker's CPU go first
+
+
+worker: Optional[StepperWorker] = None
+
+
+def get_worker() -> Optional[StepperWorker]:
+    """The shared pulse worker, started on first use; None when disabled or the expander is missing."""
+    global worker
+    if worker is None and MODE != "off" and FPJ_PCF.pcf_limitswitch is not None:
+        worker = StepperWorker()
+    return worker
@@ -0,0 +1,450 @@
+import os
+import struct
+import sys
+import FPJ_CLOCK
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# === Trace file format ===
+# Header: MAGIC + version byte, then one record per hardware interaction:
+#   <IBBHH  delta_us, kind, device, value, payload length  (+ payload bytes)
+# delta_us is the time since the previous record, so timestamps stay small.
+MAGIC: bytes = b"FPJT"
+VERSION: int = 1
+RECORD = struct.Struct("<IBBHH")
+
+# Record kinds
+PIN_WRITE = 1     # device = I2C address, value = pin << 1 | level
+PIN_READ = 2      # device = I2C address, value = pin << 1 | level
+SERIAL_WRITE = 3  # payload = bytes written to the scale
+SERIAL_READ = 4   # payload = line read from the scale; value = 1 for raw bytes read while streaming samples
+SERVO_WRITE = 5   # value = angle + 180
+MARK = 6          # payload = free-form label
+BURST_WRITE = 7   # device = I2C address, value = word count, payload = the words written
+EXCHANGE = 8      # device = I2C address, value = word count, payload = the words written + the input word read
+
+SCALE_DEVICE = 1
+SERVO_DEVICE = 2
+
+SERIAL_SLACK: float = 0.001  # Seconds a replayed scale line may arrive early (timestamp rounding)
+
+KIND_NAMES = {
+    PIN_WRITE: "pin_write",
+    PIN_READ: "pin_read",
+    SERIAL_WRITE: "serial_write",
+    SERIAL_READ: "serial_read",
+    SERVO_WRITE: "servo_write",
+    MARK: "mark",
+    BURST_WRITE: "burst_write",
+    EXCHANGE: "exchange",
+}
+
+
+class TraceExhausted(Exception):
+    """Raised during replay when the code asks for more input than was recorded."""
+
+
+def is_weight_request(payload: bytes) -> bool:
+    """True for a scale WEIGHT command, tagged ("7:WEIGHT") or not."""
+    return payload.split(b":", 1)[-1].startswith(b"WEIGHT")
+
+
+class TraceRecorder:
+    """Appends hardware interactions with monotonic timestamps to a binary trace file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + bytes([VERSION]))
+        self.last_us = int(FPJ_CLOCK.monotonic() * 1_000_000)
+        self.count = 0
+        print(f"[TRACE] Recording hardware trace to {path}")
+
+    def record(self, kind: int, device: int = 0, value: int = 0, payload: bytes = b"") -> None:
+        now = int(FPJ_CLOCK.monotonic() * 1_000_000)
+        delta_us = min(now - self.last_us, 0xFFFFFFFF)
+        self.last_us = now
+        self.file.write(RECORD.pack(delta_us, kind, device, value & 0xFFFF, len(payload)))
+        if payload:
+            self.file.write(payload)
+        self.count += 1
+
+    def mark(self, label: str) -> None:
+        self.record(MARK, payload=label.encode("utf-8"))
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.file.close()
+            print(f"[TRACE] Saved {self.count} records to {self.path}")
+
+
+def read_trace(path: str) -> List[Tuple[float, int, int, int, bytes]]:
+    """Loads a trace file as (seconds since start, kind, device, value, payload) tuples."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not an FPJ trace file")
+    offset = len(MAGIC) + 1
+    elapsed = 0.0
+    records = []
+    while offset + RECORD.size <= len(data):
+        delta_us, kind, device, value, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        payload = bytes(data[offset:offset + length])
+        offset += length
+        elapsed += delta_us / 1_000_000
+        records.append((elapsed, kind, device, value, payload))
+    return records
+
+
+# === Recording wrappers ===
+class TracedPin:
+    """Pin proxy that mirrors the adafruit_pcf8575 DigitalInOut interface."""
+
+    def __init__(self, pcf: "TracedPcf", pin_number: int) -> None:
+        self._pcf = pcf
+        self._pin = pin_number
+
+    def switch_to_output(self, value: bool = False, **kwargs) -> None:
+        self.value = value
+
+    def switch_to_input(self, pull=None, **kwargs) -> None:
+        # PCF8575 inputs are just outputs latched high (weak pull-up)
+        self._pcf.write_pin(self._pin, True)
+
+    @property
+    def value(self) -> bool:
+        return self._pcf.read_pin(self._pin)
+
+    @value.setter
+    def value(self, val: bool) -> None:
+        self._pcf.write_pin(self._pin, val)
+
+
+class TracedPcf:
+    """Wraps a PCF8575 so every pin write and read is recorded."""
+
+    def __init__(self, pcf, address: int, recorder: TraceRecorder) -> None:
+        self.pcf = pcf
+        self.address = address
+        self.recorder = recorder
+
+    def get_pin(self, pin: int) -> TracedPin:
+        assert 0 <= pin <= 15
+        return TracedPin(self, pin)
+
+    def write_pin(self, pin: int, val: bool) -> None:
+        self.pcf.write_pin(pin, val)
+        self.recorder.record(PIN_WRITE, self.address, pin << 1 | bool(val))
+
+    def read_pin(self, pin: int) -> bool:
+        val = self.pcf.read_pin(pin)
+        self.recorder.record(PIN_READ, self.address, pin << 1 | bool(val))
+        return val
+
+    def write_burst(self, data: bytes, word_time: float) -> float:
+        remaining = self.pcf.write_burst(data, word_time)
+        self.recorder.record(BURST_WRITE, self.address, len(data) // 2, data)
+        return remaining
+
+    def exchange(self, data: bytes, word_time: float) -> Tuple[int, float]:
+        inputs, remaining = self.pcf.exchange(data, word_time)
+        self.recorder.record(EXCHANGE, self.address, len(data) // 2, data + struct.pack("<H", inputs))
+        return inputs, remaining
+
+
+class TracedSerial:
+    """Wraps the scale's serial port so commands and response lines are recorded."""
+
+    def __init__(self, connection, recorder: TraceRecorder) -> None:
+        self.connection = connection
+        self.recorder = recorder
+
+    @property
+    def in_waiting(self) -> int:
+        return self.connection.in_waiting
+
+    def write(self, data: bytes) -> int:
+        self.recorder.record(SERIAL_WRITE, SCALE_DEVICE, payload=bytes(data))
+        return self.connection.write(data)
+
+    def readline(self) -> bytes:
+        line = self.connection.readline()
+        self.recorder.record(SERIAL_READ, SCALE_DEVICE, payload=line)
+        return line
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.connection.read(size)
+        self.recorder.record(SERIAL_READ, SCALE_DEVICE, 1, data)
+        return data
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class TracedServo:
+    """Wraps a gpiozero AngularServo so angle writes are recorded."""
+
+    def __init__(self, servo, recorder: TraceRecorder) -> None:
+        self._servo = servo
+        self.recorder = recorder
+
+    @property
+    def angle(self):
+        return self._servo.angle
+
+    @angle.setter
+    def angle(self, value) -> None:
+        self._servo.angle = value
+        self.recorder.record(SERVO_WRITE, SERVO_DEVICE, int(round(value)) + 180)
+
+
+# === Replay ===
+class ReplayPcf:
+    """Stands in for a PCF8575, answering reads from the trace and checking writes against it."""
+
+    def __init__(self, player: "TracePlayer", address: int) -> None:
+        self.player = player
+        self.address = address
+
+    def get_pin(self, pin: int) -> TracedPin:
+        assert 0 <= pin <= 15
+        return TracedPin(self, pin)
+
+    def write_pin(self, pin: int, val: bool) -> None:
+        self.player.expect(PIN_WRITE, self.address, pin << 1 | bool(val))
+
+    def read_pin(self, pin: int) -> bool:
+        value = self.player.next_input(PIN_READ, self.address, pin)
+        return bool(value & 1)
+
+    def write_burst(self, data: bytes, word_time: float) -> float:
+        self.player.expect(BURST_WRITE, self.address, len(data) // 2, data)
+        return len(data) // 2 * word_time
+
+    def exchange(self, data: bytes, word_time: float) -> Tuple[int, float]:
+        self.player.expect(EXCHANGE, self.address, len(data) // 2, data)
+        return self.player.next_input(EXCHANGE, self.address, 0), len(data) // 2 * word_time
+
+
+class ReplaySerial:
+    """Stands in for the scale's serial port, replaying the recorded response lines."""
+
+    def __init__(self, player: "TracePlayer") -> None:
+        self.player = player
+        self.pending: int = 0  # Commands written whose reply has not been read yet
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.player.has_input(SERIAL_READ, SCALE_DEVICE, 0):
+            raise TraceExhausted("Scale asked for a response that was never recorded")
+        elapsed, line, raw = self.player.inputs[(SERIAL_READ, SCALE_DEVICE, 0)][0]
+        if raw:
+            # Streamed bytes are unsolicited too
+            return len(line) if elapsed <= self.player.elapsed() + SERIAL_SLACK else 0
+        # Lines only arrive when they did during recording (a booting ESP32 leaves
+        # probes unanswered), and replies only once a command was written
+        due = elapsed <= self.player.elapsed() + SERIAL_SLACK
+        if line.startswith(b"HIT,"):
+            return int(due)
+        return int(due and self.pending > 0)
+
+    def write(self, data: bytes) -> int:
+        self.player.expect(SERIAL_WRITE, SCALE_DEVICE, 0, bytes(data))
+        self.pending += 1
+        return len(data)
+
+    def readline(self) -> bytes:
+        line = self.player.next_input(SERIAL_READ, SCALE_DEVICE, 0)[1]
+        if not line.startswith(b"HIT,"):
+            self.pending = max(0, self.pending - 1)
+        return line
+
+    def read(self, size: int = 1) -> bytes:
+        # Replies read within streamed bytes are not counted one by one; the stream
+        # ends with the reply to STREAM,0, the last command written, so none are left
+        self.pending = 0
+        return self.player.next_input(SERIAL_READ, SCALE_DEVICE, 0)[1]
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayServo:
+    """Stands in for the molasses servo, checking angle writes against the trace."""
+
+    def __init__(self, player: "TracePlayer") -> None:
+        self.player = player
+        self._angle = None
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, value) -> None:
+        self._angle = value
+        self.player.expect(SERVO_WRITE, SERVO_DEVICE, int(round(value)) + 180)
+
+
+class TracePlayer:
+    """
+    Feeds a recorded trace back through the same code.
+
+    Inputs (pin reads, scale lines) are served per pin/device in recorded
+    order, so the code sees exactly the hardware it saw during recording.
+    Outputs are compared against the recorded outputs in order; mismatches
+    and their timing drift are collected for the replay report.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.records = read_trace(path)
+        self.inputs: Dict[Tuple[int, int, int], Deque] = defaultdict(deque)
+        self.outputs: Deque = deque()
+        for elapsed, kind, device, value, payload in self.records:
+            if kind == PIN_READ:
+                self.inputs[(kind, device, value >> 1)].append(value)
+            elif kind == SERIAL_READ:
+                self.inputs[(kind, device, 0)].append((elapsed, payload, value))
+            elif kind == EXCHANGE:
+                # The written words are checked like a burst; the word read is served as an input
+                self.inputs[(kind, device, 0)].append(struct.unpack("<H", payload[-2:])[0])
+                self.outputs.append((elapsed, kind, device, value, payload[:-2]))
+            elif kind in (PIN_WRITE, SERIAL_WRITE, SERVO_WRITE, BURST_WRITE):
+                self.outputs.append((elapsed, kind, device, value, payload))
+        self.recorded_duration = self.records[-1][0] if self.records else 0.0
+        self.start = FPJ_CLOCK.monotonic()
+        self.matched = 0
+        self.mismatches: List[str] = []
+        self.max_drift = 0.0
+        self.weight_requests = 0
+        print(f"[TRACE] Replaying {len(self.records)} records from {path}")
+
+    def elapsed(self) -> float:
+        return FPJ_CLOCK.monotonic() - self.start
+
+    def has_input(self, kind: int, device: int, key: int) -> bool:
+        return bool(self.inputs[(kind, device, key)])
+
+    def next_input(self, kind: int, device: int, key: int):
+        queue = self.inputs[(kind, device, key)]
+        if not queue:
+            raise TraceExhausted(f"No recorded {KIND_NAMES[kind]} left for device 0x{device:02X}/{key}")
+        return queue.popleft()
+
+    def expect(self, kind: int, device: int, value: int, payload: bytes = b"") -> None:
+        if kind == SERIAL_WRITE and is_weight_request(payload):
+            self.weight_requests += 1
+        if not self.outputs:
+            self.mismatches.append(f"extra {KIND_NAMES[kind]} {device}:{value} {payload!r}")
+            return
+        elapsed, rec_kind, rec_device, rec_value, rec_payload = self.outputs.popleft()
+        if (rec_kind, rec_device, rec_value, rec_payload) != (kind, device, value & 0xFFFF, payload):
+            self.mismatches.append(
+                f"expected {KIND_NAMES[rec_kind]} {rec_device}:{rec_value} {rec_payload!r}, "
+                f"got {KIND_NAMES[kind]} {device}:{value} {payload!r}"
+            )
+            return
+        self.matched += 1
+        self.max_drift = max(self.max_drift, abs(self.elapsed() - elapsed))
+
+    def pcf(self, address: int) -> ReplayPcf:
+        return ReplayPcf(self, address)
+
+    def serial(self) -> ReplaySerial:
+        return ReplaySerial(self)
+
+    def servo(self) -> ReplayServo:
+        return ReplayServo(self)
+
+    def recorded_weight_requests(self) -> int:
+        return sum(
+            1 for _, kind, _, _, payload in self.records
+            if kind == SERIAL_WRITE and is_weight_request(payload)
+        )
+
+    def report(self) -> dict:
+        """Summarizes how the replay compared to the recording."""
+        summary = {
+            "recorded_duration": round(self.recorded_duration, 3),
+            "replay_duration": round(FPJ_CLOCK.monotonic() - self.start, 3),
+            "max_drift": round(self.max_drift, 3),
+            "matched_outputs": self.matched,
+            "missing_outputs": len(self.outputs),
+            "mismatches": len(self.mismatches),
+            "recorded_weight_requests": self.recorded_weight_requests(),
+            "replayed_weight_requests": self.weight_requests,
+        }
+        for key, value in summary.items():
+            print(f"[REPLAY] {key}: {value}")
+        for mismatch in self.mismatches[:10]:
+            print(f"[REPLAY] mismatch: {mismatch}")
+        return summary
+
+
+# === Module state, selected from the environment before the hardware modules load ===
+recorder: Optional[TraceRecorder] = None
+player: Optional[TracePlayer] = None
+
+if os.environ.get("FPJ_REPLAY"):
+    player = TracePlayer(os.environ["FPJ_REPLAY"])
+elif os.environ.get("FPJ_TRACE"):
+    recorder = TraceRecorder(os.environ["FPJ_TRACE"])
+
+
+def wrap_pcf(pcf, address: int):
+    """Returns the PCF8575 wrapped for recording, or unchanged when not tracing."""
+    return TracedPcf(pcf, address, recorder) if recorder and pcf is not None else pcf
+
+
+def wrap_serial(connection):
+    """Returns the serial port wrapped for recording, or unchanged when not tracing."""
+    return TracedSerial(connection, recorder) if recorder else connection
+
+
+def wrap_servo(servo):
+    """Returns the servo wrapped for recording, or unchanged when not tracing."""
+    return TracedServo(servo, recorder) if recorder else servo
+
+
+def mark(label: str) -> None:
+    """Adds a label to the trace being recorded."""
+    if recorder:
+        recorder.mark(label)
+
+
+def close() -> None:
+    """Flushes and closes the trace being recorded."""
+    if recorder:
+        recorder.close()
+
+
+def replay(path: str, module: str = "main") -> dict:
+    """
+    Replays a trace through a script and reports timing and dispense-count regressions.
+
+    Must run in a fresh process: the trace backend is chosen when FPJ_PCF is imported.
+    """
+    import runpy
+
+    os.environ["FPJ_REPLAY"] = path
+    os.environ.pop("FPJ_TRACE", None)
+    import FPJ_TRACE  # The instance the hardware modules share, even when run as a script
+
+    try:
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+    except FPJ_TRACE.TraceExhausted as e:
+        print(f"[REPLAY] Diverged from the recording: {e}")
+    return FPJ_TRACE.player.report()
+
+
+# Usage:
+#   FPJ_TRACE=batch.trace python3 main.py     record a batch
+#   python3 FPJ_TRACE.py batch.trace          replay it and compare
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 FPJ_TRACE.py <trace file>")
+        sys.exit(1)
+    result = replay(sys.argv[1])
+    sys.exit(0 if result["mismatches"] == 0 and result["missing_outputs"] == 0 else 1)
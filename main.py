@@ -1,38 +1,50 @@
-from time import sleep
-from FPJ_SCALE import Scale
+from FPJ_CLOCK import sleep
+from FPJ_SCALE import Scale, ApproachSampler
 from FPJ_STEPPER import Steppers
 from FPJ_RELAY import RelayController, OutputController
 from FPJ_JSON import FpjJson, FpjStatus
-from FPJ_LCD import FPJ_LCD
+from FPJ_LCD import FPJ_LCD, ActivityMap
+from FPJ_PROFILER import profiler
+from FPJ_RECIPE import load_plan, PlanStep
+import FPJ_TRACE
+import sys
 
 # python3 main.py
 
-serial_port = '/dev/ttyUSB0'  # Serial port of the ESP32 connected to the HX711
+serial_port = '/dev/ttyUSB0'  # Where the ESP32 with the HX711 usually is; the other USB serial ports are probed too
 scale = Scale(serial_port)
 stepper = Steppers()
 controller = RelayController()
-status = FpjStatus()
+plan = load_plan()  # FPJ_RECIPE.json, or the file named by FPJ_RECIPE
+status = FpjStatus(plan)
 json = FpjJson()
 lcd = FPJ_LCD()
 
 LedIndicator = OutputController(pin_number=8, name="Ready for harvest")
 LedIndicator.turn_off()
 
-TARGET_WEIGHTS = {
-    'KAKAWATE': 1000,
-    'NEEM': 1000,
-    'MOLASSES': 2000,
-    'WATER': 2000
+# Relay dispensers by recipe actuator name; molasses goes through its servo session
+DISPENSERS = {
+    "kakawate": controller.dispense_kakawate,
+    "neem": controller.dispense_neem,
+    "water": controller.pump_water,
 }
+FINAL_SAMPLES: int = 16  # HX711 conversions the ESP32 averages for each ingredient's final weight
+
+
+def show_activity(activity: int) -> None:
+    """Shows the activity on the LCD and starts timing it as a batch phase."""
+    lcd.display_activity(activity)
+    FPJ_TRACE.mark(f"activity {activity}")
+    profiler.enter_phase(activity, ActivityMap.get(activity, "Unknown Activity"))
 
 
 def reset_slider() -> None:
-    """Resets the mixer to its home position and tares the scale."""
-    print("[SYSTEM] Resetting slider and taring scale...")
-    lcd.display_activity(1)
+    """Resets the mixer and moves the slider to its home position."""
+    print("[SYSTEM] Resetting slider...")
+    show_activity(1)
     controller.mixer_up()
     stepper.moveSliderToHome()
-    scale.trigger_tare()
 
 
 def dispense_ingredient(
@@ -41,42 +53,85 @@ def dispense_ingredient(
     set_weight_func,
     dispense_func,
     display_weight_func,
-    step: int = 5
+    step: int = 5,
+    progress_func=None,
+    tare: bool = True
 ) -> None:
     """
     Generic function to dispense ingredients based on weight deficit.
 
-    :param name: Ingredient name (for log display)
+    :param name: Ingredient name in the recipe plan
     :param get_weight_func: Function to retrieve current json weight for the ingredient
     :param set_weight_func: Function to update the json weight for the ingredient
     :param dispense_func: Relay controller function to dispense the ingredient
     :param display_weight_func: Function to update LCD with the weight (e.g. fpj_lcd.display_kakawate_weight)
     :param step: Amount to dispense per loop (default is 5 grams)
+    :param progress_func: Optional callback given (weight, deficit) after every settled reading that changed
+    :param tare: Zero the scale first; False continues on a zero made earlier for this ingredient
     """
+    ingredient = plan.step(name)
     current_weight = get_weight_func()
-    target_weight = TARGET_WEIGHTS[name]
+    target_weight = ingredient.target
     deficit = target_weight - current_weight
 
     print(f"[{name}] Target: {target_weight}g | Current: {current_weight}g | Deficit: {deficit}g")
 
-    if deficit <= 0:
+    if ingredient.is_enough(current_weight):
         print(f"[{name}] No need to add. Already enough.")
         display_weight_func(current_weight)  # ✅ Show weight even if enough
         return
 
-    scale.trigger_tare()
-    sleep(0.5)  # Allow some settling time
+    if tare:
+        scale.zero()  # Starts from the previous ingredient's baseline; tares only when there is none or it drifted
 
-    dispensed_weight = 0
-    while (weight := scale.get_weight()) < deficit:
-        print(f"[{name}] : {weight}g / {deficit}g")
+    # The ESP32 cuts each pulse short the moment its filtered weight reaches the limit
+    limit = deficit - ingredient.tolerance
+    alarm = scale.arm(limit)
+    # Reads are sparse while the deficit is large and dense near the predicted crossing
+    sampler = ApproachSampler(scale, limit)
 
-        # ✅ Update LCD every loop
-        display_weight_func(weight)
+    reported = None
 
-        dispense_func(step)
-        sleep(0.3)
-        dispensed_weight = weight
+    def settled(weight) -> None:
+        # Readings taken during a pulse trail the container; only settled ones are passed on
+        nonlocal reported
+        if progress_func and weight != reported:
+            reported = weight
+            progress_func(weight, deficit)
+
+    try:
+        weight = sampler.read()
+        settled(weight)
+        while weight < limit:
+            print(f"[{name}] : {weight}g / {deficit}g")
+
+            # ✅ Update LCD on every reading
+            display_weight_func(weight)
+
+            # Pulse on until a reading is due, the alarm fired or (without it) the limit was seen
+            while True:
+                if alarm:
+                    if not scale.armed:
+                        break  # Hit during the last pulse or its cooldown; no new pulse before a settled read
+                    dispense_func(step, until=sampler.pulse(scale.wait_hit))
+                else:
+                    dispense_func(step, until=sampler.watch)
+                    if sampler.weight >= limit:
+                        break
+                if sampler.due():
+                    break
+            with profiler.wait("dispense_settle"):
+                sleep(0.3)
+            weight = sampler.read()
+            settled(weight)
+            if alarm and not scale.armed and weight < limit:
+                alarm = scale.arm(limit)  # Hit on noise; the settled weight is still short
+    finally:
+        scale.disarm()
+
+    # One averaged reading for the books, which the next ingredient starts from
+    dispensed_weight = scale.capture_baseline(FINAL_SAMPLES)
+    sampler.report(name, current_weight + sampler.dispensed() - target_weight)
 
     final_weight = current_weight + dispensed_weight
     print(f"[{name}] Final JSON weight: {final_weight}g. Updating JSON.")
@@ -86,147 +141,137 @@ def dispense_ingredient(
     display_weight_func(final_weight)
 
 
-def add_kakawate():
-    lcd.display_activity(2)
-    dispense_ingredient(
-        "KAKAWATE",
-        json.get_kakawate_weight,
-        json.update_kakawate_weight,
-        controller.dispense_kakawate,
-        lcd.display_kakawate_weight,
-        step=2
-    )
-
-
-def add_neem():
-    lcd.display_activity(3)
-    dispense_ingredient(
-        "NEEM",
-        json.get_neem_weight,
-        json.update_neem_weight,
-        controller.dispense_neem,
-        lcd.display_neem_weight,
-        step=2
-    )
-
-
-def add_molasses():
-    lcd.display_activity(4)
-    dispense_ingredient(
-        "MOLASSES",
-        json.get_molasses_weight,
-        json.update_molasses_weight,
-        controller.add_molasses,
-        lcd.display_molasses_weight,
-        step=5
-    )
-
-
-def add_water():
-    lcd.display_activity(5)
-    dispense_ingredient(
-        "WATER",
-        json.get_water_weight,
-        json.update_water_weight,
-        controller.pump_water,
-        lcd.display_water_weight,
-        step=1
-    )
+def display_ingredient_weight(ingredient: PlanStep, weight: int) -> None:
+    lcd.update_lcd_weight(ingredient.label, weight, ingredient.lcd_line)
 
 
-def mix():
-    """Handles the mixing process by moving the mixer down, mixing, and then moving it back up."""
-    print("[SYSTEM] Starting mix process...")
-    lcd.display_activity(6)
+def add_ingredient(
+    ingredient: PlanStep,
+    get_weight_func=None,
+    set_weight_func=None,
+    tare: bool = True,
+    progress_func=None,
+    dispense_func=None
+) -> None:
+    """
+    Dispenses one recipe ingredient up to its target.
+
+    The weight is read from and saved to the JSON state unless other functions are given.
+    dispense_func replaces a relay ingredient's dispenser (molasses always goes through its servo session).
+    """
+    show_activity(ingredient.activity)
+    get_weight_func = get_weight_func or (lambda: json.get_weight(ingredient.json_key))
+    set_weight_func = set_weight_func or (lambda weight: json.set_weight(ingredient.json_key, weight))
+    display_func = lambda weight: display_ingredient_weight(ingredient, weight)
+
+    if ingredient.actuator == "molasses":
+        with controller.molasses_session() as molasses:
+            def molasses_progress(weight, deficit):
+                molasses.update(weight, deficit)
+                if progress_func:
+                    progress_func(weight, deficit)
+
+            dispense_ingredient(
+                ingredient.name,
+                get_weight_func,
+                set_weight_func,
+                molasses.dispense,
+                display_func,
+                step=ingredient.step,
+                progress_func=molasses_progress,
+                tare=tare
+            )
+    else:
+        dispense_ingredient(
+            ingredient.name,
+            get_weight_func,
+            set_weight_func,
+            dispense_func or DISPENSERS[ingredient.actuator],
+            display_func,
+            step=ingredient.step,
+            progress_func=progress_func,
+            tare=tare
+        )
+
+
+def move_to_mixer() -> None:
+    show_activity(6)
     stepper.moveSliderToMixer()
-    lcd.display_activity(7)
+
+
+def lower_mixer() -> None:
+    show_activity(7)
     controller.mixer_down()
-    lcd.display_activity(8)
-    controller.mix(20)
-    lcd.display_activity(9)
+
+
+def run_mixer() -> None:
+    show_activity(8)
+    controller.mix(plan.mix_duration)
+
+
+def raise_mixer() -> None:
+    show_activity(9)
     controller.mixer_up()
+
+
+def mix():
+    """Handles the mixing process by moving the mixer down, mixing, and then moving it back up."""
+    print("[SYSTEM] Starting mix process...")
+    move_to_mixer()
+    lower_mixer()
+    run_mixer()
+    raise_mixer()
     json.set_mixing_status(True)
     print("[SYSTEM] Mixing process completed.")
 
 
-if __name__ == "__main__":
-    try:
-        lcd.welcome()
-        controller.power_up()
-        lcd.lcd2.clear()
+def move_to_sealer() -> None:
+    show_activity(10)
+    stepper.moveSliderToSealer()
 
-        if not status.batch_done():
-            reset_slider()
 
-            if not status.is_ingredients_enough():
-                print("[SYSTEM] Starting ingredient preparation...")
+def seal_container() -> None:
+    show_activity(11)
+    stepper.seal()
+    LedIndicator.turn_on()
 
-                if not status.is_kakawate_enough() or not status.is_neem_enough():
-                    print("[CHECK] Kakawate or Neem not enough. Preparing chopper...")
-                    controller.turn_on_chopper()
 
-                    if not status.is_kakawate_enough():
-                        print("[DISPENSE] Kakawate not enough. Dispensing...")
-                        add_kakawate()
-                    else:
-                        lcd.display_kakawate_weight(json.get_kakawate_weight())
+def seal():
+    """Moves the container to the sealer and seals it."""
+    print("[ACTION] Proceeding to packaging...")
+    stepper.lift_cover()
+    move_to_sealer()
+    seal_container()
 
-                    if not status.is_neem_enough():
-                        print("[DISPENSE] Neem not enough. Dispensing...")
-                        add_neem()
-                    else:
-                        lcd.display_neem_weight(json.get_neem_weight())
 
-                    controller.turn_off_chopper()
-                else:
-                    lcd.display_kakawate_weight(json.get_kakawate_weight())
-                    lcd.display_neem_weight(json.get_neem_weight())
+def start_up() -> None:
+    """Shows the welcome screen and powers up the machine."""
+    lcd.welcome()
+    controller.power_up()
+    lcd.lcd2.clear()
 
-                if not status.is_molasses_enough():
-                    print("[CHECK] Molasses not enough. Adding...")
-                    add_molasses()
-                else:
-                    lcd.display_molasses_weight(json.get_molasses_weight())
 
-                if not status.is_water_enough():
-                    print("[CHECK] Water not enough. Pumping...")
-                    add_water()
-                else:
-                    lcd.display_water_weight(json.get_water_weight())
-            else:
-                print("Materials are complete and ready for mixing")
-                # ✅ Display all existing weights
-                lcd.display_kakawate_weight(json.get_kakawate_weight())
-                lcd.display_neem_weight(json.get_neem_weight())
-                lcd.display_molasses_weight(json.get_molasses_weight())
-                lcd.display_water_weight(json.get_water_weight())
-
-            if not status.is_mixing_done():
-                print("[SYSTEM] Initiating mixing process...")
-                mix()
-            else:
-                print("[SYSTEM] Mixing already completed.")
-
-            print("[ACTION] Turning off chopper...")
-            controller.turn_off_chopper()
-
-            print("[ACTION] Proceeding to packaging...")
-            stepper.lift_cover()
-            
-            lcd.display_activity(10)
-            stepper.moveSliderToSealer()
-            lcd.display_activity(11)
-            stepper.seal()
-            LedIndicator.turn_on()
-
-        else:
-            print("[STATUS] Batch already fermenting. Skipping process.")
-            lcd.display_activity(12)
-            LedIndicator.turn_on()
+def run_batch() -> None:
+    """Runs one batch, resuming from the phase checkpointed in the JSON state."""
+    from FPJ_STATE import BatchStateMachine
+
+    BatchStateMachine(sys.modules[__name__]).run()
+
+
+if __name__ == "__main__":
+    completed = False
+    try:
+        profiler.start_batch()
+        start_up()
+        run_batch()
+        completed = True
 
     except KeyboardInterrupt:
         print("\n[INTERRUPT] KeyboardInterrupt detected! Turning off all relays...")
 
     finally:
-        controller.shutdown()
+        controller.shutdown(force=not completed)
+        profiler.end_batch(completed)
+        profiler.report()
+        FPJ_TRACE.close()
         print("[SYSTEM] System safely shut down.")
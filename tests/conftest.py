@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+# The simulator and the virtual clock are chosen when FPJ_PCF and FPJ_CLOCK are
+# first imported, so they are set up before any test module imports them.
+os.environ.setdefault("FPJ_BACKEND", "sim")
+os.environ.setdefault("FPJ_CLOCK", "virtual")
+os.environ.setdefault("FPJ_CALIBRATION", "")  # Default stepper speeds, whatever this host calibrated
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Runs every test in its own directory, where the JSON state and metrics files land."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def machine():
+    """The simulated machine, with an empty container on a zeroed scale."""
+    import FPJ_PCF
+
+    machine = FPJ_PCF.machine
+    machine.empty_container()
+    machine.tare()
+    return machine
+
+
+@pytest.fixture(scope="session")
+def main(tmp_path_factory):
+    """main.py on the simulated machine, imported once as the daemon does."""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("main"))
+        import main
+    return main
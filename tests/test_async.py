@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+import FPJ_ASYNC
+import FPJ_CLOCK
+import FPJ_SIM
+from FPJ_ASYNC import AsyncMachine, run_blocking
+
+
+@pytest.fixture
+def machine_async(main, machine):
+    return AsyncMachine(main)
+
+
+def timed(coroutine_func):
+    """Runs a coroutine on the loop and returns its result and the virtual time it took."""
+    async def go():
+        start = FPJ_CLOCK.monotonic()
+        result = await coroutine_func()
+        return result, FPJ_CLOCK.monotonic() - start
+    return FPJ_ASYNC.run(go())
+
+
+def test_independent_steps_overlap(machine_async):
+    async def together():
+        machine_async.loop = asyncio.get_running_loop()
+        await run_blocking(machine_async.together, [lambda: FPJ_CLOCK.sleep(3), lambda: FPJ_CLOCK.sleep(5)])
+
+    assert timed(together)[1] == pytest.approx(5)
+
+
+def test_relay_stays_on_until_the_wait_returns(machine_async, machine):
+    relay = machine_async.dispensers["neem"]
+    seen = []
+
+    def until(on_time):
+        FPJ_CLOCK.sleep(on_time / 2)
+        seen.append(machine.relay_on(FPJ_SIM.NeemPin))
+
+    _, elapsed = timed(lambda: machine_async.relay_run(relay, 4.0, until, cooldown=1.0))
+    assert seen == [True]
+    assert not machine.relay_on(FPJ_SIM.NeemPin)
+    assert elapsed == pytest.approx(3.0)  # Two seconds on, one of cooldown
+    assert machine.net_weight() == pytest.approx(40, abs=2)  # 20 g/s in the simulator
+
+
+def test_relay_is_switched_off_when_the_wait_fails(machine_async, machine):
+    def until(on_time):
+        raise TimeoutError("scale gone")
+
+    with pytest.raises(TimeoutError):
+        timed(lambda: machine_async.relay_run(machine_async.dispensers["water"], 4.0, until))
+    assert not machine.relay_on(FPJ_SIM.WaterPumpPin)
+
+
+def test_wait_for_times_out(machine_async):
+    with pytest.raises(TimeoutError):
+        timed(lambda: machine_async.wait_for(lambda: False, timeout=1.0))
+
+
+def test_batch_reads_the_scale_while_dispensers_run_and_shows_slider_progress(machine_async, machine, main, monkeypatch):
+    reads_while_on = []
+    get_weight = main.scale.get_weight
+
+    def watched_get_weight():
+        reads_while_on.append(any(machine.relay_on(pin) for pin in FPJ_SIM.RelayFlowRates))
+        return get_weight()
+
+    progress = []
+    display = main.lcd.lcd1.display
+
+    def watched_display(overwrite=False, line1="", line2="", line3="", line4=""):
+        if line4.endswith("STEPS"):
+            progress.append(line4)
+        display(overwrite, line1, line2, line3, line4)
+
+    monkeypatch.setattr(main.scale, "get_weight", watched_get_weight)
+    monkeypatch.setattr(main.lcd.lcd1, "display", watched_display)
+    FPJ_ASYNC.run(machine_async.run_batch())
+
+    assert main.json.get_batch_state()["phase"] == "FERMENTING"
+    assert sum(reads_while_on) > 10
+    assert len(progress) > 10
+    assert len(set(progress)) > 1  # The count moves on
+    assert machine.slider_position == 58000  # At the sealer
@@ -0,0 +1,45 @@
+from FPJ_BENCHMARK import compare, result, time_per_op
+
+
+def baseline(**tolerances) -> dict:
+    return {
+        "results": {
+            "batch.total.machine": result(600.0, "machine_s"),
+            "batch.total.wall": result(2.0, "wall_s"),
+            "batch.pin_writes": result(100, "count"),
+        },
+        "tolerances": tolerances,
+    }
+
+
+def test_results_within_tolerance_pass():
+    results = {
+        "batch.total.machine": result(611.0, "machine_s"),  # Within the default 2%
+        "batch.total.wall": result(9.0, "wall_s"),          # Wall time is only reported
+        "batch.pin_writes": result(90, "count"),            # Fewer is better
+    }
+    assert compare(results, baseline()) == []
+
+
+def test_slower_fewer_or_missing_metrics_regress():
+    results = {"batch.total.machine": result(613.0, "machine_s"), "batch.total.wall": result(2.0, "wall_s")}
+    regressions = compare(results, baseline())
+    assert len(regressions) == 2
+    assert regressions[0].startswith("batch.total.machine: 613.0 > 600.0")
+    assert regressions[1] == "batch.pin_writes: missing from results"
+
+
+def test_tolerance_by_metric_name_beats_the_unit_default():
+    results = {
+        "batch.total.machine": result(613.0, "machine_s"),
+        "batch.total.wall": result(2.0, "wall_s"),
+        "batch.pin_writes": result(105, "count"),
+    }
+    assert compare(results, baseline(**{"batch.total.machine": 0.05, "count": 0.1})) == []
+
+
+def test_time_per_op_is_microseconds_per_call():
+    calls = []
+    timing = time_per_op(lambda: calls.append(1), 10, repeats=3)
+    assert len(calls) == 30
+    assert timing["unit"] == "us_per_op" and timing["value"] >= 0
@@ -0,0 +1,41 @@
+import json
+import pytest
+import FPJ_CALIBRATE
+import FPJ_PCF
+import FPJ_STEPPER
+
+
+@pytest.fixture
+def sealer(machine):
+    """The sealer stepper, its speed restored after the test."""
+    sealer = FPJ_STEPPER.stepper.sealer
+    interval = sealer.pulse_interval
+    yield sealer
+    sealer.pulse_interval = interval
+
+
+def test_saved_intervals_load_for_this_machine_only(tmp_path):
+    path = str(tmp_path / "calibration.json")
+    assert FPJ_CALIBRATE.load(path) == {}
+    assert FPJ_CALIBRATE.save("slider", 0.0004, path) == pytest.approx(0.0004 * FPJ_CALIBRATE.SAFETY_MARGIN)
+    interval = FPJ_CALIBRATE.save("sealer", 0.0004, path, burst=True)
+    assert interval >= 0.0004 * FPJ_CALIBRATE.SAFETY_MARGIN
+    assert interval == pytest.approx(FPJ_PCF.burst_words(interval) * FPJ_PCF.WORD_TIME)
+    assert FPJ_CALIBRATE.load(path) == {"slider": pytest.approx(0.0005), "sealer": interval}
+    with open(path) as f:
+        assert list(json.load(f)) == [FPJ_CALIBRATE.machine_key()]
+
+
+def test_sealer_calibrates_to_the_fastest_interval_without_lost_steps(tmp_path, machine, sealer):
+    path = str(tmp_path / "calibration.json")
+    intervals = FPJ_CALIBRATE.calibrate(["sealer"], path)
+    assert FPJ_CALIBRATE.load(path) == intervals
+    assert sealer.pulse_interval == intervals["sealer"]
+    assert 2 * intervals["sealer"] >= machine.min_step_period["sealer"]
+    assert FPJ_STEPPER.stepper.cover_steps_from_down is not None  # Left on the cover up switch
+
+    lost = machine.lost_steps["sealer"]
+    assert sealer.move_stepper_to_destination(
+        direction=False, max_step=1000, destination_func=FPJ_STEPPER.limit_status.is_cover_down
+    )
+    assert machine.lost_steps["sealer"] == lost  # The calibrated speed is reliable
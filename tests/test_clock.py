@@ -0,0 +1,98 @@
+import threading
+import time
+import pytest
+import FPJ_CLOCK
+from FPJ_CLOCK import Aborted, Clock, VirtualClock
+
+
+def run_participants(clock: VirtualClock, *targets) -> None:
+    threads = []
+    for target in targets:
+        clock.expect()
+
+        def run(target=target):
+            clock.register(expected=True)
+            try:
+                target()
+            finally:
+                clock.unregister()
+
+        threads.append(threading.Thread(target=run))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_sleep_advances_virtual_time_at_once():
+    clock = VirtualClock(100.0)
+    start = time.monotonic()
+    clock.sleep(3600)
+    assert clock.monotonic() == 3700.0
+    assert time.monotonic() - start < 1
+
+
+def test_participants_sleep_side_by_side():
+    clock = VirtualClock()
+    woke = {}
+
+    def sleeper(name, *periods):
+        def run():
+            for seconds in periods:
+                clock.sleep(seconds)
+                woke.setdefault(name, []).append(clock.monotonic())
+        return run
+
+    run_participants(clock, sleeper("a", 5, 5), sleeper("b", 3, 3, 3))
+    assert woke == {"a": [5, 10], "b": [3, 6, 9]}
+    assert clock.monotonic() == 10  # Not the 19 s the sleeps add up to
+
+
+def test_idle_ends_when_woken_before_time_moves_on():
+    clock = VirtualClock()
+    done = threading.Event()
+
+    def idle():
+        clock.idle(None, done.is_set)
+
+    def worker():
+        clock.sleep(2)
+        done.set()
+
+    run_participants(clock, idle, worker)
+    assert clock.monotonic() == 2
+
+
+def test_abort_cuts_a_real_sleep_short():
+    previous = FPJ_CLOCK.use(Clock())
+    errors = []
+
+    def sleeper():
+        try:
+            FPJ_CLOCK.sleep(30)
+        except Aborted as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=sleeper)
+    try:
+        start = time.monotonic()
+        thread.start()
+        time.sleep(0.05)
+        FPJ_CLOCK.abort(thread)
+        thread.join(5)
+        assert not thread.is_alive() and errors
+        assert time.monotonic() - start < 5
+    finally:
+        FPJ_CLOCK.clear_abort(thread)
+        FPJ_CLOCK.use(previous)
+
+
+def test_an_aborted_thread_cannot_sleep_until_cleared():
+    thread = threading.current_thread()
+    FPJ_CLOCK.abort(thread)
+    try:
+        with pytest.raises(Aborted):
+            FPJ_CLOCK.sleep(1)
+    finally:
+        FPJ_CLOCK.clear_abort(thread)
+    FPJ_CLOCK.sleep(1)
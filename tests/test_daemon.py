@@ -0,0 +1,57 @@
+import json
+import pytest
+import FPJ_SIM
+
+
+@pytest.fixture
+def daemon(main, machine, tmp_path):
+    from FPJ_DAEMON import FpjDaemon
+
+    daemon = FpjDaemon(str(tmp_path / "fpj.sock"))
+    yield daemon
+    if daemon.worker is not None:
+        daemon.worker.join()
+
+
+def run(daemon, command: str) -> str:
+    reply = daemon.handle(command)
+    daemon.worker.join()
+    return reply
+
+
+def test_batches_after_the_first_get_powered_steppers(daemon, machine, main):
+    for command in ("start", "reset", "start"):
+        steps = dict(machine.steps)
+        assert run(daemon, command) == f"{'batch' if command == 'start' else command} started"
+        assert daemon.last_result.endswith("completed")
+        assert machine.steps["slider"] > steps["slider"]
+        assert not main.stepper.slider.motor_enabled
+        assert not main.stepper.sealer.motor_enabled
+    assert daemon.batches == 2
+    assert machine.slider_position == 58000  # At the sealer
+    assert json.loads(daemon.status())["activity"] == "idle"
+
+
+def test_a_slider_that_does_not_reach_home_fails_the_batch(daemon, machine, monkeypatch):
+    monkeypatch.setattr(machine, "step_slider", lambda toward_home, at=None: None)
+    run(daemon, "start")
+    assert daemon.last_result == "batch failed: Slider did not reach home"
+    assert daemon.batches == 0
+    assert machine.net_weight() < 1  # Nothing dispensed
+    assert not machine.relay_on(FPJ_SIM.StepperPowerPin)
+
+
+def test_start_button_acts_on_the_press_only(daemon, machine):
+    machine.press(FPJ_SIM.StartPin)
+    daemon.poll_buttons()
+    worker = daemon.worker
+    daemon.poll_buttons()  # Still held
+    assert daemon.worker is worker
+    machine.press(FPJ_SIM.StartPin, False)
+    worker.join()
+    assert daemon.last_result == "batch completed"
+
+
+def test_unknown_command(daemon):
+    assert daemon.handle("dance") == "unknown command: dance"
+    assert daemon.handle("abort") == "idle"
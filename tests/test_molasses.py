@@ -0,0 +1,60 @@
+import pytest
+import FPJ_SIM
+
+
+@pytest.fixture(scope="module")
+def controller():
+    from FPJ_RELAY import RelayController
+
+    return RelayController()
+
+
+@pytest.fixture
+def power_ups(controller, monkeypatch):
+    """Counts the times the servo supply is switched on."""
+    calls = []
+    turn_on = controller.ServoPowerRelay.turn_on
+    monkeypatch.setattr(controller.ServoPowerRelay, "turn_on", lambda force=False: calls.append(1) or turn_on(force))
+    return calls
+
+
+def servo_powered(machine) -> bool:
+    return machine.relay_on(FPJ_SIM.ServoPowerPin)
+
+
+def test_session_powers_the_servo_once_for_every_pulse(controller, machine, power_ups):
+    with controller.molasses_session() as session:
+        for _ in range(3):
+            session.dispense(1.0)
+            assert servo_powered(machine)
+    assert power_ups == [1]
+    assert session.pulses == 3
+    assert not servo_powered(machine)
+    assert machine.servo.angle == controller.MolassesDispenser.ClosedAngle
+    assert machine.net_weight() > 20  # Three seconds wide open
+
+
+def test_dispense_outside_a_session_starts_one(controller, machine, power_ups):
+    session = controller.molasses_session()
+    session.dispense(0.5)
+    assert session.active and servo_powered(machine)
+    session.stop()
+    assert power_ups == [1]
+    assert not servo_powered(machine)
+
+
+def test_session_closes_the_valve_and_powers_down_on_errors(controller, machine):
+    with pytest.raises(RuntimeError):
+        with controller.molasses_session() as session:
+            session.dispense(0.5)
+            raise RuntimeError("scale lost")
+    assert not session.active
+    assert not servo_powered(machine)
+    assert machine.servo.angle == controller.MolassesDispenser.ClosedAngle
+
+
+def test_add_molasses_uses_one_session(controller, machine, power_ups):
+    controller.add_molasses(2)
+    assert power_ups == [1]
+    assert not servo_powered(machine)
+    assert machine.net_weight() > 40  # Two seconds at the simulator's 24 g/s wide open
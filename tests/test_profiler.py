@@ -0,0 +1,59 @@
+import json
+import threading
+import pytest
+import FPJ_CLOCK
+from FPJ_PROFILER import CycleProfiler
+
+
+@pytest.fixture
+def profiler():
+    profiler = CycleProfiler()
+    profiler.start_batch()
+    return profiler
+
+
+def in_thread(target) -> None:
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+
+def test_worker_phase_closes_when_the_worker_ends(profiler):
+    def work():
+        with profiler.worker():
+            profiler.enter_phase(10, "Cover Up")
+            FPJ_CLOCK.sleep(5)
+
+    profiler.enter_phase(9, "Mixer Up")
+    in_thread(work)
+    FPJ_CLOCK.sleep(100)
+    profiler.end_batch()
+    phases = json.load(open("FPJ_METRICS.json"))["last_batch"]["phases"]
+    assert phases["10 Cover Up"] == pytest.approx(5)
+    assert phases["09 Mixer Up"] == pytest.approx(105)
+
+
+def test_waits_without_a_phase_go_to_the_phase_still_open(profiler):
+    def work():
+        with profiler.worker():
+            profiler.enter_phase(10, "Cover Up")
+
+    profiler.enter_phase(9, "Mixer Up")
+    in_thread(work)
+    assert profiler.phase == "09 Mixer Up"
+    in_thread(lambda: profiler.record_wait("relay_on", 2))
+    assert profiler.wait_times["09 Mixer Up"]["relay_on"].total == 2
+
+
+def test_nested_waits_are_booked_under_the_outer_one(profiler):
+    profiler.enter_phase(3, "Moving")
+    with profiler.wait("stepper_move"):
+        FPJ_CLOCK.sleep(2)
+        with profiler.wait("power_settle"):
+            FPJ_CLOCK.sleep(3)
+    with profiler.wait("power_settle"):
+        FPJ_CLOCK.sleep(1)
+    waits = profiler.wait_times["03 Moving"]
+    assert waits["stepper_move"].total == pytest.approx(5)
+    assert waits["stepper_move > power_settle"].total == pytest.approx(3)
+    assert waits["power_settle"].total == pytest.approx(1)
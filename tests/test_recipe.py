@@ -0,0 +1,61 @@
+import json
+import os
+import pytest
+from FPJ_RECIPE import RecipeError, compile_recipe, load_plan
+
+
+def recipe(**changes) -> dict:
+    data = {
+        "name": "Test",
+        "mix_duration": 20,
+        "ingredients": [
+            {"name": "WATER", "actuator": "water", "target": 2000, "tolerance": 10, "step": 1, "after": ["NEEM"]},
+            {"name": "NEEM", "actuator": "neem", "target": 1000, "step": 2},
+        ],
+    }
+    data.update(changes)
+    return data
+
+
+def test_ingredients_are_ordered_by_their_constraints_and_scaled():
+    plan = compile_recipe(recipe(), scale=0.5)
+    assert [step.name for step in plan.steps] == ["NEEM", "WATER"]
+    water = plan.step("WATER")
+    assert (water.target, water.tolerance, water.json_key, water.chopped) == (1000, 5, "WaterWeight", False)
+    assert water.is_enough(995) and not water.is_enough(994)
+    assert plan.for_actuator("kakawate") is None
+
+
+@pytest.mark.parametrize("ingredients, message", [
+    ([{"name": "A", "actuator": "pump", "target": 1, "step": 1}], "unknown actuator"),
+    ([{"name": "A", "actuator": "neem", "target": 1, "step": 1},
+      {"name": "B", "actuator": "neem", "target": 1, "step": 1}], "already used"),
+    ([{"name": "A", "actuator": "neem", "target": 1, "step": 1, "after": ["B"]},
+      {"name": "B", "actuator": "water", "target": 1, "step": 1, "after": ["A"]}], "cycle"),
+    ([{"name": "A", "actuator": "neem", "target": 1, "step": 1, "after": ["C"]}], "unknown ingredients"),
+    ([{"name": "A", "actuator": "neem", "target": 10, "tolerance": 10, "step": 1}], "larger than the tolerance"),
+    ([{"name": "A", "actuator": "neem", "target": "10", "step": 1}], "must be a number"),
+    ([], "non-empty list"),
+])
+def test_invalid_recipes_are_rejected(ingredients, message):
+    with pytest.raises(RecipeError, match=message):
+        compile_recipe(recipe(ingredients=ingredients))
+
+
+def test_plan_is_reloaded_when_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.delenv("FPJ_BATCH_SCALE", raising=False)
+    path = tmp_path / "recipe.json"
+    path.write_text(json.dumps(recipe()))
+    plan = load_plan(str(path))
+    assert load_plan(str(path)) is plan
+    modified = os.stat(path).st_mtime_ns
+    path.write_text(json.dumps(recipe(name="Changed")))
+    os.utime(path, ns=(modified + 10**9, modified + 10**9))  # A later mtime, however coarse the filesystem's
+    assert load_plan(str(path)).name == "Changed"
+    monkeypatch.setenv("FPJ_BATCH_SCALE", "2")
+    assert load_plan(str(path)).step("NEEM").target == 2000
+
+
+def test_shipped_recipe_compiles():
+    plan = load_plan()
+    assert [step.actuator for step in plan.steps] == ["kakawate", "neem", "molasses", "water"]
@@ -0,0 +1,40 @@
+import pytest
+import FPJ_SIM
+
+
+@pytest.fixture(scope="module")
+def controller():
+    from FPJ_RELAY import RelayController
+
+    return RelayController()
+
+
+def test_relay_is_switched_off_when_until_fails(controller, machine):
+    def until(on_time):
+        raise TimeoutError("scale gone")
+
+    with pytest.raises(TimeoutError):
+        controller.dispense_neem(5, until=until)
+    assert not machine.relay_on(FPJ_SIM.NeemPin)
+
+
+def test_relay_runs_until_until_returns(controller, machine):
+    seen = []
+    controller.pump_water(5, until=lambda on_time: seen.append(machine.relay_on(FPJ_SIM.WaterPumpPin)))
+    assert seen == [True]
+    assert not machine.relay_on(FPJ_SIM.WaterPumpPin)
+
+
+def test_writes_are_counted_per_output(controller):
+    import FPJ_RELAY
+
+    pump, neem = controller.WaterPumpRelay, controller.NeemRelay
+    pump.turn_off(force=True)
+    before = (pump.writes, pump.skipped, neem.writes, neem.skipped)
+    pump.turn_off()
+    pump.turn_on()
+    pump.turn_on()
+    pump.turn_off(force=True)
+    assert (pump.writes, pump.skipped) == (before[0] + 2, before[1] + 2)
+    assert (neem.writes, neem.skipped) == before[2:]
+    assert FPJ_RELAY.write_counts()["Water Pump"] == {"writes": pump.writes, "skipped": pump.skipped}
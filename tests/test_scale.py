@@ -0,0 +1,399 @@
+import threading
+import pytest
+import FPJ_CLOCK
+import FPJ_PCF
+import FPJ_SCALE
+import FPJ_SIM
+from FPJ_SCALE import SAMPLE_RECORD, ApproachSampler, Scale, ScaleRequest, ScaleTimeout, decode_samples
+
+
+def record(seq: int, grams: float, corrupt: bool = False) -> bytes:
+    data = bytearray(SAMPLE_RECORD.pack(0xA5, seq, seq * 12, grams, 0))
+    data[-1] = sum(data[:-1]) & 0xFF
+    if corrupt:
+        data[-1] ^= 0xFF
+    return bytes(data)
+
+
+def decoded(records) -> list:
+    """(seq, ms, grams) tuples, with or without NumPy."""
+    return [(int(r[0]), int(r[1]), float(r[2])) if len(r) == 3 else (int(r[1]), int(r[2]), float(r[3])) for r in records]
+
+
+class StreamSerial:
+    """Serial stand-in that hands out the bytes given to it."""
+
+    def __init__(self, data: bytes = b"") -> None:
+        self.data = data
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.data)
+
+    def read(self, size: int) -> bytes:
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+    def readline(self) -> bytes:
+        line, sep, self.data = self.data.partition(b"\n")
+        return line + sep
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+
+@pytest.fixture
+def esp32(machine):
+    yield FPJ_SIM.esp32
+    FPJ_SIM.esp32.replies = "tagged"
+
+
+@pytest.fixture
+def pouring(machine):
+    """Neem flowing onto the scale at the simulator's 20 g/s."""
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.NeemPin, False)
+    yield
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.NeemPin, True)
+
+
+def connect(esp32, replies: str) -> Scale:
+    esp32.replies = replies
+    return Scale("/dev/ttyUSB0")
+
+
+# === Threshold alarm ===
+def test_alarm_fires_once_the_weight_reaches_the_threshold(esp32, pouring):
+    scale = connect(esp32, "tagged")
+    try:
+        scale.reset_baseline()
+        scale.zero()
+        assert scale.arm(100)
+        hit = scale.wait_hit(10)
+        assert hit is not None and hit[0] >= 100
+        assert not scale.armed
+        assert scale.get_weight() <= 120  # Cut within a sample period or two at 20 g/s
+    finally:
+        scale.close()
+
+
+def test_wait_hit_times_out_below_the_threshold(esp32):
+    scale = connect(esp32, "tagged")
+    try:
+        assert scale.arm(100)
+        start = FPJ_CLOCK.monotonic()
+        assert scale.wait_hit(2) is None
+        assert FPJ_CLOCK.monotonic() - start == pytest.approx(2)
+        assert scale.armed
+        scale.disarm()
+        assert not scale.armed
+    finally:
+        scale.close()
+
+
+def test_original_firmware_is_not_asked_to_arm(esp32):
+    scale = connect(esp32, "original")
+    try:
+        tag = scale.tag
+        assert not scale.arm(100)
+        assert scale.tag == tag  # Nothing sent, so no ARMED reply waited for
+        assert not scale.armed
+    finally:
+        scale.close()
+
+
+# === Tagged requests ===
+def test_tagged_replies_reach_their_requests(esp32):
+    scale = connect(esp32, "tagged")
+    try:
+        weight, status = scale.send("WEIGHT"), scale.send("STATUS")
+        assert status.result().startswith("STATUS,")  # Waited for out of order
+        assert weight.result().startswith("WT,")
+        assert scale.tagged
+    finally:
+        scale.close()
+
+
+def test_bare_replies_fall_back_to_one_request_at_a_time(esp32):
+    scale = connect(esp32, "bare")
+    try:
+        assert not scale.tagged
+        weight, status = scale.send("WEIGHT"), scale.send("STATUS")
+        assert weight.result().startswith("WT,")
+        assert status.result().startswith("STATUS,")
+        assert scale.trigger_tare()
+    finally:
+        scale.close()
+
+
+def test_untagged_line_answers_the_oldest_request_it_fits():
+    scale = Scale("", connection=StreamSerial())
+    tare, weight = ScaleRequest(scale, 1, "TARE"), ScaleRequest(scale, 2, "WEIGHT")
+    scale.in_flight = {1: tare, 2: weight}
+
+    scale._route("WT,12.50")
+    assert weight.reply == "WT,12.50"
+    assert not tare.done
+    assert not scale.tagged
+
+    scale._route("ERR,TARE")
+    assert tare.reply == "ERR,TARE"
+    assert not scale.in_flight
+
+
+def test_answers():
+    assert Scale.answers("WEIGHT,16", "WS,1.00,0.100,16")
+    assert Scale.answers("ARM,50.0", "ARMED,50.00")
+    assert Scale.answers("CAL,420", "ERR,CAL,420")
+    assert not Scale.answers("TARE", "WT,1.00")
+    assert not Scale.answers("PING", "PONG")
+
+
+def test_waiting_for_a_reply_does_not_spin(monkeypatch):
+    scale = Scale("", connection=StreamSerial())
+    pumps = []
+    pump = scale._pump
+    monkeypatch.setattr(scale, "_pump", lambda block=True: pumps.append(1) or pump(block))
+    with pytest.raises(ScaleTimeout):
+        scale.request("WEIGHT", timeout=0.05)
+    assert len(pumps) < 2 * 0.05 / FPJ_SCALE.READ_POLL
+
+
+def test_waiters_wake_when_another_thread_routes_their_reply():
+    connection = StreamSerial()
+    scale = Scale("", connection=connection)
+    first, second = scale.send("WEIGHT"), scale.send("STATUS")
+    replies = {}
+    waiter = threading.Thread(target=lambda: replies.update(second=second.result(1.0)))
+    waiter.start()
+    connection.data = b"2:STATUS,1,0,420.0\n1:WT,5.00\n"
+    assert first.result(1.0) == "WT,5.00"
+    waiter.join()
+    assert replies == {"second": "STATUS,1,0,420.0"}
+
+
+# === Sample records ===
+@pytest.fixture(params=["numpy", "python"])
+def numpy_or_not(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(FPJ_SCALE, "np", None)
+    elif FPJ_SCALE.np is None:
+        pytest.skip("NumPy not installed")
+
+
+def test_decode_samples(numpy_or_not):
+    data = b"x" + record(1, 1.5) + record(2, 2.5) + record(3, 3.5)[:-2]
+    records, end = decode_samples(data, 1)
+    assert decoded(records) == [(1, 12, 1.5), (2, 24, 2.5)]
+    assert end == 1 + 2 * SAMPLE_RECORD.size
+
+
+def test_decode_samples_stops_at_a_bad_checksum(numpy_or_not):
+    data = record(1, 1.5) + record(2, 2.5, corrupt=True) + record(3, 3.5)
+    records, end = decode_samples(data)
+    assert decoded(records) == [(1, 12, 1.5)]
+    assert end == SAMPLE_RECORD.size
+
+
+def test_stream_resyncs_after_a_corrupt_record(numpy_or_not):
+    data = record(1, 1.0) + record(2, 2.0, corrupt=True) + record(3, 3.0) + b"HIT,5.00,100\n" + record(4, 4.0)
+    scale = Scale("", connection=StreamSerial(data))
+    scale.streaming = True
+    while scale._pump():
+        pass
+    assert scale.samples_received == 3
+    assert scale.samples_lost == 1
+    assert scale.sample_errors == SAMPLE_RECORD.size
+    assert scale.hit == (5.0, 100)
+    assert decoded(scale.read_samples()) == [(1, 12, 1.0), (3, 36, 3.0), (4, 48, 4.0)]
+
+
+def test_stream_of_samples_from_the_simulator(esp32, pouring):
+    scale = connect(esp32, "tagged")
+    try:
+        assert scale.stream(80)
+        for _ in range(50):
+            FPJ_CLOCK.sleep(0.02)  # The simulator sends the records due after every sleep
+        samples = decoded(scale.read_samples())
+        assert len(samples) >= 40
+        assert [seq for seq, _, _ in samples] == list(range(samples[0][0], samples[0][0] + len(samples)))
+        assert samples[-1][2] > samples[0][2]  # Neem is pouring
+    finally:
+        scale.stop_stream()  # The simulated ESP32 outlives this connection
+        scale.close()
+
+
+# === Averaged reads ===
+def test_weight_is_averaged_on_the_esp32(esp32, machine):
+    scale = connect(esp32, "tagged")
+    try:
+        start = FPJ_CLOCK.monotonic()
+        mean, std, count = scale.read_average(16)
+        assert FPJ_CLOCK.monotonic() - start == pytest.approx(16 * FPJ_SCALE.CONVERSION_TIME)
+        assert count == 16
+        assert mean == pytest.approx(0, abs=machine.noise)
+        assert 0 < std <= machine.noise
+        assert scale.read_average(1000)[2] == FPJ_SCALE.MAX_AVERAGE
+    finally:
+        scale.close()
+
+
+def test_stable_read_is_a_single_conversion_on_the_original_firmware(esp32, machine):
+    scale = connect(esp32, "original")
+    try:
+        assert scale.read_average(16) is None
+        assert scale.read_stable_grams(16) == pytest.approx(0, abs=machine.noise)
+        assert scale.get_stable_weight(16) in (0, 10)
+    finally:
+        scale.close()
+
+
+# === Connection ===
+def test_original_firmware_is_opened_without_id(esp32):
+    scale = connect(esp32, "original")
+    try:
+        assert scale.firmware is None
+        assert not scale.tagged
+        assert scale.trigger_tare()
+        assert scale.read_grams() is not None
+        assert not scale.stream(80)
+    finally:
+        scale.close()
+
+
+def test_reconnects_on_the_new_port_after_a_usb_hiccup(esp32):
+    scale = connect(esp32, "tagged")
+    try:
+        old_port, session = scale.port, scale.tare_id
+        esp32.replug()
+        assert scale.read_grams() is not None  # Resent on the new connection
+        assert scale.port == esp32.port != old_port
+        assert scale.tare_id != session  # Weights from before the reset no longer count
+        assert scale.firmware == f"FPJ-SCALE,{esp32.VERSION}"
+    finally:
+        scale.close()
+
+
+# === Running baseline ===
+def pour(seconds: float) -> None:
+    """Neem onto the scale at the simulator's 20 g/s."""
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.NeemPin, False)
+    FPJ_CLOCK.sleep(seconds)
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.NeemPin, True)
+
+
+def test_ingredients_weigh_from_the_last_one_without_a_tare(esp32):
+    scale = connect(esp32, "tagged")
+    try:
+        assert scale.zero()  # No baseline yet: a full tare
+        pour(5)
+        tare_id = scale.tare_id
+        assert scale.capture_baseline(16) in (100, 110)
+        assert scale.tare_id != tare_id
+        assert scale.get_weight() in (0, 10)
+        assert not scale.zero()  # Within DRIFT_LIMIT: the next ingredient starts here
+        pour(2)
+        assert scale.get_weight() in (40, 50)
+    finally:
+        scale.close()
+
+
+def test_zero_tares_once_the_scale_drifted_or_the_baseline_was_reset(esp32):
+    scale = connect(esp32, "tagged")
+    try:
+        scale.zero()
+        scale.capture_baseline(16)
+        pour(1)
+        assert scale.zero()  # 20 g off the baseline
+        scale.capture_baseline(16)
+        assert not scale.zero()
+        scale.reset_baseline()  # New container
+        assert scale.zero()
+    finally:
+        scale.close()
+
+
+# === ApproachSampler ===
+class ScriptedScale:
+    """Scale stand-in returning the given weights in turn."""
+
+    def __init__(self, *weights: int) -> None:
+        self.weights = list(weights)
+        self.baseline = None
+
+    def get_weight(self) -> int:
+        return self.weights.pop(0)
+
+
+def sampler_after(limit: float, first: int, second: int, flow: float) -> ApproachSampler:
+    sampler = ApproachSampler(ScriptedScale(first, second), limit)
+    sampler.read()
+    sampler.flowed(flow)
+    sampler.read()
+    return sampler
+
+
+def test_sampler_reads_at_once_then_at_the_default_interval():
+    sampler = ApproachSampler(ScriptedScale(0), 1000)
+    assert sampler.due()
+    sampler.read()
+    assert sampler.gap == FPJ_SCALE.SAMPLE_INTERVAL
+    assert not sampler.due()
+
+
+def test_sampler_interval_follows_the_predicted_crossing():
+    sampler = sampler_after(1000, 0, 20, 0.2)  # 100 g/s, 980 g to go
+    assert sampler.rate == pytest.approx(100)
+    assert sampler.gap == pytest.approx(FPJ_SCALE.APPROACH_FRACTION * 9.8)
+
+
+def test_sampler_interval_limits():
+    assert sampler_after(1000, 0, 990, 0.2).gap == FPJ_SCALE.MIN_SAMPLE_INTERVAL  # Crossing imminent
+    assert sampler_after(1000, 0, 10, 10).gap == FPJ_SCALE.MAX_SAMPLE_INTERVAL   # Trickle, far to go
+    assert sampler_after(1000, 0, 1010, 0.2).gap == FPJ_SCALE.MIN_SAMPLE_INTERVAL  # Past the limit
+
+
+def test_sampler_keeps_the_rate_without_a_gain():
+    sampler = sampler_after(1000, 0, 0, 1.0)
+    assert sampler.rate is None
+    assert sampler.gap == FPJ_SCALE.SAMPLE_INTERVAL
+
+
+def test_sampler_smooths_the_rate():
+    sampler = ApproachSampler(ScriptedScale(0, 100, 300), 10000)
+    for flow in (0, 1.0, 1.0):
+        sampler.flowed(flow)
+        sampler.read()
+    assert sampler.rate == pytest.approx(FPJ_SCALE.RATE_SMOOTHING * 200 + (1 - FPJ_SCALE.RATE_SMOOTHING) * 100)
+
+
+def test_sampler_due_within_float_rounding():
+    sampler = ApproachSampler(ScriptedScale(0), 1000)
+    sampler.read()
+    sampler.flowed(FPJ_SCALE.SAMPLE_INTERVAL / 2)
+    assert not sampler.due()
+    assert sampler.wait_time() == pytest.approx(FPJ_SCALE.SAMPLE_INTERVAL / 2)
+    sampler.flowed(FPJ_SCALE.SAMPLE_INTERVAL / 2 - 1e-9)
+    assert sampler.due()
+
+
+def test_sampler_pulse_counts_on_time_as_flow():
+    sampler = ApproachSampler(ScriptedScale(0), 1000)
+    sampler.read()
+    assert sampler.pulse(lambda duration: FPJ_CLOCK.sleep(duration) or "hit")(0.15) == "hit"
+    assert sampler.flow == pytest.approx(0.15)
+
+
+def test_sampler_dispensed_is_measured_from_the_starting_baseline():
+    scale = ScriptedScale()
+    scale.baseline = 100.0
+    sampler = ApproachSampler(scale, 1000)
+    scale.baseline = 1098.5
+    assert sampler.dispensed() == pytest.approx(998.5)
+
+
+def test_sampler_watch_stops_the_pulse_at_the_limit():
+    sampler = ApproachSampler(ScriptedScale(0, 1000), 1000)
+    sampler.read()
+    assert sampler.watch(10)
+    assert sampler.reads == 2
+    assert sampler.flow == pytest.approx(0)  # The read that saw the limit restarted the count
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+import pytest
+import FPJ_CLOCK
+from FPJ_SCHEDULER import PipelineScheduler, RESOURCE_POLL, Stage, batch_stages
+
+
+def timed(name: str, resources, seconds: float) -> Stage:
+    return Stage(name, resources, lambda batch: FPJ_CLOCK.sleep(seconds))
+
+
+def spans(scheduler: PipelineScheduler) -> dict:
+    return {(entry["batch"], entry["stage"]): (entry["start"], entry["end"]) for entry in scheduler.timeline}
+
+
+def test_stage_resources_are_sorted():
+    assert Stage("chop", ["slider", "chopper", "scale"], None).resources == ["chopper", "scale", "slider"]
+
+
+def test_batches_take_each_resource_in_order():
+    scheduler = PipelineScheduler([timed("weigh", ["scale"], 10), timed("mix", ["mixer"], 10)])
+    summary = scheduler.run(3)
+    timeline = spans(scheduler)
+    assert summary["batches"] == 3
+    assert not summary["errors"]
+    for stage in ("weigh", "mix"):
+        for batch in (1, 2):
+            assert timeline[(batch, stage)][1] <= timeline[(batch + 1, stage)][0]
+    # Stages sharing no resource overlap: the next batch weighs while this one mixes
+    assert timeline[(2, "weigh")][0] < timeline[(1, "mix")][1]
+    assert summary["elapsed"] == pytest.approx(40, abs=3 * RESOURCE_POLL)  # 60 serially; hand-overs are polled
+
+
+def test_a_stage_waits_for_every_resource_it_needs():
+    scheduler = PipelineScheduler([
+        timed("load", ["slider"], 5),
+        timed("weigh", ["scale", "slider"], 10),
+        timed("seal", ["sealer"], 5),
+    ])
+    scheduler.run(2)
+    timeline = spans(scheduler)
+    assert timeline[(1, "weigh")][1] <= timeline[(2, "load")][0]  # Slider last used by batch 1 in weigh
+    assert timeline[(2, "load")][0] < timeline[(1, "seal")][1]
+
+
+def test_machine_stages_all_hold_the_slider():
+    main = SimpleNamespace(plan=SimpleNamespace(steps=[]))
+    stages = batch_stages(main)
+    assert [stage.name for stage in stages] == ["load", "chop", "liquids", "mix", "seal"]
+    assert all("slider" in stage.resources for stage in stages)
+
+    # One container on the slider: batches run back to back
+    scheduler = PipelineScheduler([timed(stage.name, stage.resources, 10) for stage in stages])
+    summary = scheduler.run(2)
+    assert summary["serial_time"] == 100
+    assert summary["elapsed"] == pytest.approx(100, abs=2 * RESOURCE_POLL)
+
+
+def test_a_failing_stage_stops_the_other_batches():
+    def fail(batch: int) -> None:
+        if batch == 0:
+            raise RuntimeError("jammed")
+        FPJ_CLOCK.sleep(1)
+
+    scheduler = PipelineScheduler([timed("load", ["slider"], 1), Stage("weigh", ["scale"], fail), timed("mix", ["mixer"], 1)])
+    summary = scheduler.run(2)
+    assert summary["errors"] == ["Batch 1: jammed"]
+    assert summary["batches"] == 0
@@ -0,0 +1,40 @@
+import os
+import pytest
+import FPJ_SIM
+from FPJ_SCALE import Scale
+from FPJ_SERVO import ServoController
+
+
+@pytest.fixture
+def servo():
+    return ServoController()
+
+
+def test_flow_table_is_not_read_until_needed(servo):
+    assert not os.path.exists("FPJ_DATA.json")
+    assert servo.flow_table == ServoController.DefaultFlowTable
+
+
+def test_valve_opens_less_as_the_deficit_shrinks(servo):
+    assert servo.flow_for_deficit(500) == servo.max_flow
+    assert servo.flow_for_deficit(60) == pytest.approx(6.0)
+    assert servo.flow_for_deficit(3) == 1.0
+    assert servo.flow_for_deficit(0) == 0.0
+    assert servo.angle_for_flow(servo.max_flow) == ServoController.OpenAngle
+    assert servo.angle_for_flow(6.0) == -60
+    assert servo.angle_for_flow(0.0) == ServoController.ClosedAngle
+
+
+def test_calibration_measures_the_flow_below_the_rounding_step(machine):
+    from FPJ_RELAY import RelayController
+
+    controller = RelayController()
+    servo = controller.MolassesDispenser
+    scale = Scale("/dev/ttyUSB0")
+    with controller.molasses_session():
+        table = servo.calibrate(lambda: scale.read_stable_grams(16), angles=(-75, -60, 0))
+    # The valve is open for its travel time on top of the window, hence the tolerance
+    for angle, rate in table[1:]:
+        assert rate == pytest.approx(FPJ_SIM.SimMachine.molasses_flow(angle), rel=0.15)
+    assert table[1][1] < 2.0  # Rounded reads would have seen 0 or 2 g/s here
+    assert ServoController().flow_table == table
@@ -0,0 +1,70 @@
+import pytest
+import FPJ_CLOCK
+import FPJ_SIM
+from FPJ_SIM import SimMachine
+
+
+@pytest.fixture
+def sim():
+    """A machine of its own, with a short slider track and no scale noise."""
+    return SimMachine(slider_steps_from_home=10, cover_travel_steps=5, noise=0.0)
+
+
+def pulse(sim: SimMachine, pin: int, steps: int, period: float = 0.001) -> None:
+    for _ in range(steps):
+        sim.pcf_limitswitch.write_pin(pin, True)
+        FPJ_CLOCK.sleep(period / 2)
+        sim.pcf_limitswitch.write_pin(pin, False)
+        FPJ_CLOCK.sleep(period / 2)
+
+
+def switch_closed(sim: SimMachine, pin: int) -> bool:
+    return not sim.pcf_limitswitch.read_pin(pin)
+
+
+def test_relays_pour_at_their_rates_while_on(sim):
+    sim.pcf_relay.write_pin(FPJ_SIM.NeemPin, False)
+    FPJ_CLOCK.sleep(5)
+    sim.pcf_relay.write_pin(FPJ_SIM.NeemPin, True)
+    FPJ_CLOCK.sleep(5)
+    assert sim.net_weight() == pytest.approx(5 * FPJ_SIM.RelayFlowRates[FPJ_SIM.NeemPin])
+    sim.tare()
+    assert sim.net_weight() == pytest.approx(0)
+
+
+def test_slider_reaches_its_home_switch_after_its_steps(sim):
+    sim.pcf_relay.write_pin(FPJ_SIM.StepperPowerPin, False)
+    sim.pcf_limitswitch.write_pin(FPJ_SIM.SliderDirectionPin, False)  # Toward home
+    pulse(sim, FPJ_SIM.SliderPulsePin, 9)
+    assert not switch_closed(sim, FPJ_SIM.SliderHomePin)
+    pulse(sim, FPJ_SIM.SliderPulsePin, 1)
+    assert switch_closed(sim, FPJ_SIM.SliderHomePin)
+    assert sim.steps["slider"] == 10
+
+
+def test_steps_are_lost_when_pulsed_too_fast_or_unpowered(sim):
+    pulse(sim, FPJ_SIM.SliderPulsePin, 3)  # Stepper supply off
+    assert sim.steps["slider"] == 0
+    sim.pcf_relay.write_pin(FPJ_SIM.StepperPowerPin, False)
+    pulse(sim, FPJ_SIM.SliderPulsePin, 4, period=sim.min_step_period["slider"] / 2)
+    assert sim.lost_steps["slider"] > 0
+    assert sim.steps["slider"] + sim.lost_steps["slider"] == 4
+
+
+def test_mixer_travels_between_its_switches(sim):
+    assert switch_closed(sim, FPJ_SIM.MixerUpSwitchPin)
+    sim.pcf_relay.write_pin(FPJ_SIM.MixerDownPin, False)
+    FPJ_CLOCK.sleep(sim.mixer_travel_time / 2)
+    assert not switch_closed(sim, FPJ_SIM.MixerUpSwitchPin)
+    assert not switch_closed(sim, FPJ_SIM.MixerDownSwitchPin)
+    FPJ_CLOCK.sleep(sim.mixer_travel_time / 2)
+    assert switch_closed(sim, FPJ_SIM.MixerDownSwitchPin)
+
+
+def test_molasses_flows_with_the_servo_angle_while_powered(sim):
+    sim.servo.angle = 0
+    FPJ_CLOCK.sleep(2)
+    assert sim.net_weight() == pytest.approx(0)  # Servo supply off
+    sim.pcf_relay.write_pin(FPJ_SIM.ServoPowerPin, False)
+    FPJ_CLOCK.sleep(2)
+    assert sim.net_weight() == pytest.approx(2 * SimMachine.molasses_flow(0))
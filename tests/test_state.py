@@ -0,0 +1,224 @@
+import copy
+from types import SimpleNamespace
+import pytest
+import FPJ_SIM
+from FPJ_STATE import BatchStateMachine, DISPENSING, FERMENTING, HOME, MIXER, MOVING, SEALER, SLIDER_ROUTE
+
+INGREDIENTS = [("KAKAWATE", "KakawateWeight", True), ("NEEM", "NeemWeight", True), ("WATER", "WaterWeight", False)]
+TARGET = 1000
+ROUTE_MOVES = {"to_mixer": ["to_mixer"], "to_sealer": ["to_mixer", "to_sealer"]}  # Moves from home to a location
+
+
+class FakeJson:
+    """The FpjJson calls BatchStateMachine makes, on a dict; every checkpoint is logged with a copy of the data."""
+
+    def __init__(self, log: list, data: dict = None) -> None:
+        self.log = log
+        self.data = copy.deepcopy(data) if data else {}
+
+    def get_batch_state(self) -> dict:
+        return copy.deepcopy(self.data.get("BatchState", {}))
+
+    def set_batch_state(self, state: dict) -> None:
+        self.data["BatchState"] = copy.deepcopy(state)
+        self.log.append(("checkpoint", copy.deepcopy(self.data)))
+
+    def is_already_fermenting(self) -> bool:
+        return self.data.get("IsFermenting", False)
+
+    def set_fermenting(self, status: bool) -> None:
+        self.data["IsFermenting"] = status
+
+    def get_mixing_status(self) -> bool:
+        return self.data.get("IsMixingDone", False)
+
+    def set_mixing_status(self, status: bool) -> None:
+        self.data["IsMixingDone"] = status
+
+    def get_weight(self, key: str) -> int:
+        return self.data.get(key, 0)
+
+    def set_weight(self, key: str, value: int) -> None:
+        self.data[key] = value
+
+    def reset_weights(self) -> None:
+        for _, key, _ in INGREDIENTS:
+            self.data[key] = 0
+
+
+class FakeMachine:
+    """Stands in for main: actuators only log what they do, the slider keeps its physical position."""
+
+    def __init__(self, data: dict = None, slider=None, tare_id: str = "session/1") -> None:
+        self.log: list = []
+        self.json = FakeJson(self.log, data)
+        self.position = slider
+        self.stepper = SimpleNamespace(
+            slider=SimpleNamespace(is_slider_at_home=lambda: self.position == HOME),
+            slider_homed=False,
+            slider_steps_from_home=None,
+            moveSliderToHome=self.home,
+            lift_cover=lambda: self.act("lift_cover"),
+        )
+        self.controller = SimpleNamespace(
+            mixer_up=lambda: self.act("mixer_up"),
+            turn_on_chopper=lambda: None,
+            turn_off_chopper=lambda: None,
+        )
+        self.scale = SimpleNamespace(tare_id=tare_id, reset_baseline=lambda: self.act("reset_baseline"))
+        self.LedIndicator = SimpleNamespace(turn_on=lambda: None, turn_off=lambda: None)
+        self.plan = SimpleNamespace(steps=[
+            SimpleNamespace(name=name, json_key=key, chopped=chopped) for name, key, chopped in INGREDIENTS
+        ])
+        self.status = SimpleNamespace(is_enough=lambda ingredient: self.json.get_weight(ingredient.json_key) >= TARGET)
+        self.dispensed: list = []  # (ingredient, tare) of every add_ingredient call
+
+    def act(self, name: str) -> None:
+        self.log.append(("action", name))
+
+    def home(self, force: bool = False) -> bool:
+        self.act("slider_home")
+        self.position = HOME
+        self.stepper.slider_homed = True
+        return True
+
+    def move_to_mixer(self) -> None:
+        self.act("to_mixer")
+        self.position = MIXER
+
+    def move_to_sealer(self) -> None:
+        self.act("to_sealer")
+        self.position = SEALER
+
+    def show_activity(self, activity: int) -> None:
+        pass
+
+    def display_ingredient_weight(self, ingredient, weight: int) -> None:
+        pass
+
+    def add_ingredient(self, ingredient, tare: bool = True, progress_func=None) -> None:
+        self.act(f"dispense_{ingredient.name}")
+        self.dispensed.append((ingredient.name, tare))
+        deficit = TARGET - self.json.get_weight(ingredient.json_key)
+        progress_func(deficit // 2, deficit)
+        self.json.set_weight(ingredient.json_key, TARGET)
+
+    def lower_mixer(self) -> None:
+        self.act("mixer_down")
+
+    def run_mixer(self) -> None:
+        self.act("mixing")
+
+    def raise_mixer(self) -> None:
+        self.act("mixer_up")
+
+    def seal_container(self) -> None:
+        self.act("seal")
+
+    def run(self, together=None) -> list:
+        machine = BatchStateMachine(self) if together is None else BatchStateMachine(self, together=together)
+        machine.run()
+        return [name for kind, name in self.log if kind == "action"]
+
+
+def fresh_batch() -> FakeMachine:
+    batch = FakeMachine()
+    batch.run()
+    return batch
+
+
+def checkpoints(log: list):
+    """Every checkpoint with the actions a batch still made after it."""
+    for index, (kind, data) in enumerate(log):
+        if kind == "checkpoint":
+            yield data, [name for kind, name in log[index + 1:] if kind == "action"]
+
+
+def test_fresh_batch_runs_every_step_once():
+    assert [name for kind, name in fresh_batch().log if kind == "action"] == [
+        "reset_baseline", "mixer_up", "lift_cover", "slider_home",
+        "dispense_KAKAWATE", "dispense_NEEM", "dispense_WATER",
+        "to_mixer", "mixer_down", "mixing", "mixer_up", "lift_cover",
+        "lift_cover", "to_sealer", "seal",
+    ]
+
+
+# Mid-ingredient checkpoints are covered below
+BETWEEN_STEPS = [
+    (data, remaining) for data, remaining in checkpoints(fresh_batch().log) if not data["BatchState"]["ingredient"]
+]
+
+
+@pytest.mark.parametrize(
+    "data, remaining",
+    BETWEEN_STEPS,
+    ids=[f"{data['BatchState']['phase']}-{data['BatchState']['slider']}" for data, _ in BETWEEN_STEPS],
+)
+def test_resume_from_every_checkpoint(data, remaining):
+    state = data["BatchState"]
+    slider = state["slider"] if state["slider"] in SLIDER_ROUTE else None
+
+    batch = FakeMachine(data, slider)
+    actions = batch.run()
+    if state["slider"] == MOVING and remaining[0] != "slider_home":
+        # Stopped mid-move: the slider is homed and goes along the route again
+        remaining = ["slider_home"] + ROUTE_MOVES[remaining[0]] + remaining[1:]
+    assert actions == remaining
+    assert batch.json.data["BatchState"]["phase"] == FERMENTING
+
+
+def mid_ingredient(tare_id: str) -> FakeMachine:
+    data = next(
+        data for data, _ in checkpoints(fresh_batch().log)
+        if data["BatchState"]["ingredient"] == "NEEM"
+    )
+    assert data["BatchState"]["dispensed"] == TARGET // 2
+    return FakeMachine(data, HOME, tare_id)
+
+
+def test_resume_mid_ingredient_on_the_same_zero():
+    batch = mid_ingredient("session/1")
+    batch.run()
+    assert batch.dispensed[0] == ("NEEM", False)  # Continued without a tare
+    assert batch.json.get_weight("NeemWeight") == TARGET
+
+
+def test_resume_mid_ingredient_after_the_scale_reopened():
+    batch = mid_ingredient("other-session/1")
+    batch.run()
+    assert batch.dispensed[0] == ("NEEM", True)  # New zero
+    booked = next(
+        data for kind, data in batch.log
+        if kind == "checkpoint" and data["BatchState"]["phase"] == DISPENSING
+    )
+    assert booked["NeemWeight"] == TARGET // 2  # Grams already in the container were booked first
+
+
+def test_independent_steps_go_through_together():
+    groups = []
+
+    def together(actions):
+        groups.append(len(actions))
+        for action in actions:
+            action()
+
+    FakeMachine().run(together)
+    assert groups == [2, 2]
+
+
+def test_dispensing_progress_is_each_changed_settled_read(main, machine):
+    water = main.plan.step("WATER")
+    progress = []
+
+    def checkpoint(weight, deficit):
+        assert not machine.relay_on(FPJ_SIM.WaterPumpPin)  # Never mid-pulse
+        progress.append(weight)
+
+    weights = {}
+    main.add_ingredient(
+        water, lambda: 0, lambda weight: weights.update(final=weight), progress_func=checkpoint
+    )
+    assert progress[0] <= 10  # The zeroed container, rounded up
+    assert all(a != b for a, b in zip(progress, progress[1:]))
+    assert progress[-1] >= water.target - water.tolerance  # The read that ended it is booked too
+    assert progress[-1] <= weights["final"] + 10
@@ -0,0 +1,81 @@
+import math
+import pytest
+import FPJ_CLOCK
+import FPJ_PCF
+import FPJ_STEPWORKER
+from FPJ_LIMITSWITCH import CoverUpperLimitSwitchPin
+from FPJ_STEPPER import SealerDirectionPin, SealerPulsePin, StepperController, limit_status
+
+
+@pytest.fixture
+def sealer(machine, monkeypatch):
+    """The sealer stepper moving inline (no pulse worker), its cover down and no steps lost yet."""
+    monkeypatch.setattr(FPJ_STEPWORKER, "get_worker", lambda: None)
+    with machine.lock:
+        machine.cover_position = 0
+        machine.lost_steps["sealer"] = 0
+    stepper = StepperController(SealerPulsePin, SealerDirectionPin, 0.001, check_interval=5, approach_steps=50)
+    yield stepper
+    stepper.disable()
+
+
+def lift(stepper: StepperController, expected_steps=None) -> bool:
+    return stepper.move_stepper_to_destination(
+        direction=True, max_step=1000, destination_func=limit_status.is_cover_up, expected_steps=expected_steps
+    )
+
+
+# === Batched limit-switch checks ===
+def test_switch_is_checked_every_check_interval_steps(sealer, machine):
+    sealer.burst = False
+    reads = machine.pcf_limitswitch.reads
+    assert lift(sealer)
+    travel = machine.cover_travel_steps
+    assert travel <= sealer.last_steps < travel + sealer.check_interval
+    assert machine.pcf_limitswitch.reads - reads == sealer.last_steps // sealer.check_interval + 1
+
+
+def test_approach_checks_every_step_where_the_switch_is_expected(sealer, machine):
+    sealer.burst = False
+    assert lift(sealer, expected_steps=machine.cover_travel_steps)
+    assert sealer.last_steps == machine.cover_travel_steps
+    assert machine.lost_steps["sealer"] == 0
+
+
+# === Burst pulse trains ===
+def test_pulses_go_out_as_bursts_timed_by_the_bus(sealer, machine):
+    sealer.burst = True
+    sealer.enable()
+    writes, start = machine.pcf_limitswitch.writes, FPJ_CLOCK.monotonic()
+    sealer.move_stepper(direction=True, step=300)
+    assert machine.cover_position == 300
+    assert machine.lost_steps["sealer"] == 0
+    per_burst = FPJ_PCF.pcf_limitswitch.burst_steps(sealer.pulse_interval)
+    chunks = [FPJ_STEPWORKER.BURST_STEPS] * (300 // FPJ_STEPWORKER.BURST_STEPS) + [300 % FPJ_STEPWORKER.BURST_STEPS]
+    bursts = sum(math.ceil(chunk / per_burst) for chunk in chunks)  # Split again at every abort check
+    assert machine.pcf_limitswitch.writes - writes == bursts + 1  # And the direction pin
+    step_time = 2 * FPJ_PCF.burst_words(sealer.pulse_interval) * FPJ_PCF.WORD_TIME
+    assert step_time >= 2 * sealer.pulse_interval
+    assert FPJ_CLOCK.monotonic() - start == pytest.approx(300 * step_time)
+
+
+def test_burst_destination_move_checks_between_trains(sealer, machine):
+    sealer.burst = True
+    reads = machine.pcf_limitswitch.reads
+    assert lift(sealer)
+    assert machine.cover_travel_steps <= sealer.last_steps < machine.cover_travel_steps + sealer.check_interval
+    assert machine.pcf_limitswitch.reads - reads == sealer.last_steps // sealer.check_interval + 1
+
+
+# === Combined pulse and switch transactions ===
+def test_switch_is_read_back_with_each_pulse_train(sealer, machine):
+    sealer.burst = True
+    assert FPJ_PCF.pcf_limitswitch.exchange_capable
+    reads, exchanges = machine.pcf_limitswitch.reads, machine.pcf_limitswitch.exchanges
+    assert sealer.move_stepper_to_destination(
+        direction=True, max_step=1000, destination_func=limit_status.is_cover_up, switch_pin=CoverUpperLimitSwitchPin
+    )
+    assert machine.pcf_limitswitch.reads == reads
+    assert machine.pcf_limitswitch.exchanges - exchanges == sealer.last_steps // sealer.check_interval + 1
+    assert machine.cover_travel_steps <= sealer.last_steps < machine.cover_travel_steps + sealer.check_interval
+    assert machine.lost_steps["sealer"] == 0
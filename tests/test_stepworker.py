@@ -0,0 +1,67 @@
+import struct
+import pytest
+import FPJ_PCF
+import FPJ_SIM
+from FPJ_STEPWORKER import RingBuffer, StepperWorker
+
+
+@pytest.fixture
+def worker(machine):
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.StepperPowerPin, False)
+    worker = StepperWorker("thread")
+    yield worker
+    worker.close()
+    FPJ_PCF.pcf_relay.write_pin(FPJ_SIM.StepperPowerPin, True)
+
+
+def lower_cover(machine) -> None:
+    with machine.lock:
+        machine.cover_position = 0
+
+
+def test_ring_buffer_is_first_in_first_out_and_bounded():
+    ring = RingBuffer(memoryview(bytearray(RingBuffer.size(struct.Struct("<I"), 2))), struct.Struct("<I"), 2)
+    assert ring.pop() is None
+    assert ring.push(1) and ring.push(2)
+    assert not ring.push(3)  # Full
+    assert ring.pop() == (1,)
+    assert ring.push(3)
+    assert [ring.pop(), ring.pop(), ring.pop()] == [(2,), (3,), None]
+
+
+def test_move_makes_every_step(worker, machine):
+    lower_cover(machine)
+    steps = machine.steps["sealer"]
+    report = worker.move(FPJ_SIM.SealerPulsePin, FPJ_SIM.SealerDirectionPin, True, 100, 0.001)
+    assert (report["result"], report["steps"]) == ("done", 100)
+    assert machine.steps["sealer"] - steps == 100
+    assert machine.cover_position == 100
+    assert worker.position(FPJ_SIM.SealerPulsePin) == 100
+
+
+@pytest.mark.parametrize("burst", [False, True], ids=["edges", "burst"])
+def test_move_stops_at_the_limit_switch(worker, machine, burst):
+    lower_cover(machine)
+    report = worker.move(
+        FPJ_SIM.SealerPulsePin, FPJ_SIM.SealerDirectionPin, True, 1000, 0.001,
+        switch_pin=FPJ_SIM.CoverUpPin, check_interval=5, fast_steps=350, approach_half_period=0.002, burst=burst,
+    )
+    assert report["result"] == "reached"
+    assert report["steps"] == machine.cover_travel_steps  # Checked before every step on the approach
+    assert worker.progress() == {"seq": report["seq"], "steps": report["steps"]}
+
+
+def test_moves_report_in_submission_order(worker, machine):
+    lower_cover(machine)
+    first = worker.submit(FPJ_SIM.SealerPulsePin, FPJ_SIM.SealerDirectionPin, True, 10, 0.001)
+    second = worker.submit(FPJ_SIM.SealerPulsePin, FPJ_SIM.SealerDirectionPin, False, 4, 0.001)
+    assert worker.wait(second)["steps"] == 4
+    assert worker.wait(first)["steps"] == 10
+    assert machine.cover_position == 6
+
+
+def test_process_mode_needs_the_real_expanders():
+    # A forked worker would pulse its own copy of the simulated machine
+    with pytest.raises(ValueError):
+        StepperWorker("process")
+
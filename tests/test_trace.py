@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import pytest
+import FPJ_CLOCK
+import FPJ_SIM
+from FPJ_SIM import SimMachine
+from FPJ_TRACE import PIN_READ, PIN_WRITE, TraceExhausted, TracePlayer, TracedPcf, TraceRecorder, read_trace
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A dose of neem, weighed; run as a script against the simulator, then replayed
+DOSE_SCRIPT = '''
+import os
+import FPJ_TRACE
+from FPJ_RELAY import RelayController
+from FPJ_SCALE import Scale
+
+if __name__ == "__main__":
+    controller = RelayController()
+    scale = Scale("/dev/ttyUSB0")
+    scale.zero()
+    controller.dispense_neem(float(os.environ.get("FPJ_DOSE", "2")))
+    print(f"WEIGHED {scale.get_weight()}")
+    scale.close()
+    FPJ_TRACE.close()
+'''
+
+
+def test_recorded_pins_replay_in_order(tmp_path):
+    path = str(tmp_path / "pins.trace")
+    recorder = TraceRecorder(path)
+    pcf = TracedPcf(SimMachine().pcf_limitswitch, 0x20, recorder)
+    pcf.write_pin(FPJ_SIM.SliderDirectionPin, False)
+    FPJ_CLOCK.sleep(0.5)
+    home = pcf.read_pin(FPJ_SIM.SliderHomePin)
+    recorder.close()
+
+    records = read_trace(path)
+    assert [(kind, value) for _, kind, _, value, _ in records] == [
+        (PIN_WRITE, FPJ_SIM.SliderDirectionPin << 1), (PIN_READ, FPJ_SIM.SliderHomePin << 1 | home)
+    ]
+    assert records[1][0] - records[0][0] == pytest.approx(0.5)
+
+    player = TracePlayer(path)
+    replayed = player.pcf(0x20)
+    replayed.write_pin(FPJ_SIM.SliderDirectionPin, True)  # Not what was recorded
+    assert replayed.read_pin(FPJ_SIM.SliderHomePin) == home
+    with pytest.raises(TraceExhausted):
+        replayed.read_pin(FPJ_SIM.SliderHomePin)
+    assert player.matched == 0
+    assert len(player.mismatches) == 1
+
+
+def run_dose(tmp_path, seconds: float, **env) -> subprocess.CompletedProcess:
+    (tmp_path / "fpj_dose.py").write_text(DOSE_SCRIPT)
+    environ = {key: value for key, value in os.environ.items() if key not in ("FPJ_TRACE", "FPJ_REPLAY")}
+    environ.update(PYTHONPATH=os.pathsep.join([REPO, str(tmp_path)]), FPJ_DOSE=str(seconds), **env)
+    replay = "FPJ_REPLAY" in env
+    command = (
+        ["-c", f"import FPJ_TRACE, sys; r = FPJ_TRACE.replay({env['FPJ_REPLAY']!r}, 'fpj_dose'); "
+               "sys.exit(0 if r['mismatches'] == 0 and r['missing_outputs'] == 0 else 1)"]
+        if replay else ["fpj_dose.py"]
+    )
+    return subprocess.run(
+        [sys.executable] + command, cwd=tmp_path, env=environ, capture_output=True, text=True, timeout=120
+    )
+
+
+def test_a_recorded_run_replays_without_hardware(tmp_path):
+    trace = str(tmp_path / "dose.trace")
+    recorded = run_dose(tmp_path, 2, FPJ_TRACE=trace)
+    assert recorded.returncode == 0, recorded.stderr
+    weighed = [line for line in recorded.stdout.splitlines() if line.startswith("WEIGHED")]
+
+    replayed = run_dose(tmp_path, 2, FPJ_REPLAY=trace, FPJ_BACKEND="hardware")
+    assert replayed.returncode == 0, replayed.stdout + replayed.stderr
+    assert [line for line in replayed.stdout.splitlines() if line.startswith("WEIGHED")] == weighed
+    assert "[REPLAY] max_drift: 0.0" in replayed.stdout
+
+    slower = run_dose(tmp_path, 3, FPJ_REPLAY=trace, FPJ_BACKEND="hardware")
+    assert "[REPLAY] max_drift: 1.0" in slower.stdout  # The relay switches off a second late